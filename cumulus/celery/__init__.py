@@ -77,6 +77,9 @@ _routes = {
     'cumulus.tasks.job.monitor_jobs': {
         'queue': 'monitor'
     },
+    'cumulus.tasks.job.job_complete': {
+        'queue': 'monitor'
+    },
     'cumulus.tasks.job.monitor_process': {
         'queue': 'monitor'
     },
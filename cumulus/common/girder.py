@@ -29,16 +29,17 @@ import cumulus
 from cumulus.constants import ClusterType
 
 
-def get_task_token(cluster=None):
+def get_task_token(cluster=None, user=None):
     """
     Gets a Girder token to use to access Girder while running a task. By default
     we create a token using the cumulus girder user ( this user has certain
     privileges, such as access to passphrases that a regular user doesn't have).
     However, in the case of a NEWT cluster we need the token to be associated
-    with the logged in user as this is used to look up the NEWT session ID.
+    with the logged in user, or user if there isn't one, as this is used to
+    look up the NEWT session ID.
     """
     if cluster and cluster['type'] == ClusterType.NEWT:
-        user = getCurrentUser()
+        user = user or getCurrentUser()
     else:
         user = ModelImporter.model('user') \
             .find({'login': cumulus.config.girder.user})
@@ -32,6 +32,63 @@ import re
 
 max_chunk_size = 1024 * 1024 * 64
 
+# How often, in seconds, a checkpoint is written while a transfer runs
+checkpoint_interval = 5
+
+
+class Checkpoint(object):
+    """
+    Records the progress of a transfer in a local file, so if the transfer is
+    interrupted running it again picks up where it left off.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._last_save = time.time()
+        self._dirty = False
+        self.entries = {}
+
+        try:
+            with open(path) as fp:
+                self.entries = json.load(fp)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def completed(self, key, state=None):
+        entry = self.entries.get(key)
+        if entry is None or not entry.get('done'):
+            return False
+
+        return state is None or \
+            all(entry.get(k) == v for (k, v) in state.items())
+
+    def update(self, key, entry, save=False):
+        self.entries[key] = entry
+        self._dirty = True
+        if save or time.time() - self._last_save >= checkpoint_interval:
+            self.save()
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        # Write and rename so an interruption can't leave a partial file
+        temp_path = '%s.tmp' % self._path
+        with open(temp_path, 'w') as fp:
+            json.dump(self.entries, fp)
+        os.rename(temp_path, self._path)
+        self._dirty = False
+        self._last_save = time.time()
+
+    def clear(self):
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
 
 class GirderBase(object):
 
@@ -52,6 +109,7 @@ class DirectoryUploader(GirderBase):
         self._dir = dir
         self._base_url = base_url
         self._job_id = job_id
+        self._checkpoint = Checkpoint('.girderclient-upload-%s.json' % job_id)
         super(DirectoryUploader, self).__init__(girder_token)
 
     def run(self):
@@ -64,14 +122,19 @@ class DirectoryUploader(GirderBase):
 
         start = time.time()
 
-        for i in job['output']:
-
-            if 'itemId' in i and 'path' in i:
-                item_id = i['itemId']
-                path_spec = i['path']
-                exclude_regex = i.get('exclude', None)
-                self._upload(item_id, path_spec, exclude_regex=exclude_regex)
-
+        try:
+            for i in job['output']:
+
+                if 'itemId' in i and 'path' in i:
+                    item_id = i['itemId']
+                    path_spec = i['path']
+                    exclude_regex = i.get('exclude', None)
+                    self._upload(item_id, path_spec,
+                                 exclude_regex=exclude_regex)
+        finally:
+            self._checkpoint.save()
+
+        self._checkpoint.clear()
         end = time.time()
 
         upload_time = end - start
@@ -85,8 +148,28 @@ class DirectoryUploader(GirderBase):
         r = requests.patch(job_url, json=updates, headers=self._headers)
         self.check_status(r)
 
+    def _upload_offset(self, upload_id):
+        """
+        Returns the offset Girder has received an upload up to, or None if
+        the upload no longer exists.
+        """
+        r = requests.get('%s/file/offset' % self._base_url,
+                         params={'uploadId': upload_id}, headers=self._headers)
+        if r.status_code != 200:
+            return None
+
+        return r.json()['offset']
+
     def _upload_file(self, name, path, parent_id):
         datalen = os.path.getsize(path)
+        key = '%s:%s' % (parent_id, path)
+        state = {
+            'size': datalen,
+            'mtime': os.path.getmtime(path)
+        }
+
+        if self._checkpoint.completed(key, state):
+            return
 
         params = {
             'parentType': 'item',
@@ -95,19 +178,35 @@ class DirectoryUploader(GirderBase):
             'size': datalen
         }
 
-        r = requests.post(
-            '%s/file' % self._base_url, params=params, headers=self._headers)
-        self.check_status(r)
-        obj = r.json()
+        # Continue the upload started by a previous run
+        upload_id = None
+        uploaded = 0
+        previous = self._checkpoint.get(key)
+        if previous and 'uploadId' in previous and \
+                all(previous.get(k) == v for (k, v) in state.items()):
+            uploaded = self._upload_offset(previous['uploadId'])
+            if uploaded is not None:
+                upload_id = previous['uploadId']
+            else:
+                uploaded = 0
 
-        if '_id' in obj:
-            upload_id = obj['_id']
-        else:
-            raise Exception('Unexpected response: ' + json.dumps(obj))
+        if upload_id is None:
+            r = requests.post(
+                '%s/file' % self._base_url, params=params,
+                headers=self._headers)
+            self.check_status(r)
+            obj = r.json()
 
-        uploaded = 0
+            if '_id' in obj:
+                upload_id = obj['_id']
+            else:
+                raise Exception('Unexpected response: ' + json.dumps(obj))
+
+            self._checkpoint.update(key, dict(state, uploadId=upload_id),
+                                    save=True)
 
         with open(path, 'rb') as fp:
+            fp.seek(uploaded)
             while (uploaded != datalen):
 
                 chunk_size = datalen - uploaded
@@ -127,6 +226,8 @@ class DirectoryUploader(GirderBase):
 
                 uploaded += chunk_size
 
+        self._checkpoint.update(key, dict(state, done=True))
+
     def _upload(self, parent_id, path, exclude_regex=None):
         if os.path.isdir(path):
             for root, _, file_list in os.walk(path):
@@ -152,6 +253,8 @@ class JobInputDownloader(GirderBase):
         self._base_url = base_url
         self._job_id = job_id
         self._dest = dest
+        self._checkpoint = Checkpoint(
+            os.path.join(dest, '.girderclient-download-%s.json' % job_id))
         super(JobInputDownloader, self).__init__(girder_token)
 
     def _mkdir(self, path):
@@ -163,7 +266,34 @@ class JobInputDownloader(GirderBase):
             else:
                 raise
 
+    def _download_file(self, item_id, dest_path):
+        """
+        Download a single file item to dest_path, the data is written to a
+        partial file first so an interrupted download can be continued.
+        """
+        partial_path = '%s.part' % dest_path
+        self._mkdir(os.path.dirname(dest_path))
+
+        offset = 0
+        if os.path.exists(partial_path):
+            offset = os.path.getsize(partial_path)
+
+        item_url = '%s/item/%s/download' % (self._base_url, item_id)
+        r = requests.get(item_url, params={'offset': offset},
+                         headers=self._headers, stream=True)
+        self.check_status(r)
+
+        with open(partial_path, 'ab' if offset else 'wb') as fp:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                if chunk:
+                    fp.write(chunk)
+
+        os.rename(partial_path, dest_path)
+
     def _download_item(self, item_id, target_path):
+        key = '%s:%s' % (item_id, target_path)
+        if self._checkpoint.completed(key):
+            return
 
         item_files_url = '%s/item/%s/files' % (self._base_url, item_id)
         r = requests.get(item_files_url, headers=self._headers)
@@ -172,14 +302,8 @@ class JobInputDownloader(GirderBase):
         files = r.json()
 
         if len(files) == 1:
-            item_url = '%s/item/%s/download' % (self._base_url, item_id)
-            r = requests.get(item_url, headers=self._headers)
-            self.check_status(r)
             dest_path = os.path.join(self._dest, target_path, files[0]['name'])
-
-            self._mkdir(os.path.dirname(dest_path))
-            with open(dest_path, 'w') as fp:
-                fp.write(r.content)
+            self._download_file(item_id, dest_path)
         elif len(files) > 1:
             # Download the item in zip format
             item_url = '%s/item/%s/download' % (self._base_url, item_id)
@@ -220,6 +344,8 @@ class JobInputDownloader(GirderBase):
                         if os.path.exists(temp_dir):
                             shutil.rmtree(temp_dir)
 
+        self._checkpoint.update(key, {'done': True})
+
     def run(self):
         job_url = '%s/jobs/%s' % (self._base_url, self._job_id)
 
@@ -230,11 +356,16 @@ class JobInputDownloader(GirderBase):
 
         start = time.time()
 
-        for i in job['input']:
-            item_id = i['itemId']
-            target_path = i['path']
-            self._download_item(item_id, target_path)
+        self._mkdir(self._dest)
+        try:
+            for i in job['input']:
+                item_id = i['itemId']
+                target_path = i['path']
+                self._download_item(item_id, target_path)
+        finally:
+            self._checkpoint.save()
 
+        self._checkpoint.clear()
         end = time.time()
 
         download_time = end - start
@@ -23,6 +23,8 @@ from . import sge
 from . import pbs
 from . import slurm
 from . import newt
+from . import snapshot
+from . import metadata
 from cumulus.constants import QueueType
 from cumulus.constants import ClusterType
 type_to_adapter = {
@@ -33,7 +35,13 @@ type_to_adapter = {
 }
 
 
-def get_queue_adapter(cluster, cluster_connection=None):
+def get_queue_adapter(cluster, cluster_connection=None, girder_token=None):
+    """
+    Returns the adapter for the cluster's queueing system. If girder_token is
+    provided job statuses are served from the queue snapshot shared through
+    Girder, rather than querying the scheduler on each call, and scheduler
+    metadata is cached by Girder.
+    """
     global type_to_adapter
 
     # Special case for nersc clusters. They use SLURM ( at the moment ) but the
@@ -54,7 +62,17 @@ def get_queue_adapter(cluster, cluster_connection=None):
     else:
         cls = type_to_adapter[system]
 
-    return cls(cluster, cluster_connection)
+    queue_snapshot = None
+    if girder_token is not None and snapshot.snapshot_enabled():
+        queue_snapshot = snapshot.QueueSnapshot(cluster['_id'], girder_token)
+
+    scheduler_metadata = None
+    if girder_token is not None and metadata.metadata_cache_enabled():
+        scheduler_metadata = metadata.SchedulerMetadata(cluster['_id'],
+                                                        girder_token)
+
+    return cls(cluster, cluster_connection, queue_snapshot,
+               scheduler_metadata)
 
 
 def is_valid_type(type):
@@ -17,19 +17,245 @@
 #  limitations under the License.
 ###############################################################################
 
+import re
+
+from cumulus.common.jsonpath import get_property
+from cumulus.transport.batch import check_results, quote
+
+# Matches the complaint of a scheduler command that doesn't support the option
+# used to request structured output.
+UNSUPPORTED_OPTION_PATTERN = re.compile(
+    r'invalid option|unrecognized option|illegal option|usage:', re.I)
+
+# Matches the complaint of a scheduler command asked about jobs that have left
+# the queue.
+UNKNOWN_JOB_PATTERN = re.compile(r'unknown job id|invalid job id', re.I)
+
+# The longest command line used to terminate jobs, the job ids are split
+# across several invocations, run in a single batch, rather than exceed it.
+MAX_TERMINATE_COMMAND_LENGTH = 32 * 1024
+
+# The clusters whose scheduler has been found not to support structured
+# output, these are queried using the table parsers.
+_structured_unsupported = set()
+
+
+class QueueQueryError(Exception):
+    """
+    Raised when the scheduler couldn't be queried, the state of the jobs is
+    unknown rather than them having left the queue.
+    """
+    pass
+
+
+def structured_output_enabled(cluster):
+    """
+    Structured output can be turned off for a cluster by setting
+    config.scheduler.structuredOutput to false.
+    """
+    return bool(get_property('config.scheduler.structuredOutput', cluster,
+                             default=True))
+
 
 class AbstractQueueAdapter(object):
     QUEUE_JOB_ID = 'queueJobId'
 
-    def __init__(self, cluster, cluster_connection):
+    # The scheduler command that terminates the jobs given as arguments
+    TERMINATE_COMMAND = None
+
+    def __init__(self, cluster, cluster_connection, snapshot=None,
+                 metadata=None):
         self._cluster = cluster
         self._cluster_connection = cluster_connection
+        self._snapshot = snapshot
+        self._metadata = metadata
+
+    def _cached(self, key, fetch):
+        """
+        Returns scheduler metadata, from the cache if there is one.
+        """
+        if self._metadata is None:
+            return fetch()
+
+        return self._metadata.get(key, fetch)
 
-    def submit_job(self, job, job_script):
+    def queues(self):
+        """
+        Returns the queues ( partitions on SLURM ) of the scheduler, a dict
+        for each holding its name and, where the scheduler reports them, its
+        limits.
+        """
+        return self._cached('queues', self._queues)
+
+    def _queues(self):
+        raise NotImplementedError('Subclasses should implement this')
+
+    def scheduler_metadata(self):
+        """
+        Returns all the metadata about the scheduler that is cached.
+        """
+        return {
+            'queues': self.queues()
+        }
+
+    def submit_job(self, job, job_script, pre_commands=None):
+        raise NotImplementedError('Subclasses should implement this')
+
+    def _execute_submit(self, command, pre_commands=None):
+        """
+        Run the submit command, any pre_commands ( staging the job script for
+        example ) are run first as part of the same remote invocation.
+        Returns the output of the submit command.
+        """
+        if not pre_commands:
+            return self._cluster_connection.execute(command)
+
+        results = self._cluster_connection.execute_many(
+            list(pre_commands) + [command], stop_on_error=True)
+        check_results(results)
+
+        return results[-1].stdout
+
+    def submit_array(self, job, job_script, size, pre_commands=None):
+        """
+        Submit a job script that declares an array of size elements ( see the
+        scheduler templates ) as a single submission. Returns the queue job id
+        of each element, in order, these are tracked like any other job.
+        """
+        queue_job_id = self.submit_job(job, job_script, pre_commands)
+
+        return [self._array_element_id(queue_job_id, index)
+                for index in range(size)]
+
+    def _array_element_id(self, queue_job_id, index):
         raise NotImplementedError('Subclasses should implement this')
 
     def terminate_job(self, job):
         raise NotImplementedError('Subclasses should implement this')
 
-    def job_statuses(self, jobs):
+    def terminate_jobs(self, jobs):
+        """
+        Terminate jobs using as few scheduler invocations as the command line
+        length allows, all run in a single batch. Returns the CommandResult of
+        each invocation. As with terminate_job a job that has already left the
+        queue isn't treated as an error.
+        """
+        return self._cluster_connection.execute_many(self._terminate_commands(
+            [str(job[AbstractQueueAdapter.QUEUE_JOB_ID]) for job in jobs]))
+
+    def _terminate_commands(self, queue_job_ids):
+        if self.TERMINATE_COMMAND is None:
+            raise NotImplementedError('Subclasses should implement this')
+
+        commands = []
+        command = None
+        for queue_job_id in queue_job_ids:
+            arg = quote(queue_job_id)
+            if command is not None and \
+                    len(command) + len(arg) < MAX_TERMINATE_COMMAND_LENGTH:
+                command += ' ' + arg
+            else:
+                if command is not None:
+                    commands.append(command)
+                command = '%s %s' % (self.TERMINATE_COMMAND, arg)
+
+        if command is not None:
+            commands.append(command)
+
+        return commands
+
+    def queue_states(self, jobs=None):
+        """
+        Query the scheduler, returns a dict mapping queue job id to a dict
+        holding the scheduler's own state for the job and, when the scheduler
+        provides structured output, the nodes, startTime and reason. If jobs
+        is None every job the scheduler reports is returned, this is what is
+        kept in the shared snapshot.
+        """
+        cluster_id = self._cluster.get('_id')
+        command = None
+        if structured_output_enabled(self._cluster) and \
+                cluster_id not in _structured_unsupported:
+            command = self._structured_command(jobs)
+
+        if command is not None:
+            try:
+                states = self._structured_states(command)
+            except ValueError:
+                # Truncated or interleaved output, the scheduler does support
+                # structured output so only this query falls back to the table.
+                return self._table_states(jobs)
+
+            if states is not None:
+                return states
+
+            if cluster_id is not None:
+                _structured_unsupported.add(cluster_id)
+
+        return self._table_states(jobs)
+
+    def _structured_command(self, jobs):
+        """
+        Returns the command producing machine readable output, or None if the
+        scheduler only has table output.
+        """
+        return None
+
+    def _structured_states(self, command):
+        """
+        Returns the parsed structured output, or None if the scheduler doesn't
+        support it. Raises ValueError if the output can't be parsed and
+        QueueQueryError if the command failed.
+        """
+        [result] = self._cluster_connection.execute_many([command])
+        if result.exit_code != 0:
+            if any(UNSUPPORTED_OPTION_PATTERN.search(line)
+                   for line in result.stderr):
+                return None
+
+            # Asking about jobs that have left the queue makes the command
+            # fail, anything else means the queue is unknown.
+            errors = [line for line in result.stderr if line.strip()]
+            if not errors or not all(UNKNOWN_JOB_PATTERN.search(line)
+                                     for line in errors):
+                raise QueueQueryError(
+                    'Unable to query the scheduler ( exit code %d ): %s'
+                    % (result.exit_code, '\n'.join(result.stderr)))
+
+        output = '\n'.join(result.stdout)
+        if not output.strip():
+            return {}
+
+        return self._parse_structured(output)
+
+    def _parse_structured(self, output):
+        raise NotImplementedError('Subclasses should implement this')
+
+    def _table_states(self, jobs):
+        raise NotImplementedError('Subclasses should implement this')
+
+    def to_job_queue_state(self, state):
         raise NotImplementedError('Subclasses should implement this')
+
+    def job_details(self, jobs):
+        """
+        Returns a (job, details) tuple for each job, details holds the job's
+        queue state and any of nodes, startTime and reason the scheduler
+        reported.
+        """
+        if self._snapshot is not None:
+            states = self._snapshot.states(jobs, self.queue_states)
+        else:
+            states = self.queue_states(jobs)
+
+        details = []
+        for job in jobs:
+            info = dict(states.get(str(job[AbstractQueueAdapter.QUEUE_JOB_ID]))
+                        or {})
+            info['state'] = self.to_job_queue_state(info.get('state'))
+            details.append((job, info))
+
+        return details
+
+    def job_statuses(self, jobs):
+        return [(job, info['state']) for (job, info) in self.job_details(jobs)]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import requests
+
+import cumulus
+from cumulus.common import check_status
+from cumulus.common.jsonpath import get_property
+
+# How long, in seconds, scheduler metadata is cached before the scheduler is
+# asked again. This can be overridden by queue.metadata.ttl in the config.
+METADATA_TTL = 3600
+
+
+def metadata_cache_enabled():
+    return bool(get_property('queue.metadata.enabled', cumulus.config,
+                             default=True))
+
+
+class SchedulerMetadata(object):
+    """
+    Metadata about the scheduler of a cluster, the slots of each parallel
+    environment and the queues with their limits for example, cached by
+    Girder. These rarely change, so the scheduler is asked once per TTL per
+    cluster rather than on every submission.
+    """
+    def __init__(self, cluster_id, girder_token):
+        self._url = '%s/clusters/%s/scheduler' % (
+            cumulus.config.girder.baseUrl, cluster_id)
+        self._headers = {'Girder-Token': girder_token}
+        self._ttl = get_property('queue.metadata.ttl', cumulus.config,
+                                 default=METADATA_TTL)
+
+    def get(self, key, fetch):
+        """
+        Returns the cached value of key, if there isn't one younger than the
+        TTL fetch is called to get it from the scheduler and the result is
+        cached.
+        """
+        r = requests.get(self._url, headers=self._headers, params={
+            'key': key,
+            'maxAge': self._ttl
+        })
+        check_status(r)
+        cached = r.json()
+        if key in cached:
+            return cached[key]
+
+        value = fetch()
+        r = requests.put(self._url, headers=self._headers, json={key: value})
+        check_status(r)
+
+        return value
@@ -20,19 +20,19 @@
 import os
 
 from jsonpath_rw import parse
-import requests
 
-from cumulus.queue.slurm import SlurmQueueAdapter, AbstractQueueAdapter
+from cumulus.queue.slurm import SlurmQueueAdapter
 from cumulus.common import check_status
 from cumulus.transport.newt import NEWT_BASE_URL
+from cumulus.transport.batch import check_results
 
 
 class NewtQueueAdapter(SlurmQueueAdapter):
-    def __init__(self, cluster, cluster_connection):
-        super(NewtQueueAdapter, self).__init__(cluster, cluster_connection)
-        self._session = requests.Session()
-        self._session.cookies.set('newt_sessionid',
-                                  cluster_connection.session_id)
+    def __init__(self, cluster, cluster_connection, snapshot=None,
+                 metadata=None):
+        super(NewtQueueAdapter, self).__init__(cluster, cluster_connection,
+                                               snapshot, metadata)
+        self._session = cluster_connection.session
         self._machine = parse('config.host').find(cluster)[0].value
 
     def terminate_job(self, job):
@@ -45,7 +45,13 @@ class NewtQueueAdapter(SlurmQueueAdapter):
         if json_response['status'] != 'OK' or json_response['error']:
             raise Exception(json_response['error'])
 
-    def submit_job(self, job, job_script):
+    def submit_job(self, job, job_script, pre_commands=None):
+        # Submission goes through the NEWT queue API, so any pre_commands are
+        # run in a single batch beforehand.
+        if pre_commands:
+            check_results(self._cluster_connection.execute_many(
+                pre_commands, stop_on_error=True))
+
         url = '%s/queue/%s' % (NEWT_BASE_URL, self._machine)
         job_file_path = os.path.join(job['dir'], job_script)
         data = {
@@ -61,7 +67,9 @@ class NewtQueueAdapter(SlurmQueueAdapter):
 
         return json_response['jobid']
 
-    def job_statuses(self, jobs):
+    def queue_states(self, jobs=None):
+        # NEWT lists all the user's jobs as JSON, so the same query serves
+        # both and there is no table to fall back to.
         user = parse('config.user').find(self._cluster)
 
         if not user:
@@ -72,23 +80,14 @@ class NewtQueueAdapter(SlurmQueueAdapter):
         url = '%s/queue/%s?user=%s' % (NEWT_BASE_URL, self._machine, user)
         r = self._session.get(url)
         check_status(r)
-        json_response = r.json()
-
-        states = []
-        for job in jobs:
-            slurm_state = self._extract_job_status(json_response, job)
-            state = self.to_job_queue_state(slurm_state)
-            states.append((job, state))
 
-        return states
-
-    def _extract_job_status(self, response, job):
-        status = None
+        return self._extract_job_states(r.json())
 
+    def _extract_job_states(self, response):
+        states = {}
         for job_entry in response:
-            if job_entry['jobid'] == job[AbstractQueueAdapter.QUEUE_JOB_ID] and\
-                    'status' in job_entry:
-                status = job_entry['status']
-                break
+            if 'status' in job_entry:
+                states.setdefault(str(job_entry['jobid']),
+                                  {'state': job_entry['status']})
 
-        return status
+        return states
@@ -1,6 +1,23 @@
+import json
 import re
 from cumulus.queue.abstract import AbstractQueueAdapter
 from cumulus.constants import JobQueueState
+from cumulus.transport.batch import quote
+
+# Matches the job id and state columns of a line of qstat output
+JOB_STATUS_PATTERN = re.compile(
+    r'^\s*(\d+)(\[\d+\])?\S*\s+\S+\s+\S+\s+\S+\s+(\w+)')
+# Matches the numeric part of a PBS job id, 1234[].server for example, and the
+# index of an array element, 1234[5].server for example.
+JOB_ID_PATTERN = re.compile(r'^(\d+)(\[\d+\])?')
+# Matches the queue limits reported by qstat -Q -f
+QUEUE_LIMIT_PATTERN = re.compile(
+    r'^\s*resources_max\.(walltime|nodect)\s*=\s*(\S+)')
+
+
+def _queue_job_id(m):
+    # An array job is known by its number, its elements by number[index]
+    return m.group(1) + (m.group(2) or '')
 
 
 class PbsQueueAdapter(AbstractQueueAdapter):
@@ -14,6 +31,8 @@ class PbsQueueAdapter(AbstractQueueAdapter):
     # Queued states
     QUEUED_STATE = ['q', 'h', 't', 'w', 's']
 
+    TERMINATE_COMMAND = 'qdel'
+
     def terminate_job(self, job):
         command = 'qdel %s' % job['queueJobId']
         output = self._cluster_connection.execute(command)
@@ -21,7 +40,8 @@ class PbsQueueAdapter(AbstractQueueAdapter):
         return output
 
     def _parse_job_id(self, submit_output):
-        m = re.match(r'^(\d+)\..*', submit_output[0])
+        # An array job is reported as 1234[].server
+        m = re.match(r'^(\d+)(?:\[\])?\..*', submit_output[0])
         if not m:
             raise Exception('Unable to extraction job id from: %s'
                             % submit_output[0])
@@ -29,50 +49,103 @@ class PbsQueueAdapter(AbstractQueueAdapter):
 
         return sge_id
 
-    def submit_job(self, job, job_script):
+    def submit_job(self, job, job_script, pre_commands=None):
         command = 'cd %s && qsub ./%s' % (job['dir'], job_script)
-        output = self._cluster_connection.execute(command)
+        output = self._execute_submit(command, pre_commands)
 
         if len(output) != 1:
             raise Exception('Unexpected qsub output: %s' % output)
 
         return self._parse_job_id(output)
 
-    def job_statuses(self, jobs):
-
-        job_ids = ' '.join(
-            [job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs])
+    def _array_element_id(self, queue_job_id, index):
+        return '%s[%d]' % (queue_job_id, index)
+
+    def _queues(self):
+        output = self._cluster_connection.execute('qstat -Q -f')
+
+        queues = []
+        for line in output:
+            if line.startswith('Queue:'):
+                queues.append({'name': line.split(':', 1)[1].strip()})
+                continue
+
+            m = QUEUE_LIMIT_PATTERN.match(line)
+            if m and queues:
+                (limit, value) = m.groups()
+                if limit == 'walltime':
+                    queues[-1]['maxWallTime'] = value
+                else:
+                    queues[-1]['maxNodes'] = int(value)
+
+        return queues
+
+    def _job_ids(self, jobs):
+        return ' '.join(
+            [quote(job[AbstractQueueAdapter.QUEUE_JOB_ID]) for job in jobs])
+
+    def _qstat_options(self, jobs):
+        """
+        The elements of array jobs are only listed with -t, they are listed
+        when taking a snapshot of the queue or when asked about.
+        """
+        if jobs is None:
+            return ' -t'
+
+        if any('[' in job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs):
+            return ' -t ' + self._job_ids(jobs)
+
+        return ' ' + self._job_ids(jobs)
+
+    def _structured_command(self, jobs):
+        # Only PBS Pro supports JSON output, Torque falls back to the table
+        return 'qstat -f -F json' + self._qstat_options(jobs)
+
+    def _parse_structured(self, output):
+        jobs = json.loads(output).get('Jobs', {})
+
+        states = {}
+        for (job_id, job) in jobs.items():
+            m = JOB_ID_PATTERN.match(job_id)
+            if not m or 'job_state' not in job or \
+                    _queue_job_id(m) in states:
+                continue
+
+            info = {'state': job['job_state'].lower()}
+            for (key, field) in [('nodes', 'exec_host'),
+                                 ('startTime', 'stime'),
+                                 ('reason', 'comment')]:
+                if field in job:
+                    info[key] = job[field]
+            states[_queue_job_id(m)] = info
 
-        output = self._cluster_connection.execute('qstat %s' % job_ids)
+        return states
 
-        states = []
-        for job in jobs:
-            state = None
-            pbs_state = self._extract_job_status(output, job)
+    def _table_states(self, jobs):
+        output = self._cluster_connection.execute(
+            'qstat' + self._qstat_options(jobs))
 
-            if pbs_state:
-                if pbs_state in PbsQueueAdapter.RUNNING_STATE:
-                    state = JobQueueState.RUNNING
-                elif pbs_state in PbsQueueAdapter.ERROR_STATE:
-                    state = JobQueueState.ERROR
-                elif pbs_state in PbsQueueAdapter.QUEUED_STATE:
-                    state = JobQueueState.QUEUED
-                elif pbs_state in PbsQueueAdapter.COMPLETE_STATE:
-                    state = JobQueueState.COMPLETE
+        return self._extract_job_states(output)
 
-            states.append((job, state))
+    def to_job_queue_state(self, pbs_state):
+        state = None
+        if pbs_state in PbsQueueAdapter.RUNNING_STATE:
+            state = JobQueueState.RUNNING
+        elif pbs_state in PbsQueueAdapter.ERROR_STATE:
+            state = JobQueueState.ERROR
+        elif pbs_state in PbsQueueAdapter.QUEUED_STATE:
+            state = JobQueueState.QUEUED
+        elif pbs_state in PbsQueueAdapter.COMPLETE_STATE:
+            state = JobQueueState.COMPLETE
 
-        return states
+        return state
 
-    def _extract_job_status(self, job_status_output, job):
-        state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
+    def _extract_job_states(self, job_status_output):
+        states = {}
         for line in job_status_output:
-            m = re.match(r'^\s*(\d+)\S*\s+\S+\s+\S+\s+\S+\s+(\w+)',
-                         line)
+            m = JOB_STATUS_PATTERN.match(line)
+            if m:
+                states.setdefault(_queue_job_id(m),
+                                  {'state': m.group(3).lower()})
 
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
-
-        return state
+        return states
@@ -18,9 +18,43 @@
 ###############################################################################
 
 import re
+from xml.etree import ElementTree
+
 from cumulus.queue.abstract import AbstractQueueAdapter
 from cumulus.constants import JobQueueState
 
+# Matches the job id and state columns of a line of qstat output
+JOB_STATUS_PATTERN = re.compile(r'^\s*(\d+)\s+\S+\s+\S+\s+\S+\s+(\w+)')
+# Matches an array task id or a range of them, 4-100:1 for example
+TASK_RANGE_PATTERN = re.compile(r'^(\d+)(?:-(\d+)(?::(\d+))?)?$')
+
+
+def _task_ids(tasks):
+    """
+    Expand the task ids of an array job, qstat lists the pending tasks as
+    ranges.
+    """
+    ids = []
+    for part in tasks.split(','):
+        m = TASK_RANGE_PATTERN.match(part)
+        if m:
+            first = int(m.group(1))
+            last = int(m.group(2) or first)
+            ids += range(first, last + 1, int(m.group(3) or 1))
+
+    return ids
+
+
+def _index_job(states, job_id, info, tasks=None):
+    """
+    Index a job under its id and, for an array job, each of its task ids as
+    job_id.task_id. The first entry for an id wins.
+    """
+    states.setdefault(job_id, info)
+    if tasks:
+        for task_id in _task_ids(tasks):
+            states.setdefault('%s.%d' % (job_id, task_id), info)
+
 
 class SgeQueueAdapter(AbstractQueueAdapter):
     # Running states
@@ -31,6 +65,8 @@ class SgeQueueAdapter(AbstractQueueAdapter):
     # Queued states
     QUEUED_STATE = ['qw', 'q', 'w', 's', 'h', 't']
 
+    TERMINATE_COMMAND = 'qdel'
+
     def terminate_job(self, job):
         command = 'qdel %s' % job['queueJobId']
         output = self._cluster_connection.execute(command)
@@ -38,7 +74,8 @@ class SgeQueueAdapter(AbstractQueueAdapter):
         return output
 
     def _parse_job_id(self, submit_output):
-        m = re.match(r'^[Yy]our job (\d+)', submit_output[0])
+        # An array job is reported as "Your job-array 123.1-10:1 ..."
+        m = re.match(r'^[Yy]our job(?:-array)? (\d+)', submit_output[0])
         if not m:
             raise Exception('Unable to extraction job id from: %s'
                             % submit_output[0])
@@ -46,48 +83,86 @@ class SgeQueueAdapter(AbstractQueueAdapter):
 
         return sge_id
 
-    def submit_job(self, job, job_script):
+    def submit_job(self, job, job_script, pre_commands=None):
         command = 'cd %s && qsub -cwd ./%s' % (job['dir'], job_script)
-        output = self._cluster_connection.execute(command)
+        output = self._execute_submit(command, pre_commands)
 
         if len(output) != 1:
             raise Exception('Unexpected qsub output: %s' % output)
 
         return self._parse_job_id(output)
 
-    def job_statuses(self, jobs):
-        output = self._cluster_connection.execute('qstat')
-
-        states = []
-        for job in jobs:
-            state = None
-            sge_state = self._extract_job_status(output, job)
+    def _array_element_id(self, queue_job_id, index):
+        # Task ids start at 1
+        return '%s.%d' % (queue_job_id, index + 1)
+
+    def _structured_command(self, jobs):
+        return 'qstat -xml'
+
+    def _parse_structured(self, output):
+        try:
+            root = ElementTree.fromstring(output)
+        except ElementTree.ParseError as ex:
+            raise ValueError(str(ex))
+
+        states = {}
+        for job in root.iter('job_list'):
+            job_id = job.findtext('JB_job_number')
+            state = job.findtext('state')
+            if not job_id or not state:
+                continue
+
+            info = {'state': state.lower()}
+            queue = job.findtext('queue_name')
+            if queue and '@' in queue:
+                info['nodes'] = queue.split('@', 1)[1]
+            start_time = job.findtext('JAT_start_time')
+            if start_time:
+                info['startTime'] = start_time
+            _index_job(states, job_id, info, job.findtext('tasks'))
 
-            if sge_state:
-                if sge_state in SgeQueueAdapter.RUNNING_STATE:
-                    state = JobQueueState.RUNNING
-                elif sge_state in SgeQueueAdapter.ERROR_STATE:
-                    state = JobQueueState.ERROR
-                elif sge_state in SgeQueueAdapter.QUEUED_STATE:
-                    state = JobQueueState.QUEUED
+        return states
 
-            states.append((job, state))
+    def _table_states(self, jobs):
+        # qstat lists all the user's jobs, so the same query serves both
+        output = self._cluster_connection.execute('qstat')
 
-        return states
+        return self._extract_job_states(output)
 
-    def _extract_job_status(self, job_status_output, job):
+    def to_job_queue_state(self, sge_state):
         state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
-        for line in job_status_output:
-            m = re.match(r'^\s*(\d+)\s+\S+\s+\S+\s+\S+\s+(\w+)',
-                         line)
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
+        if sge_state in SgeQueueAdapter.RUNNING_STATE:
+            state = JobQueueState.RUNNING
+        elif sge_state in SgeQueueAdapter.ERROR_STATE:
+            state = JobQueueState.ERROR
+        elif sge_state in SgeQueueAdapter.QUEUED_STATE:
+            state = JobQueueState.QUEUED
 
         return state
 
+    def _extract_job_states(self, job_status_output):
+        states = {}
+        for line in job_status_output:
+            m = JOB_STATUS_PATTERN.match(line)
+            if not m:
+                continue
+
+            # The queue column is empty for pending jobs, the task ids of an
+            # array job follow the slots.
+            columns = line.split()[7:]
+            if columns and '@' in columns[0]:
+                columns = columns[1:]
+            tasks = columns[1] if len(columns) > 1 else None
+            _index_job(states, m.group(1), {'state': m.group(2).lower()},
+                       tasks)
+
+        return states
+
     def number_of_slots(self, parallel_env):
+        return self._cached('slots:%s' % parallel_env,
+                            lambda: self._number_of_slots(parallel_env))
+
+    def _number_of_slots(self, parallel_env):
         slots = -1
         output = self._cluster_connection.execute('qconf -sp %s' % parallel_env)
 
@@ -100,4 +175,24 @@ class SgeQueueAdapter(AbstractQueueAdapter):
         if int(slots) < 1:
             raise Exception('Unable to retrieve number of slots')
 
-        return slots
+        return int(slots)
+
+    def parallel_environments(self):
+        return self._cached('parallelEnvironments', self._parallel_environments)
+
+    def _parallel_environments(self):
+        output = self._cluster_connection.execute('qconf -spl')
+
+        return [line.strip() for line in output if line.strip()]
+
+    def _queues(self):
+        output = self._cluster_connection.execute('qconf -sql')
+
+        return [{'name': line.strip()} for line in output if line.strip()]
+
+    def scheduler_metadata(self):
+        metadata = super(SgeQueueAdapter, self).scheduler_metadata()
+        metadata['slots'] = {pe: self.number_of_slots(pe)
+                             for pe in self.parallel_environments()}
+
+        return metadata
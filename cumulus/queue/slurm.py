@@ -2,6 +2,20 @@ import re
 from cumulus.queue.abstract import AbstractQueueAdapter
 from cumulus.constants import JobQueueState
 
+# Matches the job id ( jobid_index for an array element ) and state columns of
+# a line of squeue output
+JOB_STATUS_PATTERN = re.compile(
+    r'^\s*(\d+(?:_\d+)?)\s+\S+\s+\S+\s+\S+\s+(\w+)')
+
+# The fields requested from squeue: the job id ( jobid_index for an array
+# element ), compact state, node list, start time and the reason the job is
+# pending.
+STRUCTURED_FORMAT = '%i|%t|%N|%S|%r'
+
+# The fields requested from sinfo: the partition ( marked with a * if it is
+# the default ), its time limit and the maximum job size in nodes.
+PARTITION_FORMAT = '%P|%l|%s'
+
 
 class SlurmQueueAdapter(AbstractQueueAdapter):
 
@@ -34,6 +48,8 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
     # Queued states
     QUEUED_STATE = ['cf', 'pd']
 
+    TERMINATE_COMMAND = 'scancel'
+
     def terminate_job(self, job):
         command = 'scancel %s' % job['queueJobId']
         output = self._cluster_connection.execute(command)
@@ -49,22 +65,88 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
 
         return slurm_id
 
-    def submit_job(self, job, job_script):
+    def submit_job(self, job, job_script, pre_commands=None):
         command = 'cd %s && sbatch ./%s' % (job['dir'], job_script)
-        output = self._cluster_connection.execute(command)
+        output = self._execute_submit(command, pre_commands)
 
         if len(output) != 1:
             raise Exception('Unexpected sbatch output: %s' % output)
 
         return self._parse_job_id(output)
 
-    def job_statuses(self, jobs):
-        job_ids = ','.join(
-            [job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs])
-        output = self._cluster_connection.execute('squeue -j %s'
-                                                  % job_ids)
+    def _array_element_id(self, queue_job_id, index):
+        return '%s_%d' % (queue_job_id, index)
+
+    def _queues(self):
+        output = self._cluster_connection.execute(
+            "sinfo --noheader --format='%s'" % PARTITION_FORMAT)
+
+        partitions = []
+        for line in output:
+            fields = line.strip().split('|')
+            if len(fields) != 3:
+                continue
+
+            (name, time_limit, job_size) = fields
+            partition = {'name': name.rstrip('*')}
+            if name.endswith('*'):
+                partition['default'] = True
+            if time_limit not in ('infinite', 'n/a'):
+                partition['maxWallTime'] = time_limit
+            # The job size is reported as a range, 1-infinite for example
+            max_nodes = job_size.split('-')[-1]
+            if max_nodes.isdigit():
+                partition['maxNodes'] = int(max_nodes)
+            # A partition can be listed more than once
+            if partition not in partitions:
+                partitions.append(partition)
+
+        return partitions
+
+    def _squeue_selection(self, jobs):
+        # -r lists the elements of array jobs one per line, rather than as
+        # a range, it is used when taking a snapshot of the queue or when
+        # asked about them.
+        if jobs is None:
+            return '-r -u $USER'
+
+        job_ids = [job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs]
+        selection = '-j %s' % ','.join(job_ids)
+        if any('_' in job_id for job_id in job_ids):
+            selection = '-r ' + selection
+
+        return selection
+
+    def _structured_command(self, jobs):
+        return "squeue --noheader --format='%s' %s" % (
+            STRUCTURED_FORMAT, self._squeue_selection(jobs))
+
+    def _parse_structured(self, output):
+        states = {}
+        for line in output.splitlines():
+            fields = line.strip().split('|')
+            if len(fields) != 5:
+                raise ValueError('Unexpected squeue output: %s' % line)
+
+            (job_id, state, nodes, start_time, reason) = fields
+            if job_id in states:
+                continue
+
+            info = {'state': state.lower()}
+            # squeue fills in fields that don't apply with N/A or None
+            for (key, value) in [('nodes', nodes), ('startTime', start_time),
+                                 ('reason', reason)]:
+                if value and value not in ('N/A', 'None', '(null)'):
+                    info[key] = value
+            states[job_id] = info
+
+        return states
+
+    def _table_states(self, jobs):
+        output = self._cluster_connection.execute(
+            'squeue %s' % self._squeue_selection(jobs))
 
-        return self._extract_job_statuses(output, jobs)
+        return self._extract_job_states(output)
 
     def to_job_queue_state(self, slurm_state):
         state = None
@@ -80,24 +162,11 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
 
         return state
 
-    def _extract_job_statuses(self, job_status_output, jobs):
-        states = []
-        for job in jobs:
-            slurm_state = self._extract_job_status(job_status_output, job)
-            state = self.to_job_queue_state(slurm_state)
-            states.append((job, state))
-
-        return states
-
-    def _extract_job_status(self, job_status_output, job):
-        state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
+    def _extract_job_states(self, job_status_output):
+        states = {}
         for line in job_status_output:
-            m = re.match('^\\s*(\\d+)\\s+\\S+\\s+\\S+\\s+\\S+\\s+(\\w+)',
-                         line)
+            m = JOB_STATUS_PATTERN.match(line)
+            if m:
+                states.setdefault(m.group(1), {'state': m.group(2).lower()})
 
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
-
-        return state
+        return states
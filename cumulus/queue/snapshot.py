@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import time
+
+import requests
+
+import cumulus
+from cumulus.common import check_status
+from cumulus.common.jsonpath import get_property
+
+# How old, in seconds, a snapshot can get before the scheduler is queried
+# again. This can be overridden by queue.snapshot.interval in the config.
+SNAPSHOT_INTERVAL = 5
+# How long to wait for another worker to refresh the snapshot before querying
+# the scheduler directly, in seconds.
+WAIT_TIMEOUT = 10
+
+
+def states_to_list(states):
+    """
+    The ids of array elements can contain '.', which older versions of Mongo
+    won't store as a key, so the states are sent as a list of entries rather
+    than keyed by queue job id.
+    """
+    return [dict(state, queueJobId=queue_job_id)
+            for (queue_job_id, state) in states.items()]
+
+
+def states_from_list(entries):
+    states = {}
+    for entry in entries or []:
+        entry = dict(entry)
+        states[entry.pop('queueJobId')] = entry
+
+    return states
+
+
+def snapshot_enabled():
+    return bool(get_property('queue.snapshot.enabled', cumulus.config,
+                             default=True))
+
+
+class QueueSnapshot(object):
+    """
+    A snapshot of the scheduler state of all the jobs on a cluster, kept by
+    Girder and shared by every task monitoring jobs on the cluster, so the
+    scheduler is queried once per interval per cluster rather than once per
+    interval per job.
+    """
+    def __init__(self, cluster_id, girder_token):
+        self._url = '%s/clusters/%s/queue' % (cumulus.config.girder.baseUrl,
+                                              cluster_id)
+        self._headers = {'Girder-Token': girder_token}
+        self._interval = get_property('queue.snapshot.interval',
+                                      cumulus.config,
+                                      default=SNAPSHOT_INTERVAL)
+
+    def _get(self, after):
+        params = {
+            'maxAge': self._interval
+        }
+        if after is not None:
+            params['after'] = after
+
+        r = requests.get(self._url, headers=self._headers, params=params)
+        check_status(r)
+
+        return r.json()
+
+    def _refresh(self, fetch, refresh_time):
+        states = fetch()
+        r = requests.put(self._url, headers=self._headers, json={
+            'time': refresh_time,
+            'states': states_to_list(states)
+        })
+        check_status(r)
+
+        return states
+
+    def states(self, jobs, fetch):
+        """
+        Returns a dict mapping queue job id to scheduler state for all the
+        jobs on the cluster.
+
+        :param jobs: The jobs the caller is interested in. A job that was
+                     queued after the snapshot was taken would be missing
+                     from it, and so look complete, so the snapshot must be
+                     newer than the queuedAt of all of them. Both are taken
+                     from Girder's clock so the workers' clocks don't matter.
+        :param fetch: Called to query the scheduler for the state of all the
+                      jobs, if this caller is the one to refresh the snapshot.
+        """
+        queued_times = [job['queuedAt'] for job in jobs if 'queuedAt' in job]
+        after = max(queued_times) if queued_times else None
+
+        start = time.time()
+        while True:
+            snapshot = self._get(after)
+            if snapshot['refresh']:
+                return self._refresh(fetch, snapshot['refreshTime'])
+
+            if snapshot['time'] is not None and \
+                    (after is None or snapshot['time'] >= after):
+                return states_from_list(snapshot['states'])
+
+            # Another worker is refreshing the snapshot, give it a chance
+            # to finish before falling back to querying the scheduler.
+            if time.time() - start > WAIT_TIMEOUT:
+                return fetch()
+
+            time.sleep(snapshot['retryAfter'])
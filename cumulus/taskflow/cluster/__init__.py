@@ -26,7 +26,7 @@ from celery.canvas import Signature
 import cumulus.taskflow
 import cumulus.ansible.tasks.volume
 from cumulus.ansible.tasks.providers import CloudProvider, InstanceState
-from cumulus.tasks.job import terminate_job
+import cumulus.tasks.job
 from cumulus.constants import JobState
 from cumulus.ansible.tasks.utils import check_girder_cluster_status
 
@@ -382,6 +382,7 @@ def create_girder_client(girder_api_url, girder_token):
 
 
 def terminate_jobs(task, client, cluster, jobs):
+    terminating = []
     for job in jobs:
         task.logger.info('Terminating job %s' % job['_id'])
         # Fetch the latest job info
@@ -393,7 +394,10 @@ def terminate_jobs(task, client, cluster, jobs):
             'status': JobState.TERMINATING
         }
         client.patch(job_url, data=json.dumps(body))
+        terminating.append(job)
 
-        terminate_job(
-            cluster, job, log_write_url=None,
+    # Terminate them together, over one connection to the cluster
+    if terminating:
+        cumulus.tasks.job.terminate_jobs(
+            cluster, terminating, log_write_url=None,
             girder_token=task.taskflow.girder_token)
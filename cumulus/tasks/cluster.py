@@ -23,6 +23,7 @@ from cumulus.common import check_status
 from cumulus.common import get_cluster_logger
 import cumulus
 from cumulus.transport import get_connection
+from cumulus.queue import get_queue_adapter
 
 import requests
 # import time
@@ -186,3 +187,28 @@ def test_connection(cluster, log_write_url=None, girder_token=None):
                            json={'status': 'error'})
         # Log the error message
         log.exception(ex)
+
+
+@command.task
+def refresh_scheduler_metadata(cluster, log_write_url=None, girder_token=None):
+    """
+    Query the scheduler of a cluster for the metadata that is cached, the
+    cache is expected to have been invalidated.
+    """
+    cluster_url = '%s/clusters/%s' % (cumulus.config.girder.baseUrl,
+                                      cluster['_id'])
+    log = get_cluster_logger(cluster, girder_token)
+    headers = {'Girder-Token':  girder_token}
+
+    try:
+        # Fetch the cluster with this 'admin' token so we get the passphrase
+        # filled out.
+        r = requests.get(cluster_url, headers=headers)
+        check_status(r)
+        cluster = r.json()
+
+        with get_connection(girder_token, cluster) as conn:
+            get_queue_adapter(cluster, conn, girder_token=girder_token) \
+                .scheduler_metadata()
+    except Exception as ex:
+        log.exception(ex)
@@ -28,18 +28,22 @@ import cumulus.girderclient
 import cumulus.constants
 from cumulus.constants import ClusterType, JobQueueState
 from cumulus.queue import get_queue_adapter
-from cumulus.queue.abstract import AbstractQueueAdapter
+from cumulus.queue.abstract import AbstractQueueAdapter, QueueQueryError
+from cumulus.common.jsonpath import get_property
 from cumulus.transport import get_connection
+from cumulus.transport.abstract import STDOUT
+from cumulus.transport.batch import check_results, quote, write_file_command
 from cumulus.transport.files.download import download_path
 from cumulus.transport.files.upload import upload_path
 from cumulus.transport.files import get_assetstore_url_base, get_assetstore_id
+from cumulus.transport.newt import is_transient_error
+from cumulus.transport.scheduler import transfer_lease
 import requests
 import os
 import re
 import inspect
 import time
 import uuid
-from six import StringIO
 from celery import signature
 from celery.exceptions import Retry
 from jinja2 import Environment, Template, PackageLoader
@@ -48,15 +52,42 @@ import tempfile
 from girder_client import HttpError
 import paramiko
 
+# The maximum amount of output read from a tailed file each time a job is
+# monitored.
+TAIL_MAX_BYTES = 1024 * 1024
 
-def _put_script(conn, script_commands):
-    script_name = uuid.uuid4().hex
-    script = script_commands + 'echo $!\n'
-    conn.put(StringIO(script), script_name)
-    cmd = './%s' % script_name
-    conn.execute('chmod 700 %s' % cmd)
+# How often, in seconds, the scheduler is polled for the state of a job.
+MONITOR_INTERVAL = 5
+# How often, in seconds, a job that reports its own completion is polled, as
+# a safety net in case the report is lost. This can be overridden by
+# job.completionCallback.pollInterval in the config.
+CALLBACK_POLL_INTERVAL = 60
 
-    return cmd
+
+def _background_command(command, output_path):
+    """
+    Returns a shell command that runs command in the background using nohup,
+    the PID of the background process is echoed.
+    """
+    return 'nohup %s  &> %s  &\necho $!' % (command, output_path)
+
+
+def _stage_girder_client(cluster, conn, remote_path):
+    """
+    Returns the commands that write the girder client to remote_path, so it
+    can be staged in the same batch as the command that runs it. NEWT runs a
+    batch as a single command argument, too small for the client, so there
+    it is uploaded through the file API instead.
+    """
+    path = inspect.getsourcefile(cumulus.girderclient)
+    if cluster['type'] == ClusterType.NEWT:
+        with open(path, 'rb') as fp:
+            conn.put(fp, remote_path)
+
+        return []
+
+    with open(path, 'r') as fp:
+        return [write_file_command(remote_path, fp.read())]
 
 
 def job_directory(cluster, job, user_home='.'):
@@ -90,11 +121,6 @@ def download_job_input_items(cluster, job, log_write_url=None,
 
     try:
         with get_connection(girder_token, cluster) as conn:
-            # First put girder client on master
-            path = inspect.getsourcefile(cumulus.girderclient)
-            with open(path, 'r') as fp:
-                conn.put(fp, os.path.basename(path))
-
             r = requests.patch(status_url, json={'status': 'downloading'},
                                headers=headers)
             check_status(r)
@@ -105,14 +131,14 @@ def download_job_input_items(cluster, job, log_write_url=None,
                    job_directory(cluster, job), job_id)
 
             download_output = '%s.download.out' % job_id
-            download_cmd = 'nohup %s  &> %s  &\n' % (download_cmd,
-                                                     download_output)
-
-            download_cmd = _put_script(conn, download_cmd)
-            output = conn.execute(download_cmd)
 
-            # Remove download script
-            conn.remove(download_cmd)
+            # Put girder client on master and start the download in one go
+            results = conn.execute_many(
+                _stage_girder_client(cluster, conn, 'girderclient.py') +
+                [_background_command(download_cmd, download_output)],
+                stop_on_error=True)
+            check_results(results)
+            output = results[-1].stdout
 
         if len(output) != 1:
             raise Exception('PID not returned by execute command')
@@ -142,13 +168,18 @@ def download_job_input_folders(cluster, job, log_write_url=None,
                                girder_token=None, submit=True):
     job_dir = job_directory(cluster, job)
 
-    with get_connection(girder_token, cluster) as conn:
+    with get_connection(girder_token, cluster) as conn, \
+            transfer_lease(cluster, girder_token, conn,
+                           owner_id=job.get('userId')):
         for input in job['input']:
             if 'folderId' in input and 'path' in input:
                 folder_id = input['folderId']
                 path = input['path']
                 upload_path(conn, girder_token, folder_id,
-                            os.path.join(job_dir, path))
+                            os.path.join(job_dir, path),
+                            bulk=input.get('bulk', False),
+                            compress=input.get('compress', False),
+                            sync=input.get('sync', False))
 
     if submit:
         submit_job.delay(cluster, job, log_write_url=log_write_url,
@@ -199,22 +230,105 @@ def _is_terminating(job, girder_token):
     return current_status in [JobState.TERMINATED, JobState.TERMINATING]
 
 
+def _completion_callback_enabled(cluster, job):
+    """
+    Returns True if the job should report its completion to Girder when its
+    script exits, this is set by the completionCallback job parameter or
+    the scheduler.completionCallback property of the cluster's config.
+    """
+    enabled = get_property('config.scheduler.completionCallback', cluster,
+                           default=False)
+
+    return bool(job.get('params', {}).get('completionCallback', enabled))
+
+
+def _add_callback_secret(cluster, job, girder_token):
+    """
+    If the job is to report its completion, give it a secret that it passes
+    back to authenticate the report. Returns True if the job reports its
+    completion.
+    """
+    if not _completion_callback_enabled(cluster, job):
+        return False
+
+    secret = uuid.uuid4().hex
+    job_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job['_id'])
+    r = requests.patch(job_url, headers={'Girder-Token': girder_token},
+                       json={'callbackSecret': secret})
+    check_status(r)
+    job['callbackSecret'] = secret
+
+    return True
+
+
+def _monitor_interval(callback):
+    """
+    Jobs that report their completion are still polled, in case the report
+    never arrives, but less often.
+    """
+    if callback:
+        return get_property('job.completionCallback.pollInterval',
+                            cumulus.config, default=CALLBACK_POLL_INTERVAL)
+
+    return MONITOR_INTERVAL
+
+
+def _callback_params(jobs):
+    if any(job.get('callbackSecret') for job in jobs):
+        return {
+            'completionCallbackUrl': '%s/jobs' % cumulus.config.girder.baseUrl
+        }
+
+    return {}
+
+
 def _generate_submission_script(job, cluster, job_params):
     env = Environment(loader=PackageLoader('cumulus', 'templates'))
     template = env.get_template('template.sh')
+    callback_params = _callback_params([job])
     script = template.render(cluster=cluster, job=job,
                              baseUrl=cumulus.config.girder.baseUrl,
-                             **job_params)
+                             **dict(job_params, **callback_params))
 
     # We now render again to ensure any template variable in the jobs
     # commands are filled out.
     script = Template(script).render(cluster=cluster, job=job,
                                      baseUrl=cumulus.config.girder.baseUrl,
-                                     **job_params)
+                                     **dict(job_params, **callback_params))
 
     return script
 
 
+def _generate_array_script(jobs, cluster, job_params):
+    """
+    Generate a single script running jobs as the elements of an array job.
+    The scheduler directives come from the first job and job_params, the
+    commands of each job are rendered with its own parameters.
+    """
+    array_jobs = []
+    for job in jobs:
+        params = dict(job_params, **job.get('params', {}))
+        commands = [Template(command).render(
+            cluster=cluster, job=job, baseUrl=cumulus.config.girder.baseUrl,
+            **params) for command in job.get('commands', [])]
+        array_jobs.append({
+            '_id': job['_id'],
+            'name': job['name'],
+            'dir': quote(job['dir']),
+            'commands': commands,
+            'callbackSecret': job.get('callbackSecret')
+        })
+
+    # The commands have already been rendered, so there is no second pass.
+    env = Environment(loader=PackageLoader('cumulus', 'templates'))
+    template = env.get_template('template.sh')
+
+    return template.render(cluster=cluster, job=jobs[0],
+                           baseUrl=cumulus.config.girder.baseUrl,
+                           arraySize=len(jobs), arrayJobs=array_jobs,
+                           **dict(job_params, **_callback_params(jobs)))
+
+
 def _get_on_complete(job):
     on_complete = parse('onComplete.cluster').find(job)
 
@@ -226,6 +340,61 @@ def _get_on_complete(job):
     return on_complete
 
 
+def _set_job_directories(cluster, jobs, conn):
+    """
+    Set the directory of each job, the user's home directory is only fetched
+    if one of them needs it.
+    """
+    user_home = None
+    for job in jobs:
+        job_dir = job_directory(cluster, job)
+        if not os.path.isabs(job_dir):
+            if user_home is None:
+                output = conn.execute('pwd')
+                if len(output) != 1:
+                    raise Exception('Unable to fetch users home directory.')
+
+                user_home = output[0].strip()
+            job_dir = job_directory(cluster, job, user_home=user_home)
+        job['dir'] = job_dir
+
+
+def _submission_params(cluster, job, conn, girder_token=None):
+    """
+    Returns the template parameters of a job and the number of slots
+    available to it, -1 if that isn't known. The parallel environment and,
+    if needed, the number of slots it provides are filled in, the latter is
+    cached per cluster if girder_token is provided.
+    """
+    job_params = {}
+    if 'params' in job:
+        job_params = job['params']
+
+    slots = -1
+
+    # Try job parameters first
+    slots = int(job_params.get('numberOfSlots', slots))
+
+    if slots == -1:
+        # Try the cluster
+        slots = int(cluster['config'].get('numberOfSlots', slots))
+
+    parallel_env = _get_parallel_env(cluster, job)
+    if parallel_env:
+        job_params['parallelEnvironment'] = parallel_env
+
+        # If the number of slots has not been provided we will get
+        # the number of slots from the parallel environment
+        if slots == -1:
+            slots = int(get_queue_adapter(cluster, conn,
+                                          girder_token=girder_token)
+                        .number_of_slots(parallel_env))
+            if slots > 0:
+                job_params['numberOfSlots'] = slots
+
+    return (job_params, slots)
+
+
 @command.task
 def submit_job(cluster, job, log_write_url=None, girder_token=None,
                monitor=True):
@@ -241,53 +410,29 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None,
 
         script_name = job['name']
 
-        with get_connection(girder_token, cluster) as conn:
-            job_params = {}
-            if 'params' in job:
-                job_params = job['params']
-
-            output = conn.execute('pwd')
-            if len(output) != 1:
-                raise Exception('Unable to fetch users home directory.')
-
-            user_home = output[0].strip()
-            job_dir = job_directory(cluster, job, user_home=user_home)
-            job['dir'] = job_dir
-
-            slots = -1
+        callback = _add_callback_secret(cluster, job, girder_token)
 
-            # Try job parameters first
-            slots = int(job_params.get('numberOfSlots', slots))
-
-            if slots == -1:
-                # Try the cluster
-                slots = int(cluster['config'].get('numberOfSlots', slots))
-
-            parallel_env = _get_parallel_env(cluster, job)
-            if parallel_env:
-                job_params['parallelEnvironment'] = parallel_env
-
-                # If the number of slots has not been provided we will get
-                # the number of slots from the parallel environment
-                if slots == -1:
-                    slots = int(get_queue_adapter(cluster, conn)
-                                .number_of_slots(parallel_env))
-                    if slots > 0:
-                        job_params['numberOfSlots'] = slots
+        with get_connection(girder_token, cluster) as conn:
+            _set_job_directories(cluster, [job], conn)
+            job_dir = job['dir']
+            (job_params, slots) = _submission_params(cluster, job, conn,
+                                                     girder_token)
 
             script = _generate_submission_script(job, cluster, job_params)
 
-            conn.makedirs(job_dir)
-            # put the script to master
-            conn.put(StringIO(script), os.path.join(job_dir, script_name))
+            # Stage the script on master as part of the submission
+            stage_commands = [
+                'mkdir -p %s' % quote(job_dir),
+                write_file_command(os.path.join(job_dir, script_name), script)
+            ]
 
             if slots > -1:
                 log.info('We have %s slots available' % slots)
 
             # Now submit the job
             queue_job_id \
-                = get_queue_adapter(cluster, conn).submit_job(job,
-                                                              script_name)
+                = get_queue_adapter(cluster, conn).submit_job(
+                    job, script_name, pre_commands=stage_commands)
 
             # Update the state and queue job id
             job[AbstractQueueAdapter.QUEUE_JOB_ID] = queue_job_id
@@ -306,7 +451,9 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None,
             if monitor:
                 monitor_job.s(
                     cluster, job, log_write_url=log_write_url,
-                    girder_token=girder_token).apply_async(countdown=5)
+                    girder_token=girder_token,
+                    monitor_interval=_monitor_interval(callback)
+                ).apply_async(countdown=5)
 
         # Now update the status of the job
         headers = {'Girder-Token':  girder_token}
@@ -322,6 +469,89 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None,
         raise
 
 
+@command.task
+def submit_jobs(cluster, jobs, log_write_url=None, girder_token=None,
+                monitor=True):
+    """
+    Submit related jobs as the elements of a single array job, one script is
+    staged and submitted and each job is then tracked by the queue job id of
+    its element. The scheduler parameters of the first job apply to all of
+    them.
+    """
+    headers = {'Girder-Token':  girder_token}
+    try:
+        # if terminating leave the job out
+        jobs = [job for job in jobs if not _is_terminating(job, girder_token)]
+        if not jobs:
+            return
+
+        first_job = jobs[0]
+        script_name = first_job['name']
+        job_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
+                                      first_job['_id'])
+        log = get_post_logger(first_job['_id'], girder_token, job_url)
+
+        callbacks = [_add_callback_secret(cluster, job, girder_token)
+                     for job in jobs]
+
+        with get_connection(girder_token, cluster) as conn:
+            _set_job_directories(cluster, jobs, conn)
+            (job_params, slots) = _submission_params(
+                cluster, first_job, conn, girder_token)
+
+            script = _generate_array_script(jobs, cluster, job_params)
+
+            # Stage the script on master as part of the submission, it is
+            # submitted from the directory of the first job.
+            stage_commands = [
+                'mkdir -p %s' % ' '.join([quote(job['dir']) for job in jobs]),
+                write_file_command(
+                    os.path.join(first_job['dir'], script_name), script)
+            ]
+
+            if slots > -1:
+                log.info('We have %s slots available' % slots)
+
+            queue_job_ids = get_queue_adapter(cluster, conn).submit_array(
+                first_job, script_name, len(jobs),
+                pre_commands=stage_commands)
+
+            # Update the state and queue job id of each element
+            queued = []
+            for (job, queue_job_id) in zip(jobs, queue_job_ids):
+                patch_data = {
+                    'status': JobState.QUEUED,
+                    AbstractQueueAdapter.QUEUE_JOB_ID: queue_job_id,
+                    'dir': job['dir']
+                }
+                status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
+                                             job['_id'])
+                r = requests.patch(status_url, headers=headers,
+                                   json=patch_data)
+                check_status(r)
+                job = r.json()
+                job['queuedTime'] = time.time()
+                queued.append(job)
+
+            # Now monitor the progress of all the elements
+            if monitor:
+                monitor_jobs.s(
+                    cluster, queued, log_write_url=log_write_url,
+                    girder_token=girder_token,
+                    monitor_interval=_monitor_interval(all(callbacks))
+                ).apply_async(countdown=5)
+    except Exception as ex:
+        traceback.print_exc()
+        for job in jobs:
+            status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
+                                         job['_id'])
+            r = requests.patch(status_url, headers=headers,
+                               json={'status': JobState.UNEXPECTEDERROR})
+            check_status(r)
+            get_job_logger(job, girder_token).exception(str(ex))
+        raise
+
+
 def submit(girder_token, cluster, job, log_url):
     # Do we inputs to download ?
     if 'input' in job and len(job['input']) > 0:
@@ -333,6 +563,13 @@ def submit(girder_token, cluster, job, log_url):
                          girder_token=girder_token)
 
 
+def submit_array(girder_token, cluster, jobs, log_url):
+    # Input is downloaded per job, so only jobs without input can be
+    # submitted together.
+    submit_jobs.delay(cluster, jobs, log_write_url=log_url,
+                      girder_token=girder_token)
+
+
 class JobState(object):
     CREATED = cumulus.constants.JobState.CREATED
     RUNNING = cumulus.constants.JobState.RUNNING
@@ -423,6 +660,8 @@ class Running(JobState):
         job_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
                                       self.job['_id'])
         log = get_post_logger(self.job['_id'], self.girder_token, job_url)
+        max_bytes = get_property('job.tailMaxBytes', cumulus.config,
+                                 default=TAIL_MAX_BYTES)
 
         # Do we need to tail any output files
         for output in self.job.get('output', []):
@@ -438,8 +677,12 @@ class Running(JobState):
                 try:
                     # Only tail if file exists
                     if self.conn.isfile(tail_path):
-                        stdout = self.conn.execute(command)
-                        output['content'] = output['content'] + stdout
+                        # Stream the output, capping what we pull back in one
+                        # go, anything left over is picked up next time.
+                        for (stream, line) in self.conn.execute_stream(
+                                command, max_bytes=max_bytes):
+                            if stream == STDOUT:
+                                output['content'].append(line)
                     else:
                         log.info('Skipping tail of %s as file doesn\'t '
                                  'currently exist' %
@@ -536,6 +779,10 @@ class Terminated(JobState):
         return self
 
 
+def _uploads_output(job):
+    return job.get('uploadOutput', True) and len(job.get('output', [])) > 0
+
+
 class Uploading(JobState):
     def next(self, job_queue_status):
         job_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
@@ -552,17 +799,13 @@ class Uploading(JobState):
         # Fire off task to upload the output
         log.info('Job "%s" complete' % job_name)
 
-        upload = self.job.get('uploadOutput', True)
-
-        if not upload or len(self.job.get('output', [])) == 0:
+        if not _uploads_output(self.job):
             return Complete(self)
 
         return self
 
     def run(self):
-        upload = self.job.get('uploadOutput', True)
-
-        if upload and len(self.job.get('output', [])) > 0:
+        if _uploads_output(self.job):
             upload_job_output.delay(self.cluster, self.job,
                                     log_write_url=self.log_write_url,
                                     job_dir=self.job['dir'],
@@ -609,8 +852,79 @@ def from_string(s, **kwargs):
     return state
 
 
+def _claim_status(job, current_status, new_status, headers):
+    """
+    Move a job to new_status only if it is still in current_status, returns
+    False if something else, a completion callback or another monitor, has
+    already moved it on.
+    """
+    job_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job['_id'])
+    r = requests.patch(job_url, headers=headers, json={
+        'status': new_status,
+        'previousStatus': current_status
+    })
+    if r.status_code == 409:
+        return False
+    check_status(r)
+
+    return True
+
+
+def _update_job_status(task, cluster, job, queue_state, conn, headers,
+                       log_write_url, girder_token):
+    """
+    Move a job on according to its scheduler state, returns the new status
+    or None if the job was left alone.
+    """
+    # First get the current status
+    status_url = '%s/jobs/%s/status' % (cumulus.config.girder.baseUrl,
+                                        job['_id'])
+    r = requests.get(status_url, headers=headers)
+    check_status(r)
+    current_status = r.json()['status']
+
+    if current_status == JobState.TERMINATED:
+        return None
+
+    # The upload task moves the job on once its output has been uploaded.
+    if current_status == JobState.UPLOADING and _uploads_output(job):
+        return None
+
+    job_status = from_string(current_status, task=task, cluster=cluster,
+                             job=job, log_write_url=log_write_url,
+                             girder_token=girder_token, conn=conn)
+    job_status = job_status.next(queue_state)
+
+    # Completion can be reported by both the job's callback and the monitor,
+    # only one of them should upload the output.
+    if str(job_status) == JobState.UPLOADING and \
+            current_status != JobState.UPLOADING and \
+            not _claim_status(job, current_status, JobState.UPLOADING,
+                              headers):
+        return None
+
+    job['status'] = str(job_status)
+    job_status.run()
+    json = {
+        'status': str(job_status),
+        'timings': job.get('timings', {}),
+        'output': job['output']
+    }
+    job_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job['_id'])
+    r = requests.patch(job_url, headers=headers, json=json)
+    check_status(r)
+
+    return job['status']
+
+
 def _monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
-                  monitor_interval=5):
+                  monitor_interval=MONITOR_INTERVAL, reported_states=None):
+    """
+    Move each job on according to its scheduler state, retrying while any
+    are still queued or running. reported_states, the state of each job
+    reported by a completion callback, is used rather than querying the
+    scheduler.
+    """
     headers = {'Girder-Token':  girder_token}
 
     cluster_url = '%s/clusters/%s' % (
@@ -619,41 +933,22 @@ def _monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
         with get_connection(girder_token, cluster) as conn:
 
             try:
-                job_queue_states \
-                    = get_queue_adapter(cluster, conn).job_statuses(jobs)
+                if reported_states is not None:
+                    job_queue_states = list(zip(jobs, reported_states))
+                else:
+                    # Statuses come from the cluster's shared queue snapshot,
+                    # so the scheduler isn't queried once per monitored job.
+                    job_queue_states = get_queue_adapter(
+                        cluster, conn,
+                        girder_token=girder_token).job_statuses(jobs)
 
                 new_states = set()
                 for (job, state) in job_queue_states:
-                    job_id = job['_id']
-                    # First get the current status
-                    status_url = '%s/jobs/%s/status' % (
-                        cumulus.config.girder.baseUrl, job_id)
-                    r = requests.get(status_url, headers=headers)
-                    check_status(r)
-                    current_status = r.json()['status']
-
-                    if current_status == JobState.TERMINATED:
-                        continue
-
-                    job_status = from_string(current_status, task=task,
-                                             cluster=cluster, job=job,
-                                             log_write_url=log_write_url,
-                                             girder_token=girder_token,
-                                             conn=conn)
-                    job_status = job_status.next(state)
-                    job['status'] = str(job_status)
-                    job_status.run()
-                    json = {
-                        'status': str(job_status),
-                        'timings': job.get('timings', {}),
-                        'output': job['output']
-                    }
-                    job_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
-                                              job['_id'])
-                    r = requests.patch(job_url, headers=headers, json=json)
-                    check_status(r)
-
-                    new_states.add(job['status'])
+                    new_state = _update_job_status(
+                        task, cluster, job, state, conn, headers,
+                        log_write_url, girder_token)
+                    if new_state is not None:
+                        new_states.add(new_state)
 
                 # Now see if we still have jobs to monitor
                 running_states = set(
@@ -662,15 +957,22 @@ def _monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
                 )
 
                 # Do we have any job still in a running state?
-                if new_states & running_states:
+                if new_states & running_states and reported_states is None:
                     task.retry(countdown=monitor_interval)
-            except EOFError:
+            except (EOFError, paramiko.ssh_exception.NoValidConnectionsError):
                 # Try again
                 task.retry(countdown=5)
                 return
-            except paramiko.ssh_exception.NoValidConnectionsError:
-                # Try again
-                task.retry(countdown=5)
+            except requests.exceptions.RequestException as ex:
+                # A transient HTTP failure, for example a NEWT 502, shouldn't
+                # put the cluster into error.
+                if not is_transient_error(ex):
+                    raise
+                task.retry(countdown=monitor_interval)
+                return
+            except QueueQueryError:
+                # The scheduler may be down, the jobs are still there
+                task.retry(countdown=monitor_interval)
                 return
     # Ensure that the Retry exception will get through
     except Retry:
@@ -692,18 +994,39 @@ def _monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
 
 @monitor.task(bind=True, max_retries=None, throws=(Retry,))
 def monitor_job(task, cluster, job, log_write_url=None, girder_token=None,
-                monitor_interval=5):
+                monitor_interval=MONITOR_INTERVAL):
     _monitor_jobs(task, cluster, [job], log_write_url, girder_token,
                   monitor_interval=monitor_interval)
 
 
 @monitor.task(bind=True, max_retries=None, throws=(Retry,))
 def monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
-                 monitor_interval=5):
+                 monitor_interval=MONITOR_INTERVAL):
     _monitor_jobs(task, cluster, jobs, log_write_url, girder_token,
                   monitor_interval=monitor_interval)
 
 
+@monitor.task(bind=True)
+def job_complete(task, cluster, job, log_write_url=None, girder_token=None):
+    """
+    Called when a job's completion callback reports that it has exited, the
+    job is moved on straight away rather than when the scheduler is next
+    polled. A job that exited with a non-zero exit code is in error.
+    """
+    completion = job.get('completion', {})
+    if 'startTime' in completion and 'endTime' in completion:
+        running_time = completion['endTime'] - completion['startTime']
+        job.setdefault('timings', {})['running'] \
+            = int(round(running_time * 1000))
+
+    state = JobQueueState.COMPLETE
+    if completion.get('exitCode', 0) != 0:
+        state = JobQueueState.ERROR
+
+    _monitor_jobs(task, cluster, [job], log_write_url, girder_token,
+                  reported_states=[state])
+
+
 def upload_job_output_to_item(cluster, job, log_write_url=None, job_dir=None,
                               girder_token=None):
     headers = {'Girder-Token':  girder_token}
@@ -716,14 +1039,9 @@ def upload_job_output_to_item(cluster, job, log_write_url=None, job_dir=None,
             return
 
         with get_connection(girder_token, cluster) as conn:
-            # First put girder client on master
-            path = inspect.getsourcefile(cumulus.girderclient)
-            with open(path, 'r') as fp:
-                conn.put(fp,
-                         os.path.normpath(os.path.join(job_dir, '..',
-                                                       os.path.basename(path))))
-
-            cmds = ['cd %s' % job_dir]
+            girder_client_path = os.path.normpath(
+                os.path.join(job_dir, '..', 'girderclient.py'))
+
             upload_cmd = 'python ../girderclient.py --token %s --url "%s" ' \
                          'upload --job %s' \
                          % (girder_token,
@@ -732,13 +1050,16 @@ def upload_job_output_to_item(cluster, job, log_write_url=None, job_dir=None,
             upload_output = '%s.upload.out' % job_id
             upload_output_path = os.path.normpath(os.path.join(job_dir, '..',
                                                                upload_output))
-            cmds.append('nohup %s  &> ../%s  &\n' % (upload_cmd, upload_output))
+            upload_cmd = 'cd %s\n%s' % (
+                job_dir, _background_command(upload_cmd,
+                                             '../%s' % upload_output))
 
-            upload_cmd = _put_script(conn, '\n'.join(cmds))
-            output = conn.execute(upload_cmd)
-
-            # Remove upload script
-            conn.remove(upload_cmd)
+            # Put girder client on master and start the upload in one go
+            results = conn.execute_many(
+                _stage_girder_client(cluster, conn, girder_client_path) +
+                [upload_cmd], stop_on_error=True)
+            check_results(results)
+            output = results[-1].stdout
 
         if len(output) != 1:
             raise Exception('PID not returned by execute command')
@@ -780,7 +1101,9 @@ def upload_job_output_to_folder(cluster, job, log_write_url=None, job_dir=None,
         job_dir = job['dir']
 
     try:
-        with get_connection(girder_token, cluster) as conn:
+        with get_connection(girder_token, cluster) as conn, \
+                transfer_lease(cluster, girder_token, conn,
+                               owner_id=job.get('userId')):
             for output in job['output']:
                 if 'folderId' in output and 'path' in output:
                     folder_id = output['folderId']
@@ -788,7 +1111,11 @@ def upload_job_output_to_folder(cluster, job, log_write_url=None, job_dir=None,
                     download_path(conn, girder_token, folder_id, path,
                                   assetstore_base_url, assetstore_id,
                                   include=output.get('include'),
-                                  exclude=output.get('exclude'))
+                                  exclude=output.get('exclude'),
+                                  bulk=output.get('bulk', False),
+                                  compress=output.get('compress', False),
+                                  sync=output.get('sync', False),
+                                  checksum=output.get('checksum', False))
     except HttpError as e:
         job['status'] = JobState.ERROR
         url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl, job['_id'])
@@ -915,66 +1242,90 @@ def monitor_process(task, cluster, job, pid, nohup_out_path,
         raise
 
 
-@command.task
-def terminate_job(cluster, job, log_write_url=None, girder_token=None):
-    script_filepath = None
-    headers = {'Girder-Token':  girder_token}
-    job_id = job['_id']
-    status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job_id)
+def _run_on_terminate(conn, cluster, job, log_write_url, girder_token):
+    """
+    Run the onTerminate commands of a job in the background, monitoring the
+    process they run in.
+    """
+    commands = '\n'.join(job['onTerminate']['commands']) + '\n'
+    commands = Template(commands) \
+        .render(cluster=cluster,
+                job=job,
+                base_url=cumulus.config.girder.baseUrl)
+
+    terminate_output = '%s.terminate.out' % job['_id']
+    terminate_cmd = _background_command(
+        'bash -c %s' % quote(commands), terminate_output)
+    results = conn.execute_many([terminate_cmd])
+    check_results(results)
+    output = results[0].stdout
+
+    if len(output) != 1:
+        raise Exception('PID not returned by execute command')
 
     try:
+        pid = int(output[0])
+    except ValueError:
+        raise Exception('Unable to extract PID from: %s'
+                        % output)
 
-        with get_connection(girder_token, cluster) as conn:
-            if AbstractQueueAdapter.QUEUE_JOB_ID in job:
-                queue_adapter = get_queue_adapter(cluster, conn)
-                output = queue_adapter.terminate_job(job)
-            else:
-                r = requests.patch(status_url, headers=headers,
-                                   json={'status': JobState.TERMINATED})
-                check_status(r)
+    output_message = 'onTerminate error: %s'
+    monitor_process.delay(cluster, job, pid, terminate_output,
+                          log_write_url=log_write_url,
+                          output_message=output_message,
+                          girder_token=girder_token)
 
-            if 'onTerminate' in job:
-                commands = '\n'.join(job['onTerminate']['commands']) + '\n'
-                commands = Template(commands) \
-                    .render(cluster=cluster,
-                            job=job,
-                            base_url=cumulus.config.girder.baseUrl)
 
-                on_terminate = _put_script(conn, commands + '\n')
+def _terminate_jobs(cluster, jobs, log_write_url=None, girder_token=None):
+    headers = {'Girder-Token':  girder_token}
 
-                terminate_output = '%s.terminate.out' % job_id
-                terminate_cmd = 'nohup %s  &> %s  &\n' % (on_terminate,
-                                                          terminate_output)
-                terminate_cmd = _put_script(conn, terminate_cmd)
-                output = conn.execute(terminate_cmd)
+    try:
+        with get_connection(girder_token, cluster) as conn:
+            # The jobs in the queue are terminated with as few scheduler
+            # invocations as possible, the monitor moves them on once they
+            # have left the queue.
+            queued = [job for job in jobs
+                      if AbstractQueueAdapter.QUEUE_JOB_ID in job]
+            if queued:
+                get_queue_adapter(cluster, conn).terminate_jobs(queued)
+
+            for job in jobs:
+                if AbstractQueueAdapter.QUEUE_JOB_ID not in job:
+                    status_url = '%s/jobs/%s' % (
+                        cumulus.config.girder.baseUrl, job['_id'])
+                    r = requests.patch(status_url, headers=headers,
+                                       json={'status': JobState.TERMINATED})
+                    check_status(r)
 
-                conn.remove(on_terminate)
-                conn.remove(terminate_cmd)
+                if 'onTerminate' in job:
+                    _run_on_terminate(conn, cluster, job, log_write_url,
+                                      girder_token)
 
-                if len(output) != 1:
-                    raise Exception('PID not returned by execute command')
+    except Exception as ex:
+        for job in jobs:
+            status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
+                                         job['_id'])
+            r = requests.patch(status_url, headers=headers,
+                               json={'status': JobState.UNEXPECTEDERROR})
+            check_status(r)
+            get_job_logger(job, girder_token).exception(str(ex))
+        raise
 
-                try:
-                    pid = int(output[0])
-                except ValueError:
-                    raise Exception('Unable to extract PID from: %s'
-                                    % output)
 
-                output_message = 'onTerminate error: %s'
-                monitor_process.delay(cluster, job, pid, terminate_output,
-                                      log_write_url=log_write_url,
-                                      output_message=output_message,
-                                      girder_token=girder_token)
+@command.task
+def terminate_job(cluster, job, log_write_url=None, girder_token=None):
+    _terminate_jobs(cluster, [job], log_write_url=log_write_url,
+                    girder_token=girder_token)
+
 
-    except Exception as ex:
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': JobState.UNEXPECTEDERROR})
-        check_status(r)
-        get_job_logger(job, girder_token).exception(str(ex))
-        raise
-    finally:
-        if script_filepath and os.path.exists(script_filepath):
-            os.remove(script_filepath)
+@command.task
+def terminate_jobs(cluster, jobs, log_write_url=None, girder_token=None):
+    """
+    Terminate jobs on a cluster over a single connection, the scheduler is
+    passed all the queue job ids at once.
+    """
+    _terminate_jobs(cluster, jobs, log_write_url=log_write_url,
+                    girder_token=girder_token)
 
 
 @command.task(bind=True, max_retries=5)
@@ -14,5 +14,12 @@
 {% if account -%}
 #PBS -A {{account}}
 {% endif -%}
+{% if arraySize -%}
+#PBS -t 0-{{arraySize - 1}}
+{% endif -%}
 cd $PBS_O_WORKDIR
+{% if arraySize -%}
+export CUMULUS_ARRAY_INDEX=${PBS_ARRAY_INDEX:-$PBS_ARRAYID}
+export CUMULUS_QUEUE_JOB_ID=${PBS_JOBID%%.*}
+{% endif -%}
 
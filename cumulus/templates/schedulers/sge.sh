@@ -17,6 +17,13 @@
 {% if account -%}
 #$ -A {{account}}
 {% endif -%}
+{% if arraySize -%}
+#$ -t 1-{{arraySize}}
+{% endif -%}
 
 cd $SGE_O_WORKDIR
+{% if arraySize -%}
+export CUMULUS_ARRAY_INDEX=$((SGE_TASK_ID - 1))
+export CUMULUS_QUEUE_JOB_ID=$JOB_ID.$SGE_TASK_ID
+{% endif -%}
 
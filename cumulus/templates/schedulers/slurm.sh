@@ -1,7 +1,13 @@
 #
 #SBATCH --job-name={{job.name}}-{{job._id}}
+{% if arraySize -%}
+#SBATCH --array=0-{{arraySize - 1}}
+#SBATCH --output={{job.name}}-{{job._id}}.o%A_%a
+#SBATCH --error={{job.name}}-{{job._id}}.e%A_%a
+{% else -%}
 #SBATCH --output={{job.name}}-{{job._id}}.o%j
 #SBATCH --error={{job.name}}-{{job._id}}.e%j
+{% endif -%}
 #SBATCH --chdir={{job.dir}}
 {% if numberOfSlots -%}
 #SBATCH --ntasks={{numberOfSlots}}
@@ -29,3 +35,7 @@
 {% if constraint -%}
 #SBATCH --constraint={{constraint}}
 {% endif -%}
+{% if arraySize -%}
+export CUMULUS_ARRAY_INDEX=$SLURM_ARRAY_TASK_ID
+export CUMULUS_QUEUE_JOB_ID=${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}
+{% endif -%}
@@ -8,8 +8,47 @@
 #
 {% include "schedulers/" + cluster.config.scheduler.type + ".sh" -%}
 
+{% if completionCallbackUrl %}
+# Report the exit code of the job to Girder when the script exits, so the job
+# is moved on without waiting for the scheduler to be polled.
+CUMULUS_START_TIME=$(date +%s)
+cumulus_report_completion() {
+    exit_code=$?
+    if command -v curl > /dev/null 2>&1; then
+        curl --silent --max-time 30 -X PUT \
+            -H "Content-Type: application/json" \
+            -d "{\"secret\": \"$CUMULUS_CALLBACK_SECRET\", \"exitCode\": $exit_code, \"startTime\": $CUMULUS_START_TIME, \"endTime\": $(date +%s)}" \
+            "{{ completionCallbackUrl }}/$CUMULUS_JOB_ID/complete" > /dev/null 2>&1
+    fi
+}
+trap cumulus_report_completion EXIT
+{% if not arrayJobs -%}
+CUMULUS_JOB_ID={{ job._id }}
+CUMULUS_CALLBACK_SECRET={{ job.callbackSecret }}
+{% endif -%}
+{% endif -%}
+{% if arrayJobs %}
+# Each element of the array runs the commands of its own job, in its own
+# directory and with its own output files.
+case $CUMULUS_ARRAY_INDEX in
+{% for element in arrayJobs -%}
+{{ loop.index0 }})
+cd {{ element.dir }}
+exec > {{ element.name }}-{{ element._id }}.o$CUMULUS_QUEUE_JOB_ID 2> {{ element.name }}-{{ element._id }}.e$CUMULUS_QUEUE_JOB_ID
+{% if element.callbackSecret -%}
+CUMULUS_JOB_ID={{ element._id }}
+CUMULUS_CALLBACK_SECRET={{ element.callbackSecret }}
+{% endif -%}
+{% for command in element.commands -%}
+{{ command }}
+{% endfor -%}
+;;
+{% endfor -%}
+esac
+{%- else -%}
 {% for command in job.commands %}
 {{ command -}}
 {% endfor %}
+{%- endif %}
 
 
@@ -18,14 +18,145 @@
 ###############################################################################
 
 
+from .batch import batch_script, parse_batch_output, new_marker, quote
+from .transfer import RangeReader
+from .walk import walk_command, parse_entries
+from .scheduler import ThrottledStream
+
+# The streams output is read from by execute_stream(...)
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+
 class AbstractConnection(object):
 
+    # The Throttle limiting the rate of transfers, see set_throttle(...)
+    _throttle = None
+
+    def set_throttle(self, throttle):
+        """
+        Limit the rate data is moved by get(...), put(...), put_ranges(...)
+        and open_command(...) using throttle, None removes the limit.
+        """
+        self._throttle = throttle
+
+    def _throttled(self, stream):
+        if self._throttle is None:
+            return stream
+
+        return ThrottledStream(stream, self._throttle)
+
+    def _throttled_range(self, read_range):
+        throttle = self._throttle
+        if throttle is None:
+            return read_range
+
+        def _read_range(offset, length):
+            data = read_range(offset, length)
+            throttle.consume(len(data))
+
+            return data
+
+        return _read_range
+
     def execute(self, command, ignore_exit_status=False, source_profile=True):
         raise NotImplementedError('Implemented by subclass')
 
-    def get(self, remote_path):
+    def execute_stream(self, command, ignore_exit_status=False,
+                       source_profile=True, max_bytes=None, chunks=False):
+        """
+        Run a command yielding its output as it is produced rather than
+        returning it once the command has completed.
+
+        :param max_bytes: Stop reading once this many bytes have been received,
+                          only complete lines are yielded when this is hit.
+        :param chunks: Yield byte chunks rather than lines.
+        :returns A generator of ( stream, data ) tuples where stream is STDOUT
+                 or STDERR.
+
+        This default implementation just yields the output of execute(...).
+        """
+        received = 0
+        for line in self.execute(command,
+                                 ignore_exit_status=ignore_exit_status,
+                                 source_profile=source_profile):
+            received += len(line)
+            if max_bytes is not None and received > max_bytes:
+                break
+            yield (STDOUT, line.encode('utf8') if chunks else line)
+
+    def _execute_batch(self, script, source_profile=True):
+        return self.execute(script, source_profile=source_profile)
+
+    def execute_many(self, commands, source_profile=True,
+                     stop_on_error=False):
+        """
+        Run a list of commands in a single remote shell invocation.
+
+        :param commands: The commands to run, in order.
+        :param source_profile: Source the login profile first.
+        :param stop_on_error: Don't run the remaining commands once one fails.
+        :returns A list of CommandResult ( command, exit_code, stdout, stderr )
+                 one per command. stdout and stderr are lists of lines, the
+                 exit_code of a command that wasn't run is None.
+        """
+        if not commands:
+            return []
+
+        marker = new_marker()
+        script = batch_script(commands, marker, stop_on_error=stop_on_error)
+        output = self._execute_batch(script, source_profile=source_profile)
+
+        return parse_batch_output(commands, output, marker)
+
+    def open_command(self, command, source_profile=True):
+        """
+        Context manager running a command with its stdin and stdout exposed as
+        file objects, used to stream data through a single command.
+
+        :returns An object with stdin and stdout file objects, close_stdin()
+                 to signal the end of input and wait() which blocks until
+                 the command exits, raising an exception if it failed.
+        """
         raise NotImplementedError('Implemented by subclass')
 
+    def get(self, remote_path, offset=0):
+        """
+        Context manager returning a file like object to read remote_path,
+        starting at offset.
+        """
+        raise NotImplementedError('Implemented by subclass')
+
+    def read_range(self, remote_path, offset=0, length=None):
+        """
+        Read part of a file without transferring the whole file.
+
+        :param offset: The offset to start reading at, a negative offset is
+                       relative to the end of the file.
+        :param length: The maximum number of bytes to read, None reads to the
+                       end of the file.
+        :returns The bytes read.
+
+        This default implementation runs tail and head on the cluster.
+        """
+        if offset < 0:
+            command = 'tail -c %d %s' % (-offset, quote(remote_path))
+        else:
+            command = 'tail -c +%d %s' % (offset + 1, quote(remote_path))
+        if length is not None:
+            command += ' | head -c %d' % length
+
+        return b''.join(data for (stream, data) in
+                        self.execute_stream(command, chunks=True,
+                                            source_profile=False)
+                        if stream == STDOUT)
+
+    def tail(self, remote_path, nbytes):
+        """
+        Returns the last nbytes of remote_path.
+        """
+        return self.read_range(remote_path, offset=-nbytes)
+
     def isfile(self, remote_path):
         raise NotImplementedError('Implemented by subclass')
 
@@ -38,12 +169,59 @@ class AbstractConnection(object):
     def put(self, stream, remote_path):
         raise NotImplementedError('Implemented by subclass')
 
+    def put_ranges(self, read_range, size, remote_path, offset=0,
+                   progress=None):
+        """
+        Write a file whose content is read by range, this allows transports
+        that support it to move the ranges concurrently.
+
+        :param read_range: Callable taking ( offset, length ) returning the
+                           bytes in that range.
+        :param size: The size of the file.
+        :param remote_path: The path to write to.
+        :param offset: The offset a previous attempt wrote the file up to,
+                       transports that can resume only write the rest.
+        :param progress: Callable taking the offset the file has been written
+                         up to, called by transports that can resume.
+
+        This default implementation writes the whole file as a single stream,
+        from the start whatever the offset, progress is called once it has
+        been written.
+        """
+        self.put(RangeReader(read_range, size), remote_path)
+        if progress is not None:
+            progress(size)
+
     def stat(self):
         raise NotImplementedError('Implemented by subclass')
 
     def remove(self, remote_path):
         raise NotImplementedError('Implemented by subclass')
 
+    def walk(self, root_path, max_depth=None):
+        """
+        Enumerate the entries under root_path using a single remote command,
+        rather than a listing per directory.
+
+        :param root_path: The directory to walk.
+        :param max_depth: Only descend this many levels, 1 lists just the
+                          entries in root_path.
+        :returns A generator of objects of the form:
+
+        {
+            'path': <path relative to root_path>,
+            'name': <name>,
+            'mode': <mode>,
+            'size': <size>,
+            'mtime': <mtime>
+        }
+        """
+        chunks = (data for (stream, data) in
+                  self.execute_stream(walk_command(root_path, max_depth),
+                                      chunks=True) if stream == STDOUT)
+
+        return parse_entries(chunks)
+
     def list(self, remove_path):
         """
         Returns an array of objects of the form:
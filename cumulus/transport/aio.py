@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import functools
+import io
+import threading
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+from .ssh import SshClusterConnection
+from .newt import NewtClusterConnection
+
+ssh_cluster = ['trad', 'ec2']
+
+# The default size of the pool shared by all async connections, configured
+# using transport.async.maxWorkers.
+MAX_WORKERS = 32
+
+# The size of the parts a file is read in by SyncConnection.get
+GET_CHUNK_SIZE = 1024 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the executor shared by async connections. The blocking transport
+    calls run on this bounded pool, so the number of threads doesn't grow
+    with the number of clusters. Each operation in flight still holds one of
+    its threads, once more than transport.async.maxWorkers clusters are busy
+    the remaining operations wait for a thread, so the pool should be sized
+    for the number of clusters polled at once.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            max_workers = get_property('transport.async.maxWorkers',
+                                       cumulus.config, default=MAX_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    return _executor
+
+
+class AsyncConnection(object):
+    """
+    Async counterpart to AbstractConnection. Operations on a connection are
+    serialized, operations on different connections run concurrently, up to
+    the size of the executor. The operations are the blocking transport run
+    on the executor rather than a native async SSH or HTTP client.
+    """
+    def __init__(self, connection, executor=None):
+        self._connection = connection
+        self._executor = executor
+        self._lock = None
+
+    async def _call(self, func, *args, **kwargs):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        loop = asyncio.get_event_loop()
+        executor = self._executor or get_executor()
+        async with self._lock:
+            return await loop.run_in_executor(
+                executor, functools.partial(func, *args, **kwargs))
+
+    async def __aenter__(self):
+        await self._call(self._connection.__enter__)
+
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self._call(self._connection.__exit__, type, value, traceback)
+
+    async def execute(self, command, ignore_exit_status=False,
+                      source_profile=True):
+        return await self._call(self._connection.execute, command,
+                                ignore_exit_status=ignore_exit_status,
+                                source_profile=source_profile)
+
+    async def execute_many(self, commands, source_profile=True,
+                           stop_on_error=False):
+        return await self._call(self._connection.execute_many, commands,
+                                source_profile=source_profile,
+                                stop_on_error=stop_on_error)
+
+    async def get(self, remote_path):
+        """
+        Returns the content of remote_path, the whole file is read into
+        memory so read_range should be used to read large files in parts.
+        """
+        def _get():
+            with self._connection.get(remote_path) as fp:
+                return fp.read()
+
+        return await self._call(_get)
+
+    async def read_range(self, remote_path, offset=0, length=None):
+        return await self._call(self._connection.read_range, remote_path,
+                                offset=offset, length=length)
+
+    async def tail(self, remote_path, nbytes):
+        return await self._call(self._connection.tail, remote_path, nbytes)
+
+    async def put(self, data, remote_path):
+        """
+        Write data to remote_path, data may be bytes or a file like object.
+        """
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+
+        return await self._call(self._connection.put, data, remote_path)
+
+    async def list(self, remote_path):
+        return await self._call(
+            lambda: list(self._connection.list(remote_path)))
+
+    async def walk(self, root_path, max_depth=None):
+        return await self._call(
+            lambda: list(self._connection.walk(root_path,
+                                               max_depth=max_depth)))
+
+    async def stat(self, remote_path):
+        return await self._call(self._connection.stat, remote_path)
+
+    async def isfile(self, remote_path):
+        return await self._call(self._connection.isfile, remote_path)
+
+    async def run(self, func):
+        """
+        Run a callable taking the underlying blocking connection, this allows
+        existing code such as the queue adapters to be used, for example:
+
+            await conn.run(
+                lambda c: get_queue_adapter(cluster, c).job_statuses(jobs))
+        """
+        return await self._call(func, self._connection)
+
+
+class AsyncSshClusterConnection(AsyncConnection):
+    def __init__(self, girder_token, cluster, executor=None):
+        super(AsyncSshClusterConnection, self).__init__(
+            SshClusterConnection(girder_token, cluster), executor=executor)
+
+
+class AsyncNewtClusterConnection(AsyncConnection):
+    def __init__(self, girder_token, cluster, executor=None):
+        super(AsyncNewtClusterConnection, self).__init__(
+            NewtClusterConnection(girder_token, cluster), executor=executor)
+
+
+def get_async_connection(girder_token, cluster, executor=None):
+    if cluster['type'] in ssh_cluster:
+        return AsyncSshClusterConnection(girder_token, cluster,
+                                         executor=executor)
+    elif cluster['type'] == 'newt':
+        return AsyncNewtClusterConnection(girder_token, cluster,
+                                          executor=executor)
+    else:
+        raise Exception('Unsupported cluster type: %s' % cluster['type'])
+
+
+class _RangeReader(io.RawIOBase):
+    """
+    Raw stream reading a remote file in parts using read_range.
+    """
+    def __init__(self, connection, remote_path, offset):
+        self._connection = connection
+        self._remote_path = remote_path
+        self._offset = offset
+
+    def readable(self):
+        return True
+
+    def _read(self, length):
+        data = self._connection.read_range(self._remote_path,
+                                           offset=self._offset, length=length)
+        self._offset += len(data)
+
+        return data
+
+    def readinto(self, b):
+        data = self._read(len(b))
+        b[:len(data)] = data
+
+        return len(data)
+
+    def readall(self):
+        return self._read(None)
+
+
+class SyncConnection(object):
+    """
+    Synchronous shim over an AsyncConnection, each call runs to completion
+    on an event loop owned by the shim.
+    """
+    def __init__(self, async_connection):
+        self._connection = async_connection
+        self._loop = asyncio.new_event_loop()
+
+    def _run(self, coroutine):
+        return self._loop.run_until_complete(coroutine)
+
+    def __enter__(self):
+        self._run(self._connection.__aenter__())
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            self._run(self._connection.__aexit__(type, value, traceback))
+        finally:
+            self._loop.close()
+
+    def execute(self, command, ignore_exit_status=False, source_profile=True):
+        return self._run(self._connection.execute(
+            command, ignore_exit_status=ignore_exit_status,
+            source_profile=source_profile))
+
+    def execute_many(self, commands, source_profile=True,
+                     stop_on_error=False):
+        return self._run(self._connection.execute_many(
+            commands, source_profile=source_profile,
+            stop_on_error=stop_on_error))
+
+    @contextmanager
+    def get(self, remote_path, offset=0):
+        """
+        Context manager returning a file like object to read remote_path,
+        starting at offset. The file is read in parts rather than into memory.
+        """
+        raw = _RangeReader(self, remote_path, offset)
+        with io.BufferedReader(raw, buffer_size=GET_CHUNK_SIZE) as fp:
+            yield fp
+
+    def read_range(self, remote_path, offset=0, length=None):
+        return self._run(self._connection.read_range(
+            remote_path, offset=offset, length=length))
+
+    def tail(self, remote_path, nbytes):
+        return self._run(self._connection.tail(remote_path, nbytes))
+
+    def put(self, data, remote_path):
+        return self._run(self._connection.put(data, remote_path))
+
+    def list(self, remote_path):
+        return self._run(self._connection.list(remote_path))
+
+    def walk(self, root_path, max_depth=None):
+        return self._run(self._connection.walk(root_path,
+                                               max_depth=max_depth))
+
+    def stat(self, remote_path):
+        return self._run(self._connection.stat(remote_path))
+
+    def isfile(self, remote_path):
+        return self._run(self._connection.isfile(remote_path))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from collections import namedtuple
+import uuid
+
+from six.moves import shlex_quote as quote
+
+CommandResult = namedtuple('CommandResult',
+                           ['command', 'exit_code', 'stdout', 'stderr'])
+
+
+class BatchOutputError(Exception):
+    """
+    Raised when the output of a batch can't be split back up, so the result
+    of its commands is unknown. This is distinct from a command failing.
+    """
+    pass
+
+
+def write_file_command(path, content, mode=None):
+    """
+    Returns a shell command that writes content to path using a here
+    document, optionally setting the file mode. This allows a file to be
+    staged as part of a batch rather than with a separate put.
+
+    :param path: The remote path to write to.
+    :param content: The file content.
+    :param mode: Optional mode, for example '700'.
+    """
+    delimiter = 'CUMULUS_EOF_%s' % uuid.uuid4().hex
+    if not content.endswith('\n'):
+        content += '\n'
+
+    command = 'cat > %s <<\'%s\'' % (quote(path), delimiter)
+    if mode:
+        command += ' && chmod %s %s' % (mode, quote(path))
+
+    return '%s\n%s%s' % (command, content, delimiter)
+
+
+def batch_script(commands, marker, stop_on_error=False):
+    """
+    Generate the shell script used to run commands in a single invocation.
+    Each command runs in its own subshell with its stdout and stderr
+    captured to temporary files on the remote host, they are then written
+    back framed by marker so they can be split up again.
+
+    :param commands: The list of commands to run.
+    :param marker: The marker used to frame the output of each command.
+    :param stop_on_error: If True no further commands are run once a command
+                          exits with a non zero status.
+    """
+    lines = [
+        '_cumulus_dir=$(mktemp -d) || exit 1'
+    ]
+    for (index, command) in enumerate(commands):
+        out = '"$_cumulus_dir/%d.out"' % index
+        err = '"$_cumulus_dir/%d.err"' % index
+        lines += [
+            '(',
+            command,
+            ') > %s 2> %s' % (out, err),
+            '_cumulus_rc=$?',
+            'echo "%s out %d"' % (marker, index),
+            'awk 1 %s' % out,
+            'echo "%s err %d"' % (marker, index),
+            'awk 1 %s' % err,
+            'echo "%s rc %d $_cumulus_rc"' % (marker, index)
+        ]
+        if stop_on_error:
+            lines.append('[ $_cumulus_rc -eq 0 ] || '
+                         '{ rm -rf "$_cumulus_dir"; exit 0; }')
+
+    lines.append('rm -rf "$_cumulus_dir"')
+
+    return '\n'.join(lines)
+
+
+def parse_batch_output(commands, output, marker):
+    """
+    Split the framed output of a batch script back into a CommandResult per
+    command. Commands that were not run ( stop_on_error ) have an exit_code
+    of None.
+    """
+    stdout = [[] for _ in commands]
+    stderr = [[] for _ in commands]
+    exit_codes = [None] * len(commands)
+    current = None
+
+    for line in output:
+        line = line.rstrip('\n')
+        if line.startswith(marker):
+            parts = line[len(marker):].split()
+            stream = parts[0]
+            index = int(parts[1])
+            if stream == 'out':
+                current = stdout[index]
+            elif stream == 'err':
+                current = stderr[index]
+            else:
+                exit_codes[index] = int(parts[2])
+                current = None
+        elif current is not None:
+            current.append(line)
+
+    if commands and exit_codes[0] is None:
+        raise BatchOutputError('Unable to parse batch output: %s' % output)
+
+    return [CommandResult(command, exit_code, out, err)
+            for (command, exit_code, out, err)
+            in zip(commands, exit_codes, stdout, stderr)]
+
+
+def new_marker():
+    return '__cumulus_%s__' % uuid.uuid4().hex
+
+
+def check_results(results):
+    """
+    Raise an exception for the first command in a batch that failed.
+    """
+    for result in results:
+        if result.exit_code:
+            raise Exception('"%s" failed with %s: %s'
+                            % (result.command, result.exit_code,
+                               '\n'.join(result.stderr + result.stdout)))
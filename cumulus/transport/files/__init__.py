@@ -25,6 +25,20 @@ from cumulus.common import check_status
 ssh_cluster = ['trad', 'ec2']
 
 
+def tar_mode(direction, compress=False):
+    """
+    Returns the tarfile stream mode and the tar flag to use on the cluster for
+    a bulk transfer.
+
+    :param direction: 'r' or 'w'
+    :param compress: Compress the stream with gzip.
+    """
+    if compress:
+        return ('%s|gz' % direction, 'z')
+
+    return ('%s|' % direction, '')
+
+
 def get_assetstore_url_base(cluster):
     if cluster['type'] in ssh_cluster:
         return 'sftp_assetstores'
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import json
+import logging
+import os
+import threading
+import time
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+from cumulus.transport.batch import check_results, quote, \
+    write_file_command
+from cumulus.transport.files.sync import CHECKPOINT_NAME, \
+    manifest_from_list, manifest_to_list
+
+logger = logging.getLogger('cumulus')
+
+# The folder metadata key holding the checkpoint of a folder that is being
+# imported into.
+CHECKPOINT_METADATA_KEY = 'cumulusCheckpoint'
+
+# How often, in seconds, the checkpoint is saved while a transfer runs. This
+# can be overridden by transfer.checkpointInterval in the config.
+CHECKPOINT_INTERVAL = 30
+
+
+class FolderStore(object):
+    """
+    Keeps a checkpoint in the metadata of a Girder folder.
+    """
+    def __init__(self, girder_client, folder_id):
+        self._girder_client = girder_client
+        self._folder_id = folder_id
+
+    def load(self):
+        folder = self._girder_client.getFolder(self._folder_id)
+
+        return folder.get('meta', {}).get(CHECKPOINT_METADATA_KEY)
+
+    def save(self, doc):
+        self._girder_client.addMetadataToFolder(self._folder_id, {
+            CHECKPOINT_METADATA_KEY: doc
+        })
+
+    def clear(self):
+        # Setting a metadata key to null removes it
+        self._girder_client.addMetadataToFolder(self._folder_id, {
+            CHECKPOINT_METADATA_KEY: None
+        })
+
+
+class ClusterStore(object):
+    """
+    Keeps a checkpoint in a file in a directory on a cluster.
+    """
+    def __init__(self, cluster_connection, path):
+        self._cluster_connection = cluster_connection
+        self._path = os.path.join(path, CHECKPOINT_NAME)
+
+    def load(self):
+        results = self._cluster_connection.execute_many(
+            ['cat %s' % quote(self._path)], source_profile=False)
+        if results[0].exit_code != 0:
+            return None
+
+        try:
+            return json.loads(''.join(results[0].stdout))
+        except ValueError:
+            return None
+
+    def save(self, doc):
+        check_results(self._cluster_connection.execute_many(
+            [write_file_command(self._path, json.dumps(doc))],
+            source_profile=False))
+
+    def clear(self):
+        self._cluster_connection.execute_many(
+            ['rm -f %s' % quote(self._path)], source_profile=False)
+
+
+class Checkpoint(object):
+    """
+    Records the progress of a transfer so it can be resumed if the worker
+    dies or the connection drops. Each file transferred has an entry, keyed
+    by its path relative to the root of the transfer, the entry of a file
+    that has been transferred has done set, the entry of a partial file holds
+    what is needed to resume it.
+
+    :param store: Where the checkpoint is kept, a FolderStore or ClusterStore.
+    :param source: Identifies what is being transferred, a checkpoint left by
+                   a transfer of something else is ignored.
+    """
+    def __init__(self, store, source):
+        self._store = store
+        self._source = source
+        self._lock = threading.Lock()
+        self._interval = get_property('transfer.checkpointInterval',
+                                      cumulus.config,
+                                      default=CHECKPOINT_INTERVAL)
+        self._last_save = time.time()
+        self._dirty = False
+        self._saved = False
+        self.files = {}
+        # Set if the checkpoint was left by an earlier attempt, that attempt
+        # may have transferred files after the checkpoint was last saved.
+        self.resumed = False
+
+        doc = store.load()
+        if isinstance(doc, dict) and doc.get('source') == source:
+            self.files = manifest_from_list(doc.get('files'))
+            self._saved = True
+            self.resumed = True
+
+    def get(self, path):
+        with self._lock:
+            return self.files.get(path)
+
+    def completed(self, path, state, keys):
+        """
+        Returns True if path was transferred by a previous attempt and the
+        source still matches state for the given keys.
+        """
+        entry = self.get(path)
+        if entry is None or not entry.get('done'):
+            return False
+
+        return all(entry.get(key) == state.get(key) for key in keys)
+
+    def update(self, path, entry, save=False):
+        """
+        Record the entry for path, the checkpoint is saved once the interval
+        since the last save has passed or if save is set.
+        """
+        with self._lock:
+            self.files[path] = entry
+            self._dirty = True
+
+        if save or time.time() - self._last_save >= self._interval:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            self._store.save({
+                'source': self._source,
+                'files': manifest_to_list(self.files)
+            })
+            self._dirty = False
+            self._saved = True
+            self._last_save = time.time()
+
+    def save_quietly(self):
+        """
+        Save after a transfer has failed, the failure may have made the store
+        unreachable so errors are logged rather than raised.
+        """
+        try:
+            self.save()
+        except Exception:
+            logger.exception('Unable to save transfer checkpoint')
+
+    def clear(self):
+        """
+        Remove the checkpoint once the transfer is complete.
+        """
+        if self._saved:
+            self._store.clear()
+            self._saved = False
+        self._dirty = False
@@ -22,12 +22,26 @@ import stat
 import json
 import re
 import six
+import tarfile
+import threading
 
-from girder_client import GirderClient
+from girder_client import GirderClient, HttpError
 
 import cumulus
 from cumulus.transport import get_connection
-from cumulus.transport.files import get_assetstore_url_base, get_assetstore_id
+from cumulus.transport.scheduler import transfer_lease
+from cumulus.transport.batch import quote
+from cumulus.transport.transfer import transfer_config
+from cumulus.transport.files import get_assetstore_url_base, \
+    get_assetstore_id, tar_mode
+from cumulus.transport.files.checkpoint import Checkpoint, FolderStore
+from cumulus.transport.files.sync import remote_state, manifest_from_list, \
+    manifest_to_list, unchanged, CHECKPOINT_NAME, MANIFEST_METADATA_KEY, \
+    MANIFEST_NAME
+
+# The files cumulus keeps its own state in, left in a directory by an upload
+# to the cluster, these are never imported.
+_STATE_FILES = [MANIFEST_NAME, CHECKPOINT_NAME]
 
 
 def _include(path, includes, excludes):
@@ -39,6 +53,9 @@ def _include(path, includes, excludes):
     :returns True if the file path should be included, False
 
     """
+    if path in _STATE_FILES:
+        return False
+
     if includes is None:
         includes = []
 
@@ -123,9 +140,119 @@ def _ensure_path(girder_client, girder_folders, parent, path):
     return parent_id
 
 
+def _upload_file_resumable(cluster_connection, girder_client, item_id,
+                           cluster_path, name, size, checkpoint, key, state):
+    """
+    Upload a file into an item a chunk at a time, the upload is recorded in
+    the checkpoint so a later attempt can continue it from the offset Girder
+    has received.
+    """
+    (chunk_size, _, _) = transfer_config()
+    upload_id = None
+    offset = 0
+
+    previous = checkpoint.get(key)
+    if previous is not None and 'uploadId' in previous and \
+            all(previous.get(k) == state[k] for k in ['size', 'mtime']):
+        try:
+            offset = girder_client.get('file/offset', parameters={
+                'uploadId': previous['uploadId']
+            })['offset']
+            upload_id = previous['uploadId']
+        except HttpError:
+            # The upload has gone, start again
+            pass
+
+    if upload_id is None:
+        upload = girder_client.post('file', parameters={
+            'parentType': 'item',
+            'parentId': item_id,
+            'name': name,
+            'size': size
+        })
+        upload_id = upload['_id']
+        # Save now, the upload can only be continued if we know its id
+        checkpoint.update(key, dict(state, itemId=item_id,
+                                    uploadId=upload_id), save=True)
+
+    with cluster_connection.get(cluster_path, offset=offset) as stream:
+        while offset < size:
+            data = stream.read(min(chunk_size, size - offset))
+            if not data:
+                raise IOError('Unexpected end of %s at offset %d'
+                              % (cluster_path, offset))
+            girder_client.post('file/chunk', parameters={
+                'uploadId': upload_id,
+                'offset': offset
+            }, data=data)
+            offset += len(data)
+
+
+def _has_file(girder_client, item_id, name, size):
+    """
+    Returns True if the item already holds a complete file of the given name
+    and size.
+    """
+    return any(file['name'] == name and file['size'] == size
+               for file in girder_client.listFile(item_id))
+
+
+def _import_file(cluster_connection, girder_client, folder_id, root_path,
+                 path, size, assetstore_url, assetstore_id, upload=False,
+                 checkpoint=None, state=None):
+    """
+    Create an item for a single file on the cluster, either importing just
+    the metadata or uploading the file data.
+
+    :params path: The path of the file relative to root_path.
+    :params checkpoint: The Checkpoint recording the progress of the import,
+                        large uploads recorded in it are resumed.
+    :params state: The size and mtime of the file.
+    :returns The item created.
+    """
+    name = os.path.basename(path)
+    cluster_path = os.path.normpath(os.path.join(root_path, path))
+
+    previous = checkpoint.get(path) if checkpoint is not None else None
+    if upload and previous is not None and 'itemId' in previous:
+        # Reuse the item created by the previous attempt
+        item = {'_id': previous['itemId']}
+    elif checkpoint is not None and checkpoint.resumed:
+        # The previous attempt may have imported the file after the
+        # checkpoint was last saved, don't create a duplicate.
+        item = girder_client.createItem(folder_id, name, '',
+                                        reuseExisting=True)
+        if _has_file(girder_client, item['_id'], name, size):
+            return item
+    else:
+        item = girder_client.createItem(folder_id, name, '')
+
+    (chunk_size, _, _) = transfer_config()
+    if upload and checkpoint is not None and size > chunk_size:
+        _upload_file_resumable(cluster_connection, girder_client, item['_id'],
+                               cluster_path, name, size, checkpoint, path,
+                               state)
+    elif not upload:
+
+        url = '%s/%s/files' % (assetstore_url, assetstore_id)
+        body = {
+            'name': name,
+            'itemId': item['_id'],
+            'size': size,
+            'path': os.path.join(root_path, path)
+        }
+        girder_client.post(url, data=json.dumps(body))
+    else:
+        with cluster_connection.get(cluster_path) as stream:
+            girder_client.uploadFile(item['_id'], stream, name, size,
+                                     parentType='item')
+
+    return item
+
+
 def _import_path(cluster_connection, girder_client, parent, root_path,
                  assetstore_url, assetstore_id, upload=False,
-                 include=None, exclude=None, path='.', girder_folders=None):
+                 include=None, exclude=None):
     """
     :params cluster_connection: The cluster connection to access the cluster.
     :params girder_client: The Girder client to use to access Girder.
@@ -137,68 +264,177 @@ def _import_path(cluster_connection, girder_client, parent, root_path,
                     the metadata, the default is False.
     :params include: List of include regexs
     :params exclude: List of exclude regexs,
-    :params path: The current subdirectory of root_path that is being imported.
+
+    A checkpoint of the files imported is kept in the metadata of parent, if
+    the import fails it is resumed from the checkpoint the next time the path
+    is imported into parent.
     """
-    if girder_folders is None:
-        girder_folders = {}
+    girder_folders = {}
 
     if root_path[0] != '/':
         # If we don't have a full path, assume the path is relative to the users
         # home directory.
-        home = cluster_connection.execute('pwd')[0]
+        home = cluster_connection.execute('pwd')[0].strip()
         root_path = os.path.abspath(os.path.join(home, root_path))
 
-    cluster_path = os.path.normpath(os.path.join(root_path, path))
-    for p in cluster_connection.list(cluster_path):
-        name = p['name']
+    checkpoint = Checkpoint(FolderStore(girder_client, parent), root_path)
+    try:
+        # The whole tree is enumerated by a single command
+        for entry in cluster_connection.walk(root_path):
+            if stat.S_ISDIR(entry['mode']):
+                continue
 
-        full_path = os.path.normpath(os.path.join(path, name))
-        if name in ['.', '..']:
-            continue
-
-        if stat.S_ISDIR(p['mode']):
-            _import_path(cluster_connection, girder_client, parent,
-                         root_path, assetstore_url, assetstore_id,
-                         upload=upload, path=full_path,
-                         include=include,
-                         exclude=exclude, girder_folders=girder_folders)
-        else:
+            full_path = os.path.normpath(entry['path'])
 
             # Should we include this path?
             if not _include(full_path, include, exclude):
                 continue
 
+            state = {
+                'size': entry['size'],
+                'mtime': entry['mtime']
+            }
+            if checkpoint.completed(full_path, state, ['size', 'mtime']):
+                continue
+
             # Create any folders we might need
-            if path == '.':
+            path = os.path.dirname(full_path)
+            if not path:
                 folder_id = parent
             else:
-                folder_id = _ensure_path(girder_client, girder_folders, parent,
-                                         path)
+                folder_id = _ensure_path(girder_client, girder_folders,
+                                         parent, path)
 
-            size = p['size']
-            item = girder_client.createItem(folder_id, name, '')
+            _import_file(cluster_connection, girder_client, folder_id,
+                         root_path, full_path, entry['size'], assetstore_url,
+                         assetstore_id, upload=upload, checkpoint=checkpoint,
+                         state=state)
+            checkpoint.update(full_path, dict(state, done=True))
+    except Exception:
+        checkpoint.save_quietly()
+        raise
+
+    checkpoint.clear()
 
-            if not upload:
 
-                url = '%s/%s/files' % (assetstore_url, assetstore_id)
-                body = {
-                    'name': name,
-                    'itemId': item['_id'],
-                    'size': size,
-                    'path': os.path.join(root_path, full_path)
-                }
-                girder_client.post(url, data=json.dumps(body))
+def _import_path_sync(cluster_connection, girder_client, parent, root_path,
+                      assetstore_url, assetstore_id, upload=False,
+                      include=None, exclude=None, checksum=False):
+    """
+    Import only the files that are new or have changed since the last sync of
+    root_path into parent. The state of the files is recorded in a manifest
+    held in the metadata of the parent folder.
+    """
+    if root_path[0] != '/':
+        home = cluster_connection.execute('pwd')[0].strip()
+        root_path = os.path.abspath(os.path.join(home, root_path))
+
+    (files, _) = remote_state(cluster_connection, root_path,
+                              checksum=checksum)
+    folder = girder_client.getFolder(parent)
+    manifest = manifest_from_list(
+        folder.get('meta', {}).get(MANIFEST_METADATA_KEY))
+
+    new_manifest = {}
+    girder_folders = {}
+    for path in sorted(files):
+        if not _include(path, include, exclude):
+            continue
+
+        state = files[path]
+        previous = manifest.get(path)
+        if unchanged(previous, state, ['size', 'mtime', 'checksum']):
+            new_manifest[path] = previous
+            continue
+
+        # Replace the item from the previous sync
+        if previous and 'itemId' in previous:
+            try:
+                girder_client.delete('item/%s' % previous['itemId'])
+            except HttpError:
+                pass
+
+        dirname = os.path.dirname(path)
+        if not dirname:
+            folder_id = parent
+        else:
+            folder_id = _ensure_path(girder_client, girder_folders, parent,
+                                     dirname)
+
+        item = _import_file(cluster_connection, girder_client, folder_id,
+                            root_path, path, state['size'], assetstore_url,
+                            assetstore_id, upload=upload)
+        new_manifest[path] = dict(state, itemId=item['_id'])
+
+    girder_client.addMetadataToFolder(parent, {
+        MANIFEST_METADATA_KEY: manifest_to_list(new_manifest)
+    })
+
+
+def _write_file_list(cmd, paths):
+    try:
+        for path in paths:
+            cmd.stdin.write(path.encode('utf8') + b'\0')
+    finally:
+        cmd.close_stdin()
+
+
+def _import_path_bulk(cluster_connection, girder_client, parent, root_path,
+                      include=None, exclude=None, compress=False):
+    """
+    Import the files under root_path by streaming them as a single tar stream,
+    the file data is uploaded into Girder as each member is read.
+    """
+    if root_path[0] != '/':
+        home = cluster_connection.execute('pwd')[0].strip()
+        root_path = os.path.abspath(os.path.join(home, root_path))
+
+    # First get the list of files, so we only transfer what we need
+    paths = []
+    for entry in cluster_connection.walk(root_path):
+        if not stat.S_ISREG(entry['mode']):
+            continue
+        path = os.path.normpath(entry['path'])
+        if _include(path, include, exclude):
+            paths.append(path)
+
+    if not paths:
+        return
+
+    girder_folders = {}
+    (mode, flag) = tar_mode('r', compress)
+    command = 'tar -c%sf - -C %s --null -T -' % (flag, quote(root_path))
+    with cluster_connection.open_command(command) as cmd:
+        # Write the file list from a thread, tar may start producing output
+        # before it has read all of its input.
+        writer = threading.Thread(target=_write_file_list,
+                                  args=(cmd, paths))
+        writer.start()
+
+        tar = tarfile.open(mode=mode, fileobj=cmd.stdout)
+        for member in tar:
+            if not member.isfile():
+                continue
+
+            (path, name) = os.path.split(os.path.normpath(member.name))
+            if not path:
+                folder_id = parent
             else:
-                cluster_path = os.path.normpath(
-                    os.path.join(root_path, full_path))
-                with cluster_connection.get(cluster_path) as stream:
-                    girder_client.uploadFile(item['_id'], stream, name, size,
-                                             parentType='item')
+                folder_id = _ensure_path(girder_client, girder_folders,
+                                         parent, path)
+
+            item = girder_client.createItem(folder_id, name, '')
+            girder_client.uploadFile(item['_id'], tar.extractfile(member),
+                                     name, member.size, parentType='item')
+
+        writer.join()
+        cmd.wait()
 
 
 def download_path(cluster_connection, girder_token, parent, path,
                   assetstore_url, assetstore_id, upload=False, include=None,
-                  exclude=None):
+                  exclude=None, bulk=False, compress=False, sync=False,
+                  checksum=False):
     """
     Download a given path on a cluster into an assetstore.
 
@@ -212,17 +448,42 @@ def download_path(cluster_connection, girder_token, parent, path,
                     the metadata, the default is False.
     :params include: List of include regexs
     :params exclude: List of exclude regexs,
+    :params bulk: When uploading, transfer the files as a single tar stream
+                  rather than one at a time. Only supported by transports
+                  that can stream a command.
+    :params compress: Compress the tar stream in bulk mode.
+    :params sync: Only import files that are new or have changed since the
+                  last sync into parent.
+    :params checksum: In sync mode also compare a checksum of the files.
     """
     girder_client = GirderClient(apiUrl=cumulus.config.girder.baseUrl)
     girder_client.token = girder_token
 
+    if sync:
+        _import_path_sync(cluster_connection, girder_client, parent, path,
+                          assetstore_url, assetstore_id, upload=upload,
+                          include=include, exclude=exclude,
+                          checksum=checksum)
+        return
+
+    if upload and bulk:
+        try:
+            _import_path_bulk(cluster_connection, girder_client, parent, path,
+                              include=include, exclude=exclude,
+                              compress=compress)
+            return
+        except NotImplementedError:
+            pass
+
     _import_path(cluster_connection, girder_client, parent, path,
                  assetstore_url, assetstore_id, upload=upload, include=include,
                  exclude=exclude)
 
 
 def download_path_from_cluster(cluster, girder_token, parent, path,
-                               upload=False, include=None, exclude=None):
+                               upload=False, include=None, exclude=None,
+                               bulk=False, compress=False, sync=False,
+                               checksum=False):
     """
     Download a given path on a cluster into an assetstore.
 
@@ -238,7 +499,9 @@ def download_path_from_cluster(cluster, girder_token, parent, path,
     assetstore_base_url = get_assetstore_url_base(cluster)
     assetstore_id = get_assetstore_id(girder_token, cluster)
 
-    with get_connection(girder_token, cluster) as conn:
+    with get_connection(girder_token, cluster) as conn, \
+            transfer_lease(cluster, girder_token, conn):
         download_path(conn, girder_token, parent, path, assetstore_base_url,
                       assetstore_id, upload=upload, include=include,
-                      exclude=exclude)
+                      exclude=exclude, bulk=bulk, compress=compress,
+                      sync=sync, checksum=checksum)
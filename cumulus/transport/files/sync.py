@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import json
+import os
+
+from cumulus.transport.batch import quote
+
+# The manifest written into a directory on the cluster that has been synced
+# from Girder.
+MANIFEST_NAME = '.cumulus_manifest.json'
+
+# The checkpoint written into a directory on the cluster that is being
+# uploaded to.
+CHECKPOINT_NAME = '.cumulus_checkpoint.json'
+
+# Leaves the files cumulus keeps its own state in out of a find
+_EXCLUDE_STATE_FILES = '! -name %s ! -name %s' % (quote(MANIFEST_NAME),
+                                                  quote(CHECKPOINT_NAME))
+
+# The folder metadata key holding the manifest of a folder synced from a
+# cluster.
+MANIFEST_METADATA_KEY = 'cumulusManifest'
+
+
+def remote_state(cluster_connection, root_path, checksum=False,
+                 manifest=False):
+    """
+    Returns the state of the files under root_path on a cluster, computed
+    with a single batched command.
+
+    :param root_path: The directory to inspect.
+    :param checksum: Also compute a sha256 checksum of each file.
+    :param manifest: Also read the manifest written by a previous sync.
+    :returns A tuple ( files, manifest ), files is a dict mapping a path
+             relative to root_path to a dict with size, mtime and optionally
+             checksum. manifest is the previously written manifest or None.
+    """
+    root = quote(root_path)
+    commands = [
+        "cd %s && find . -type f %s -printf '%%P\\t%%s\\t%%T@\\n'"
+        % (root, _EXCLUDE_STATE_FILES)
+    ]
+    if checksum:
+        commands.append('cd %s && find . -type f %s -print0 '
+                        '| xargs -0 -r sha256sum'
+                        % (root, _EXCLUDE_STATE_FILES))
+    if manifest:
+        commands.append('cat %s' % quote(os.path.join(root_path,
+                                                      MANIFEST_NAME)))
+
+    results = cluster_connection.execute_many(commands)
+
+    files = {}
+    # If the directory doesn't exist yet there is nothing there
+    if results[0].exit_code != 0:
+        return (files, None)
+
+    for line in results[0].stdout:
+        parts = line.split('\t')
+        if len(parts) != 3:
+            continue
+        (path, size, mtime) = parts
+        files[path] = {
+            'size': int(size),
+            'mtime': mtime.strip()
+        }
+
+    if checksum and results[1].exit_code == 0:
+        for line in results[1].stdout:
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                continue
+            path = os.path.normpath(parts[1].strip())
+            if path in files:
+                files[path]['checksum'] = parts[0]
+
+    previous = None
+    if manifest and results[-1].exit_code == 0:
+        try:
+            previous = json.loads('\n'.join(results[-1].stdout))
+        except ValueError:
+            previous = None
+
+    return (files, previous)
+
+
+def manifest_to_list(manifest):
+    """
+    Girder metadata keys can't contain '.', so a manifest is stored as a list
+    of entries rather than keyed by path.
+    """
+    return [dict(entry, path=path) for (path, entry) in manifest.items()]
+
+
+def manifest_from_list(entries):
+    manifest = {}
+    for entry in entries or []:
+        entry = dict(entry)
+        manifest[entry.pop('path')] = entry
+
+    return manifest
+
+
+def unchanged(previous, current, keys):
+    """
+    Returns True if the previous manifest entry for a file matches its
+    current state for the given keys.
+    """
+    if previous is None or current is None:
+        return False
+
+    for key in keys:
+        if key not in current:
+            continue
+        if previous.get(key) != current[key]:
+            return False
+
+    return True
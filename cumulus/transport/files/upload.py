@@ -17,7 +17,9 @@
 #  limitations under the License.
 ###############################################################################
 
+import json
 import os
+import tarfile
 
 from girder_client import GirderClient
 import requests
@@ -25,9 +27,17 @@ import requests
 import cumulus
 from cumulus.common import check_status
 from cumulus.transport import get_connection
+from cumulus.transport.scheduler import transfer_lease
+from cumulus.transport.batch import check_results, quote, \
+    write_file_command
+from cumulus.transport.files import tar_mode
+from cumulus.transport.files.checkpoint import Checkpoint, ClusterStore
+from cumulus.transport.files.sync import remote_state, unchanged, \
+    MANIFEST_NAME
 
 
-def _upload_file(cluster_connection, girder_client, file, path):
+def _upload_file(cluster_connection, girder_client, file, path,
+                 checkpoint=None, key=None):
     """
     Upload a file to a cluster
 
@@ -35,16 +45,57 @@ def _upload_file(cluster_connection, girder_client, file, path):
     :param girder_client: The Grider client for Girder access.
     :param file: The Girder file object.
     :param path: The path on the cluster to upload to.
+    :param checkpoint: The Checkpoint recording the progress of the upload.
+    :param key: The key of the file in the checkpoint.
     """
+    source = {
+        'id': file['_id'],
+        'size': file.get('size')
+    }
+    offset = 0
+    progress = None
+    if checkpoint is not None:
+        if checkpoint.completed(key, source, ['id', 'size']):
+            return
+
+        # Pick up a partial file where the previous attempt left off
+        previous = checkpoint.get(key)
+        if previous is not None and previous.get('id') == source['id']:
+            offset = previous.get('offset', 0)
+
+        def _progress(offset):
+            checkpoint.update(key, dict(source, offset=offset))
+        progress = _progress
+
+    url = '%s/file/%s/download' % (girder_client.urlBase, file['_id'])
+    headers = {'Girder-Token': girder_client.token}
+
+    def _read_range(offset, length):
+        params = {
+            'offset': offset,
+            'endByte': offset + length
+        }
+        r = requests.get(url, headers=headers, params=params)
+        check_status(r)
+
+        return r.content
 
-    r = requests.get(
-        '%s/file/%s/download' % (girder_client.urlBase, file['_id']),
-        headers={'Girder-Token': girder_client.token}, stream=True)
-    check_status(r)
-    cluster_connection.put(r.raw, os.path.join(path, file['name']))
+    # Girder supports range requests, so let the transport move the file
+    # in parallel if it can.
+    if file.get('size') is not None:
+        cluster_connection.put_ranges(_read_range, file['size'],
+                                      os.path.join(path, file['name']),
+                                      offset=offset, progress=progress)
+    else:
+        r = requests.get(url, headers=headers, stream=True)
+        check_status(r)
+        cluster_connection.put(r.raw, os.path.join(path, file['name']))
 
+    if checkpoint is not None:
+        checkpoint.update(key, dict(source, done=True))
 
-def _upload_item(cluster_connection, girder_client, item, path):
+
+def _item_files(girder_client, item):
     offset = 0
     params = {
         'limit': 50,
@@ -56,36 +107,204 @@ def _upload_item(cluster_connection, girder_client, item, path):
                                   parameters=params)
 
         for file in files:
-            _upload_file(cluster_connection, girder_client, file, path)
+            yield file
 
         offset += len(files)
+        params['offset'] = offset
         if len(files) < 50:
             break
 
 
-def _upload_items(cluster_connection, girder_client, folder_id, path):
+def _upload_item(cluster_connection, girder_client, item, path,
+                 checkpoint=None, relative_path='.'):
+    for file in _item_files(girder_client, item):
+        key = os.path.normpath(os.path.join(relative_path, file['name']))
+        _upload_file(cluster_connection, girder_client, file, path,
+                     checkpoint=checkpoint, key=key)
+
+
+def _upload_items(cluster_connection, girder_client, folder_id, path,
+                  checkpoint=None, relative_path='.'):
     for item in girder_client.listItem(folder_id):
-        _upload_item(cluster_connection, girder_client, item, path)
+        _upload_item(cluster_connection, girder_client, item, path,
+                     checkpoint=checkpoint, relative_path=relative_path)
 
 
-def _upload_path(cluster_connection, girder_client, folder_id, path):
+def _upload_path(cluster_connection, girder_client, folder_id, path,
+                 checkpoint=None, relative_path='.'):
+    """
+    :param checkpoint: The Checkpoint recording the progress of the upload,
+                       files it records as done are skipped.
+    :param relative_path: The path relative to the root of the upload.
+    """
     # First process items
-    _upload_items(cluster_connection, girder_client, folder_id, path)
+    _upload_items(cluster_connection, girder_client, folder_id, path,
+                  checkpoint=checkpoint, relative_path=relative_path)
 
     # Now folders
     for folder in girder_client.listFolder(folder_id):
         folder_path = os.path.join(path, folder['name'])
-        cluster_connection.mkdir(folder_path)
+        # When resuming the folder may already have been created, any other
+        # failure to create it is still raised.
+        cluster_connection.makedirs(folder_path)
         _upload_path(cluster_connection, girder_client, folder['_id'],
-                     folder_path)
+                     folder_path, checkpoint=checkpoint,
+                     relative_path=os.path.join(relative_path,
+                                                folder['name']))
+
+
+def _add_folder_to_tar(tar, girder_client, folder_id, path='.'):
+    """
+    Add the contents of a Girder folder to a tar stream, the file data is
+    streamed straight from Girder.
+    """
+    for item in girder_client.listItem(folder_id):
+        for file in _item_files(girder_client, item):
+            r = requests.get(
+                '%s/file/%s/download' % (girder_client.urlBase, file['_id']),
+                headers={'Girder-Token': girder_client.token}, stream=True)
+            check_status(r)
+
+            info = tarfile.TarInfo(os.path.normpath(os.path.join(
+                path, file['name'])))
+            info.size = file['size']
+            info.mode = 0o644
+            tar.addfile(info, r.raw)
+
+    for folder in girder_client.listFolder(folder_id):
+        folder_path = os.path.normpath(os.path.join(path, folder['name']))
+        info = tarfile.TarInfo(folder_path)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        tar.addfile(info)
+
+        _add_folder_to_tar(tar, girder_client, folder['_id'], folder_path)
+
+
+def _upload_path_bulk(cluster_connection, girder_client, folder_id, path,
+                      compress=False):
+    """
+    Upload a folder as a single tar stream that is unpacked on the cluster.
+    """
+    (mode, flag) = tar_mode('w', compress)
+    command = 'mkdir -p %s && tar -x%sf - -C %s' % (quote(path), flag,
+                                                    quote(path))
+
+    with cluster_connection.open_command(command) as cmd:
+        tar = tarfile.open(mode=mode, fileobj=cmd.stdin)
+        try:
+            _add_folder_to_tar(tar, girder_client, folder_id)
+        finally:
+            tar.close()
+        cmd.close_stdin()
+        cmd.wait()
 
 
-def upload_path(cluster_connection, girder_token, folder_id, path):
+def _girder_files(girder_client, folder_id, path='.'):
+    """
+    Generator yielding ( path, file ) for all the files in a Girder folder,
+    path is relative to the folder.
+    """
+    for item in girder_client.listItem(folder_id):
+        for file in _item_files(girder_client, item):
+            yield (os.path.normpath(os.path.join(path, file['name'])), file)
+
+    for folder in girder_client.listFolder(folder_id):
+        for f in _girder_files(girder_client, folder['_id'],
+                               os.path.join(path, folder['name'])):
+            yield f
+
+
+def _upload_path_sync(cluster_connection, girder_client, folder_id, path):
+    """
+    Upload only the files in a Girder folder that are new or have changed
+    since the last sync to path. A manifest of what was uploaded is written
+    to path, a file is also uploaded again if it has been changed on the
+    cluster.
+    """
+    (files, manifest) = remote_state(cluster_connection, path, manifest=True)
+    manifest = manifest or {}
+
+    new_manifest = {}
+    dirs = set()
+    for (file_path, file) in _girder_files(girder_client, folder_id):
+        source = {
+            'id': file['_id'],
+            'size': file['size']
+        }
+        if 'sha512' in file:
+            source['sha512'] = file['sha512']
+
+        previous = manifest.get(file_path)
+        current = files.get(file_path)
+        if unchanged(previous, source, ['id', 'size', 'sha512']) \
+                and current is not None \
+                and current['size'] == file['size'] \
+                and previous.get('mtime') in [None, current['mtime']]:
+            new_manifest[file_path] = dict(previous, mtime=current['mtime'])
+            continue
+
+        dirname = os.path.join(path, os.path.dirname(file_path))
+        if dirname not in dirs:
+            cluster_connection.makedirs(dirname)
+            dirs.add(dirname)
+
+        _upload_file(cluster_connection, girder_client, file, dirname)
+        new_manifest[file_path] = source
+
+    if not dirs and new_manifest == manifest:
+        return
+
+    if path not in dirs:
+        cluster_connection.makedirs(path)
+    check_results(cluster_connection.execute_many([
+        write_file_command(os.path.join(path, MANIFEST_NAME),
+                           json.dumps(new_manifest))
+    ]))
+
+
+def upload_path(cluster_connection, girder_token, folder_id, path,
+                bulk=False, compress=False, sync=False):
+    """
+    Upload a Girder folder to a path on a cluster.
+
+    :param bulk: Transfer the whole folder as a single tar stream rather than
+                 file by file, this is much faster for many small files. Only
+                 supported by transports that can stream a command.
+    :param compress: Compress the tar stream in bulk mode.
+    :param sync: Only upload the files that are new or have changed since
+                 the last sync to path.
+
+    A file by file upload keeps a checkpoint in path, if the upload fails it
+    is resumed from the checkpoint the next time the folder is uploaded to
+    path.
+    """
     girder_client = GirderClient(apiUrl=cumulus.config.girder.baseUrl)
     girder_client.token = girder_token
+
+    if sync:
+        _upload_path_sync(cluster_connection, girder_client, folder_id, path)
+        return
+
+    if bulk:
+        try:
+            _upload_path_bulk(cluster_connection, girder_client, folder_id,
+                              path, compress=compress)
+            return
+        except NotImplementedError:
+            pass
+
     cluster_connection.makedirs(path)
 
-    _upload_path(cluster_connection, girder_client, folder_id, path)
+    checkpoint = Checkpoint(ClusterStore(cluster_connection, path), folder_id)
+    try:
+        _upload_path(cluster_connection, girder_client, folder_id, path,
+                     checkpoint=checkpoint)
+    except Exception:
+        checkpoint.save_quietly()
+        raise
+
+    checkpoint.clear()
 
 
 def upload_file(cluster, girder_token, file, path):
@@ -99,6 +318,7 @@ def upload_file(cluster, girder_token, file, path):
     """
     girder_client = GirderClient(apiUrl=cumulus.config.girder.baseUrl)
     girder_client.token = girder_token
-    with get_connection(girder_token, cluster) as conn:
+    with get_connection(girder_token, cluster) as conn, \
+            transfer_lease(cluster, girder_token, conn):
         conn.makedirs(os.path.dirname(path))
         _upload_file(conn, girder_client, file, path)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import atexit
+from contextlib import contextmanager
+import copy
+import functools
+import importlib
+import logging
+import os
+import threading
+import time
+
+import requests
+
+import cumulus
+from cumulus.common import check_status
+from cumulus.common.jsonpath import get_property
+
+logger = logging.getLogger('cumulus.transport.metrics')
+
+# The upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS = [10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000,
+                   60000]
+OVERFLOW_BUCKET = 'inf'
+
+# How often the Girder sink pushes what it has collected
+FLUSH_INTERVAL = 60
+
+
+def bucket(duration):
+    """
+    Returns the histogram bucket label for a duration in seconds. Labels are
+    the bucket bound in milliseconds, so they are safe to use as Mongo keys.
+    """
+    ms = duration * 1000
+    for bound in LATENCY_BUCKETS:
+        if ms <= bound:
+            return str(bound)
+
+    return OVERFLOW_BUCKET
+
+
+def empty_stats():
+    return {
+        'count': 0,
+        'errors': 0,
+        'totalTime': 0.0,
+        'bytes': 0,
+        'histogram': {}
+    }
+
+
+class MetricsSink(object):
+    """
+    Receives a record of each transport operation.
+    """
+    def record(self, cluster_id, operation, duration, nbytes=0, error=False,
+               girder_token=None):
+        raise NotImplementedError('Implemented by subclass')
+
+
+class NullSink(MetricsSink):
+    def record(self, cluster_id, operation, duration, nbytes=0, error=False,
+               girder_token=None):
+        pass
+
+
+class MemorySink(MetricsSink):
+    """
+    Aggregates the records in memory, keyed by cluster and operation.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, cluster_id, operation, duration, nbytes=0, error=False,
+               girder_token=None):
+        with self._lock:
+            operations = self._stats.setdefault(cluster_id, {})
+            stats = operations.setdefault(operation, empty_stats())
+            stats['count'] += 1
+            stats['totalTime'] += duration
+            stats['bytes'] += nbytes
+            if error:
+                stats['errors'] += 1
+            label = bucket(duration)
+            stats['histogram'][label] = stats['histogram'].get(label, 0) + 1
+
+    def snapshot(self, reset=False):
+        """
+        Returns a copy of the stats collected, keyed by cluster id and then
+        operation.
+        """
+        with self._lock:
+            stats = copy.deepcopy(self._stats)
+            if reset:
+                self._stats = {}
+
+        return stats
+
+
+class GirderSink(MemorySink):
+    """
+    Aggregates in memory and periodically pushes the stats to the cluster
+    metrics endpoint, so they can be viewed through Girder. The push is done
+    by a background thread so it isn't timed as part of a transport operation,
+    what is left is pushed when the process exits.
+    """
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        super(GirderSink, self).__init__()
+        self._flush_interval = flush_interval
+        self._tokens = {}
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def _start(self):
+        # The thread doesn't survive a fork ( celery prefork ), so each
+        # process starts its own.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run,
+                                      name='cumulus-metrics')
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self._flush_interval):
+            self.flush()
+
+    def record(self, cluster_id, operation, duration, nbytes=0, error=False,
+               girder_token=None):
+        super(GirderSink, self).record(cluster_id, operation, duration,
+                                       nbytes=nbytes, error=error)
+        with self._lock:
+            if girder_token:
+                self._tokens[cluster_id] = girder_token
+            self._start()
+
+    def stop(self):
+        """
+        Stop the background thread, pushing what has been collected.
+        """
+        self._stopped.set()
+        self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                tokens = dict(self._tokens)
+
+            for (cluster_id, stats) in self.snapshot(reset=True).items():
+                token = tokens.get(cluster_id)
+                if not token:
+                    continue
+
+                url = '%s/clusters/%s/metrics' % (
+                    cumulus.config.girder.baseUrl, cluster_id)
+                try:
+                    r = requests.post(url, json=stats,
+                                      headers={'Girder-Token': token})
+                    check_status(r)
+                except Exception:
+                    logger.exception('Unable to push metrics for cluster: %s'
+                                     % cluster_id)
+
+
+_sinks = {
+    'none': NullSink,
+    'memory': MemorySink,
+    'girder': GirderSink
+}
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def _create_sink(name):
+    if name in _sinks:
+        return _sinks[name]()
+
+    # Otherwise a dotted path to a sink class
+    (module, cls) = name.rsplit('.', 1)
+
+    return getattr(importlib.import_module(module), cls)()
+
+
+def get_sink():
+    """
+    Returns the process wide metrics sink, selected by metrics.sink in the
+    configuration. This is one of none, memory ( the default ) or girder or
+    the dotted path of a MetricsSink subclass.
+    """
+    global _sink
+
+    with _sink_lock:
+        if _sink is None:
+            _sink = _create_sink(get_property('metrics.sink', cumulus.config,
+                                              default='memory'))
+
+    return _sink
+
+
+def set_sink(sink):
+    global _sink
+
+    with _sink_lock:
+        _sink = sink
+
+
+class Measurement(object):
+    def __init__(self):
+        self.bytes = 0
+
+    def add_bytes(self, nbytes):
+        self.bytes += nbytes
+
+
+class CountingStream(object):
+    """
+    Wraps a file like object counting the bytes read through it.
+    """
+    def __init__(self, stream, measurement):
+        self._stream = stream
+        self._measurement = measurement
+
+    def read(self, *args, **kwargs):
+        data = self._stream.read(*args, **kwargs)
+        self._measurement.add_bytes(len(data))
+
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+@contextmanager
+def timed(connection, operation):
+    """
+    Context manager recording the latency of an operation performed by a
+    connection. Yields a Measurement that bytes transferred can be added to.
+    """
+    measurement = Measurement()
+    start = time.time()
+    error = False
+    try:
+        yield measurement
+    except Exception:
+        error = True
+        raise
+    finally:
+        duration = time.time() - start
+        try:
+            get_sink().record(connection._cluster.get('_id'), operation,
+                              duration, nbytes=measurement.bytes,
+                              error=error,
+                              girder_token=connection._girder_token)
+        except Exception:
+            logger.exception('Unable to record metrics')
+
+
+def instrumented(operation):
+    """
+    Decorator recording the latency of a connection method.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with timed(self, operation):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -17,23 +17,53 @@
 #  limitations under the License.
 ###############################################################################
 
+import base64
 import os
 from contextlib import contextmanager
 import stat
 import re
 import six
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from paramiko import SFTPAttributes
 
 from jsonpath_rw import parse
 
 from .abstract import AbstractConnection
+from .batch import quote
+from .walk import walk_command, parse_entries
+from .metrics import timed, instrumented, CountingStream
 import cumulus
 from cumulus.common import check_status
+from cumulus.common.jsonpath import get_property
 
 NEWT_BASE_URL = 'https://newt.nersc.gov/newt'
 
+# How long NEWT session ids and home directories are cached for
+SESSION_TTL = 3600
+HOME_TTL = 24 * 3600
+
+# The status codes that indicate a NEWT session is no longer valid
+AUTH_ERRORS = (401, 403)
+
+# The status codes that indicate a transient failure that is worth retrying
+TRANSIENT_ERRORS = (502, 503, 504)
+
+# Defaults for the HTTP layer, these can be overridden in the newt.http
+# section of the config.
+POOL_SIZE = 32
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# The size of the reads used to skip data that has already been transferred
+SKIP_SIZE = 1024 * 1024
+
 newt_stat_command = '/bin/stat -c "st_mode=%f,st_ino=%i,st_dev=%d,' \
     'st_nlink=%h,st_uid=%u,st_gid=%g,st_size=%s,st_atime=%X,st_mtime=%Y,' \
     'st_ctime=%Z" '
@@ -45,6 +75,7 @@ commands = {
     'rm': '/bin/rm',
     'pwd': '/bin/pwd',
     'tail': '/usr/bin/tail',
+    'find': '/usr/bin/find',
     # This may be very machine dependant!
     'squeue': '/opt/slurm/default/bin/squeue'
 }
@@ -77,6 +108,180 @@ class NewtException(Exception):
     pass
 
 
+class _ExpiringCache(object):
+    """
+    Thread safe process level cache whose entries expire after a ttl.
+    """
+    def __init__(self, ttl_property, default_ttl):
+        self._ttl_property = ttl_property
+        self._default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        ttl = get_property(self._ttl_property, cumulus.config,
+                           default=self._default_ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            (created, value) = entry
+            if time.time() - created > ttl:
+                del self._entries[key]
+                return None
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+
+    def invalidate(self, match):
+        """
+        Remove the entries whose key match(key) returns True for.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if match(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+# NEWT session ids keyed by Girder token
+_session_ids = _ExpiringCache('newt.sessionTtl', SESSION_TTL)
+# Home directories keyed by ( session id, machine )
+_home_dirs = _ExpiringCache('newt.homeTtl', HOME_TTL)
+
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def _http_config(name, default):
+    return get_property('newt.http.%s' % name, cumulus.config,
+                        default=default)
+
+
+def _create_http_session():
+    pool_size = _http_config('poolSize', POOL_SIZE)
+    # Only idempotent requests are retried, a command or a queue submission
+    # must not run twice.
+    retry = Retry(total=_http_config('retries', RETRIES),
+                  backoff_factor=_http_config('backoffFactor',
+                                              BACKOFF_FACTOR),
+                  status_forcelist=TRANSIENT_ERRORS,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_http_session():
+    """
+    Returns the requests.Session shared by NEWT connections, so connections to
+    NEWT are kept alive and reused. The session id is passed with each
+    request rather than held in the session, as it is shared between users.
+    The pool is sized so concurrent workers don't serialize on it.
+    """
+    global _http_session, _http_session_pid
+
+    with _http_session_lock:
+        # Don't share connections with a parent process
+        if _http_session is None or _http_session_pid != os.getpid():
+            _http_session = _create_http_session()
+            _http_session_pid = os.getpid()
+
+    return _http_session
+
+
+def http_timeout():
+    """
+    Returns the ( connect, read ) timeout used for NEWT requests.
+    """
+    return (_http_config('connectTimeout', CONNECT_TIMEOUT),
+            _http_config('readTimeout', READ_TIMEOUT))
+
+
+def is_transient_error(ex):
+    """
+    Returns True if ex is a failure talking to NEWT that is likely to go away
+    if the request is tried again later.
+    """
+    if isinstance(ex, (requests.exceptions.ConnectionError,
+                       requests.exceptions.Timeout)):
+        return True
+
+    if isinstance(ex, requests.exceptions.HTTPError) \
+            and ex.response is not None:
+        return ex.response.status_code in TRANSIENT_ERRORS
+
+    return False
+
+
+def invalidate_session(girder_token=None, session_id=None):
+    """
+    Drop the cached state for a NEWT session that is no longer valid.
+    """
+    if girder_token is not None:
+        _session_ids.invalidate(lambda key: key == girder_token)
+    if session_id is not None:
+        _home_dirs.invalidate(lambda key: key[0] == session_id)
+
+
+def clear_caches():
+    _session_ids.clear()
+    _home_dirs.clear()
+
+
+def _skip(stream, nbytes):
+    """
+    Read and discard nbytes from stream.
+    """
+    while nbytes > 0:
+        data = stream.read(min(nbytes, SKIP_SIZE))
+        if not data:
+            break
+        nbytes -= len(data)
+
+
+class NewtSession(object):
+    """
+    Issues requests for a NEWT session through the shared HTTP session. If
+    NEWT rejects the session the cached session id is invalidated, so the
+    next connection fetches a fresh one.
+    """
+    def __init__(self, girder_token, session_id):
+        self._girder_token = girder_token
+        self.session_id = session_id
+
+    def request(self, method, url, **kwargs):
+        cookies = kwargs.pop('cookies', {})
+        cookies['newt_sessionid'] = self.session_id
+        kwargs.setdefault('timeout', http_timeout())
+        r = get_http_session().request(method, url, cookies=cookies,
+                                       **kwargs)
+        if r.status_code in AUTH_ERRORS:
+            invalidate_session(self._girder_token, self.session_id)
+
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
 class NewtClusterConnection(AbstractConnection):
     def __init__(self, girder_token, cluster):
         self._girder_token = girder_token
@@ -84,29 +289,39 @@ class NewtClusterConnection(AbstractConnection):
         self._newt_session_id = None
         self._machine = parse('config.host').find(cluster)[0].value
 
+    def _fetch_session_id(self):
+        headers = {'Girder-Token':  self._girder_token}
+        url = '%s/newt/sessionId' % cumulus.config.girder.baseUrl
+        with timed(self, 'connect'):
+            r = get_http_session().get(url, headers=headers,
+                                       timeout=http_timeout())
+            check_status(r)
+
+        session_id = parse('sessionId').find(r.json())
+
+        if not session_id:
+            raise Exception('No NEWT session ID present')
+
+        return session_id[0].value
+
     def __enter__(self):
 
         # Do we need to get the session id for this user
         if not self._newt_session_id:
-            headers = {'Girder-Token':  self._girder_token}
-            url = '%s/newt/sessionId' % cumulus.config.girder.baseUrl
-            r = requests.get(url, headers=headers)
-            check_status(r)
-
-            session_id = parse('sessionId').find(r.json())
-
-            if not session_id:
-                raise Exception('No NEWT session ID present')
+            session_id = _session_ids.get(self._girder_token)
+            if session_id is None:
+                session_id = self._fetch_session_id()
+                _session_ids.set(self._girder_token, session_id)
 
-            self._session = requests.Session()
-            self._newt_session_id = session_id[0].value
-            self._session.cookies.set('newt_sessionid', self._newt_session_id)
+            self._newt_session_id = session_id
+            self._session = NewtSession(self._girder_token, session_id)
 
         return self
 
     def __exit__(self, type, value, traceback):
         pass
 
+    @instrumented('execute')
     def execute(self, command, ignore_exit_status=False, source_profile=True):
         url = '%s/command/%s' % (NEWT_BASE_URL, self._machine)
 
@@ -128,22 +343,75 @@ class NewtClusterConnection(AbstractConnection):
 
         return json_response['output'].split('\n')
 
-    @contextmanager
-    def get(self, remote_path):
+    def _execute_batch(self, script, source_profile=True):
+        # NEWT runs a single executable, so hand the script to a shell
+        return self.execute('/bin/bash -c %s' % quote(script),
+                            source_profile=source_profile)
+
+    def _read(self, remote_path, byte_range=None):
+        """
+        Request the content of remote_path, optionally a byte range of it. If
+        the range was honoured the status of the response is 206.
+        """
         url = '%s/file/%s/%s' % (NEWT_BASE_URL, self._machine, remote_path)
         params = {
             'view': 'read'
         }
-        r = None
+        headers = {}
+        if byte_range is not None:
+            headers['Range'] = byte_range
 
-        try:
-            r = self._session.get(url, params=params, stream=True)
+        r = self._session.get(url, params=params, headers=headers,
+                              stream=True)
+        if r.status_code != 206:
             check_status(r)
 
-            yield r.raw
-        finally:
-            if r:
-                r.close()
+        return r
+
+    @contextmanager
+    def get(self, remote_path, offset=0):
+        r = None
+
+        with timed(self, 'get') as measurement:
+            try:
+                r = self._read(remote_path,
+                               'bytes=%d-' % offset if offset else None)
+                stream = self._throttled(CountingStream(r.raw, measurement))
+                if r.status_code != 206:
+                    _skip(stream, offset)
+
+                yield stream
+            finally:
+                if r:
+                    r.close()
+
+    def read_range(self, remote_path, offset=0, length=None):
+        if length == 0:
+            return b''
+
+        if offset < 0:
+            byte_range = 'bytes=%d' % offset
+        elif length is None:
+            byte_range = 'bytes=%d-' % offset
+        else:
+            byte_range = 'bytes=%d-%d' % (offset, offset + length - 1)
+
+        r = None
+        with timed(self, 'get') as measurement:
+            try:
+                r = self._read(remote_path, byte_range)
+                stream = CountingStream(r.raw, measurement)
+                # If the range wasn't honoured skip to it
+                if r.status_code != 206:
+                    if offset < 0:
+                        offset = max(0, self.stat(remote_path).st_size +
+                                     offset)
+                    _skip(stream, offset)
+
+                return stream.read() if length is None else stream.read(length)
+            finally:
+                if r:
+                    r.close()
 
     def isfile(self, remote_path):
         try:
@@ -171,17 +439,25 @@ class NewtClusterConnection(AbstractConnection):
         return self.execute(command)
 
     def _home_dir(self):
-        home = self.execute('pwd')[0]
+        key = (self._newt_session_id, self._machine)
+        home = _home_dirs.get(key)
+        if home is None:
+            home = self.execute('pwd')[0]
+            _home_dirs.set(key, home)
 
         return home
 
     def put(self, stream, remote_path):
+        with timed(self, 'put') as measurement:
+            self._put(self._throttled(CountingStream(stream, measurement)),
+                      remote_path)
 
+    def _put(self, stream, remote_path):
         name = os.path.basename(remote_path)
         path = os.path.dirname(remote_path)
 
         # If not a full path then assume relative to users home
-        if path[0] != '/':
+        if not path or path[0] != '/':
             # Get the users home directory
             path = os.path.abspath(os.path.join(self._home_dir(), path))
 
@@ -192,6 +468,7 @@ class NewtClusterConnection(AbstractConnection):
         r = self._session.post(url, files=files)
         check_status(r)
 
+    @instrumented('stat')
     def stat(self, remote_path):
         output = self.execute(newt_stat_command + remote_path)[0]
         values = dict(s.split('=') for s in output.split(','))
@@ -248,8 +525,9 @@ class NewtClusterConnection(AbstractConnection):
                                                        remote_path))
 
         url = '%s/file/%s/%s' % (NEWT_BASE_URL, self._machine, remote_path)
-        r = self._session.get(url)
-        check_status(r)
+        with timed(self, 'list'):
+            r = self._session.get(url)
+            check_status(r)
 
         paths = r.json()
 
@@ -262,9 +540,28 @@ class NewtClusterConnection(AbstractConnection):
             path['size'] = int(path['size'])
             yield path
 
+    def walk(self, root_path, max_depth=None):
+        """
+        The subtree is described by a single find run through a shell. NEWT
+        returns the output of a command as text, so the NUL terminated entries
+        are base64 encoded on the cluster.
+        """
+        command = '%s | base64' % walk_command(root_path, max_depth)
+        output = self._execute_batch(command)
+
+        return parse_entries([base64.b64decode(''.join(output))])
+
     @property
     def session_id(self):
         """
         Allow access to session id, this is used in the queue adapter
         """
         return self._newt_session_id
+
+    @property
+    def session(self):
+        """
+        The NewtSession requests for this connection should be made through,
+        this is used in the queue adapter
+        """
+        return self._session
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import socket
+import threading
+import time
+
+import paramiko
+from paramiko.client import SSHClient
+from paramiko import RSAKey
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+
+try:
+    _SOCKET_ERRORS = (ConnectionError, socket.timeout)
+except NameError:
+    # Python 2
+    _SOCKET_ERRORS = (socket.error,)
+
+# The errors that indicate the underlying transport is no longer usable.
+CONNECTION_ERRORS = (EOFError, paramiko.SSHException,
+                     paramiko.ssh_exception.NoValidConnectionsError) \
+    + _SOCKET_ERRORS
+
+
+class PooledClient(object):
+    """
+    A SSHClient checked out of the pool, along with the bookkeeping the pool
+    needs to decide whether it can be reused.
+    """
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self.created = time.time()
+        self.last_used = self.created
+        # The snapshot of the login environment taken on this connection
+        self.profile = None
+
+    def is_active(self):
+        transport = self.client.get_transport()
+
+        return transport is not None and transport.is_active()
+
+    def is_healthy(self, max_quiet):
+        """
+        Returns True if the transport is still up and was last used
+        successfully within max_quiet seconds. A half-open connection can't be
+        detected without a round trip, so one that has been quiet for longer
+        isn't trusted. A connection that fails in use anyway is replaced by
+        the reconnect path of the connection using it.
+        """
+        return self.is_active() and time.time() - self.last_used <= max_quiet
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SshConnectionPool(object):
+    """
+    Process wide pool of SSH connections keyed by (host, port, user, key).
+    Idle connections are kept warm with keep-alives and evicted once they
+    have been idle for longer than idle_timeout. Only connections used within
+    max_quiet seconds are handed out again.
+    """
+    def __init__(self, max_idle=4, idle_timeout=300, keepalive=30,
+                 connect_retries=2, retry_delay=1, max_quiet=60):
+        self._max_idle = max_idle
+        self._idle_timeout = idle_timeout
+        self._max_quiet = max_quiet
+        self._keepalive = keepalive
+        self._connect_retries = connect_retries
+        self._retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = {}
+        self._keys = {}
+
+    def _check_pid(self):
+        # Transports are not fork safe, a child process (celery prefork) must
+        # not reuse the connections of its parent.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _load_key(self, key_path, passphrase, load_key):
+        mtime = os.path.getmtime(key_path)
+        cache_key = (key_path, passphrase)
+        cached = self._keys.get(cache_key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        private_key = load_key(key_path, passphrase)
+        self._keys[cache_key] = (mtime, private_key)
+
+        return private_key
+
+    def _connect(self, hostname, port, username, private_key):
+        attempt = 0
+        while True:
+            client = SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(hostname=hostname, port=port,
+                               username=username, pkey=private_key)
+                break
+            except (EOFError,
+                    paramiko.ssh_exception.NoValidConnectionsError):
+                client.close()
+                attempt += 1
+                if attempt > self._connect_retries:
+                    raise
+                time.sleep(self._retry_delay * attempt)
+
+        transport = client.get_transport()
+        if transport is not None and self._keepalive:
+            transport.set_keepalive(self._keepalive)
+
+        return client
+
+    def _evict(self, now):
+        for key in list(self._idle):
+            entries = self._idle[key]
+            keep = []
+            for entry in entries:
+                if now - entry.last_used > self._idle_timeout:
+                    entry.close()
+                else:
+                    keep.append(entry)
+
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+    def acquire(self, hostname, port, username, key_path, passphrase=None,
+                load_key=None):
+        """
+        Returns a PooledClient connected to the given host. A warm idle
+        connection is reused if a healthy one is available, otherwise a new
+        connection is established.
+
+        :param load_key: Callable used to load the private key, the decrypted
+                         key is cached until the key file changes.
+        """
+        if load_key is None:
+            def load_key(path, passphrase):
+                return RSAKey.from_private_key_file(path, password=passphrase)
+
+        key = (hostname, port, username, key_path)
+
+        with self._lock:
+            self._check_pid()
+            self._evict(time.time())
+            entries = self._idle.get(key, [])
+            while entries:
+                entry = entries.pop()
+                if entry.is_healthy(self._max_quiet):
+                    return entry
+                entry.close()
+
+            private_key = self._load_key(key_path, passphrase, load_key)
+
+        # Connect outside of the lock so other clusters aren't blocked
+        client = self._connect(hostname, port, username, private_key)
+
+        return PooledClient(key, client)
+
+    def release(self, entry):
+        """
+        Return a client to the pool, it will be closed if it is no longer
+        usable or the pool already holds enough idle connections for its key.
+        """
+        with self._lock:
+            self._check_pid()
+            now = time.time()
+            entry.last_used = now
+            entries = self._idle.setdefault(entry.key, [])
+            if entry.is_active() and len(entries) < self._max_idle:
+                entries.append(entry)
+            else:
+                entry.close()
+                if not entries:
+                    del self._idle[entry.key]
+
+            self._evict(now)
+
+    def discard(self, entry):
+        entry.close()
+
+    def clear(self):
+        with self._lock:
+            for entries in self._idle.values():
+                for entry in entries:
+                    entry.close()
+            self._reset()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ssh_pool():
+    """
+    Returns the process wide SSH connection pool, configured from the
+    ssh.pool section of the cumulus configuration.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            config = cumulus.config
+            _pool = SshConnectionPool(
+                max_idle=get_property('ssh.pool.maxIdle', config, default=4),
+                idle_timeout=get_property('ssh.pool.idleTimeout', config,
+                                          default=300),
+                keepalive=get_property('ssh.pool.keepAlive', config,
+                                       default=30),
+                connect_retries=get_property('ssh.pool.connectRetries',
+                                             config, default=2),
+                max_quiet=get_property('ssh.pool.maxQuiet', config,
+                                       default=60))
+
+    return _pool
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import re
+import time
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+from .batch import quote
+
+SOURCE_PROFILE = 'source /etc/profile'
+
+# How long a snapshot of the login environment is reused for
+PROFILE_TTL = 600
+
+# Variables that are managed by the shell itself and must not be replayed
+_SHELL_VARIABLES = set(['_', 'PWD', 'OLDPWD', 'SHLVL', 'SHELLOPTS',
+                        'BASHOPTS', 'PS1', 'PS2', 'PS4'])
+_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def profile_config():
+    """
+    Returns a tuple ( enabled, ttl ) from the ssh.profile section of the
+    configuration.
+    """
+    config = cumulus.config
+
+    return (get_property('ssh.profile.snapshot', config, default=True),
+            get_property('ssh.profile.ttl', config, default=PROFILE_TTL))
+
+
+def snapshot_command(marker):
+    """
+    Returns a command printing the environment before and after sourcing the
+    login profile, so what the profile changes can be captured.
+    """
+    return "env -0; printf '%s\\0'; %s > /dev/null 2>&1; env -0" \
+        % (marker, SOURCE_PROFILE)
+
+
+def _parse_env(data):
+    env = {}
+    for entry in data.split(b'\0'):
+        if b'=' not in entry:
+            continue
+        (name, value) = entry.split(b'=', 1)
+        env[name.decode('utf8', 'replace')] = value.decode('utf8', 'replace')
+
+    return env
+
+
+def parse_snapshot(output, marker):
+    """
+    Parse the output of snapshot_command(...) returning a dict of the
+    variables the profile sets or changes.
+    """
+    (before, sep, after) = output.partition(marker.encode('utf8') + b'\0')
+    if not sep:
+        raise ValueError('Unable to parse the login environment')
+
+    before = _parse_env(before)
+    after = _parse_env(after)
+
+    return {name: value for (name, value) in after.items()
+            if before.get(name) != value and _NAME.match(name) and
+            name not in _SHELL_VARIABLES and not name.startswith('BASH_')}
+
+
+class ProfileSnapshot(object):
+    """
+    The changes the login profile makes to the environment, replayed as an
+    export prefix rather than sourcing the profile for every command.
+    """
+    def __init__(self, environment):
+        self.environment = environment
+        self.created = time.time()
+        self.prefix = ''
+        if environment is None:
+            # The environment couldn't be captured, fall back to sourcing the
+            # profile.
+            self.prefix = '%s && ' % SOURCE_PROFILE
+        elif environment:
+            self.prefix = 'export %s && ' % ' '.join(
+                '%s=%s' % (name, quote(value))
+                for (name, value) in sorted(environment.items()))
+
+    def expired(self, ttl):
+        return time.time() - self.created > ttl
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+import cumulus
+from cumulus.common import check_status
+from cumulus.common.jsonpath import get_property
+
+logger = logging.getLogger('cumulus')
+
+# How long to wait for a lease before giving up, in seconds
+ACQUIRE_TIMEOUT = 3600
+# The number of seconds of transfer at the current rate that can be bursted
+BURST = 1.0
+
+
+class TransferLeaseTimeout(Exception):
+    pass
+
+
+class Throttle(object):
+    """
+    Token bucket limiting the rate data moves through a connection, shared by
+    all the streams and threads of a transfer. A rate of None means no limit.
+    """
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._tokens = 0.0
+        self._last = time.time()
+        self._running = threading.Event()
+        self._running.set()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._rate = rate
+
+    def pause(self):
+        """
+        Block data from moving until resume() is called.
+        """
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def consume(self, nbytes):
+        """
+        Account for nbytes, blocking until the rate allows them to be moved.
+        """
+        self._running.wait()
+        with self._lock:
+            rate = self._rate
+            if not rate:
+                return
+
+            now = time.time()
+            self._tokens = min(rate * BURST,
+                               self._tokens + (now - self._last) * rate)
+            self._last = now
+            # Go into debt rather than splitting the request, the next
+            # caller waits for it to be paid off.
+            self._tokens -= nbytes
+            delay = -self._tokens / rate if self._tokens < 0 else 0
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ThrottledStream(object):
+    """
+    Wraps a file like object so the data read or written through it is
+    limited by a Throttle.
+    """
+    def __init__(self, stream, throttle):
+        self._stream = stream
+        self._throttle = throttle
+
+    def read(self, *args, **kwargs):
+        data = self._stream.read(*args, **kwargs)
+        self._throttle.consume(len(data))
+
+        return data
+
+    def write(self, data):
+        self._throttle.consume(len(data))
+
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class TransferLease(object):
+    """
+    A lease from Girder granting the right to transfer data to or from a
+    cluster. Girder bounds the number of concurrent transfers per cluster and
+    splits the cluster's bandwidth between them, the lease is renewed in the
+    background for as long as the transfer runs so the rate tracks the number
+    of active transfers.
+    """
+    def __init__(self, cluster_id, girder_token, owner_id=None):
+        self._cluster_id = cluster_id
+        self._owner_id = owner_id
+        self._headers = {'Girder-Token': girder_token}
+        self._lease_id = None
+        self._ttl = None
+        self._released = threading.Event()
+        self._renew_thread = None
+        self.throttle = Throttle()
+
+    def _url(self):
+        url = '%s/clusters/%s/transfers' % (cumulus.config.girder.baseUrl,
+                                            self._cluster_id)
+        if self._lease_id is not None:
+            url = '%s/%s' % (url, self._lease_id)
+
+        return url
+
+    def _update(self, r):
+        check_status(r)
+        lease = r.json()
+        self._lease_id = lease['_id']
+        self._ttl = lease['ttl']
+        self.throttle.set_rate(lease.get('rate'))
+
+        return lease
+
+    def _request(self):
+        params = {}
+        if self._owner_id is not None:
+            params['ownerId'] = str(self._owner_id)
+
+        return self._update(requests.post(self._url(), params=params,
+                                          headers=self._headers))
+
+    def _renew(self):
+        r = requests.put(self._url(), headers=self._headers)
+        if r.status_code == 404:
+            # The lease has expired, so its slot may have been granted to
+            # another transfer, a new lease has to be requested.
+            logger.warning('Transfer lease expired: %s' % self._lease_id)
+            self._lease_id = None
+            return self._request()
+
+        return self._update(r)
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        """
+        Request the lease, blocking until it is active.
+
+        :raises TransferLeaseTimeout: If the lease isn't granted within
+                                      timeout seconds.
+        """
+        start = time.time()
+        lease = self._request()
+        while lease['status'] != 'active':
+            if time.time() - start > timeout:
+                self.release()
+                raise TransferLeaseTimeout(
+                    'Timed out waiting for a transfer slot on cluster: %s'
+                    % self._cluster_id)
+
+            time.sleep(lease['retryAfter'])
+            lease = self._renew()
+
+        self._renew_thread = threading.Thread(target=self._renew_loop)
+        self._renew_thread.daemon = True
+        self._renew_thread.start()
+
+    def _renew_loop(self):
+        delay = self._ttl / 3.0
+        while not self._released.wait(delay):
+            delay = self._ttl / 3.0
+            try:
+                lease = self._renew()
+            except Exception:
+                logger.exception('Unable to renew transfer lease: %s'
+                                 % self._lease_id)
+                continue
+
+            if lease['status'] == 'active':
+                self.throttle.resume()
+            else:
+                # The lease was lost and is waiting for a slot again, hold
+                # the transfer until it is granted one.
+                self.throttle.pause()
+                delay = lease['retryAfter']
+
+    def release(self):
+        self._released.set()
+        if self._renew_thread is not None:
+            self._renew_thread.join()
+            self._renew_thread = None
+        self.throttle.resume()
+
+        if self._lease_id is None:
+            return
+
+        r = requests.delete(self._url(), headers=self._headers)
+        self._lease_id = None
+        # The lease may already have expired
+        if r.status_code != 404:
+            check_status(r)
+
+
+def scheduler_enabled(cluster):
+    """
+    Transfers are only coordinated for clusters that have limits set in the
+    transfer section of their config.
+    """
+    return bool(get_property('transfer.scheduler.enabled', cumulus.config,
+                             default=True) and
+                get_property('config.transfer', cluster))
+
+
+@contextmanager
+def transfer_lease(cluster, girder_token, connection, owner_id=None):
+    """
+    Context manager holding a transfer lease for the cluster, the connection
+    is throttled to the rate the lease is granted for the duration.
+
+    :param owner_id: The user the transfer is made for, the slots of the
+                     cluster are shared fairly between owners. Defaults to
+                     the owner of the cluster.
+    """
+    if not scheduler_enabled(cluster):
+        yield None
+        return
+
+    timeout = get_property('transfer.scheduler.timeout', cumulus.config,
+                           default=ACQUIRE_TIMEOUT)
+    lease = TransferLease(cluster['_id'], girder_token,
+                          owner_id=owner_id or cluster.get('userId'))
+    lease.acquire(timeout=timeout)
+    connection.set_throttle(lease.throttle)
+    try:
+        yield lease
+    finally:
+        connection.set_throttle(None)
+        lease.release()
@@ -19,16 +19,103 @@
 
 import os
 from contextlib import contextmanager
+import select
 import stat
 from jsonpath_rw import parse
 
-from .abstract import AbstractConnection
+from .abstract import AbstractConnection, STDOUT, STDERR
+from .pool import get_ssh_pool, CONNECTION_ERRORS
+from .transfer import PipelinedReader, parallel_put, transfer_config
+from .metrics import timed, instrumented, CountingStream
+from .profile import profile_config, snapshot_command, parse_snapshot, \
+    ProfileSnapshot, SOURCE_PROFILE
+from .batch import new_marker, quote, check_results
 import cumulus
 
-from paramiko.client import SSHClient
-from paramiko import RSAKey
 import paramiko
 
+# The maximum amount of data read from a channel in one go, this also bounds
+# the length of a line that will be buffered before being yielded in pieces.
+READ_SIZE = 32768
+SELECT_TIMEOUT = 1
+
+
+def _decode(data):
+    return data.decode('utf8', 'replace')
+
+
+class _ChannelReader(object):
+    """
+    Reads stdout and stderr of a channel as data arrives on either of them,
+    so a command can't stall because the window of the stream we are not
+    reading has filled up.
+    """
+    def __init__(self, chan, max_bytes=None):
+        self._chan = chan
+        self._max_bytes = max_bytes
+        self.received = 0
+        self.truncated = False
+
+    def _ready(self):
+        return self._chan.recv_ready() or self._chan.recv_stderr_ready()
+
+    def chunks(self):
+        """
+        Generator yielding ( stream, bytes ) until the command has exited or
+        max_bytes have been received.
+        """
+        chan = self._chan
+        streams = [
+            (STDOUT, chan.recv_ready, chan.recv),
+            (STDERR, chan.recv_stderr_ready, chan.recv_stderr)
+        ]
+        while True:
+            if not self._ready():
+                if chan.exit_status_ready() and not self._ready():
+                    return
+                select.select([chan], [], [], SELECT_TIMEOUT)
+                continue
+
+            for (stream, ready, recv) in streams:
+                if not ready():
+                    continue
+
+                data = recv(READ_SIZE)
+                if self._max_bytes is not None \
+                        and self.received + len(data) > self._max_bytes:
+                    data = data[:self._max_bytes - self.received]
+                    self.truncated = True
+                self.received += len(data)
+
+                yield (stream, data)
+
+                if self.truncated:
+                    return
+
+
+def _lines(reader):
+    """
+    Generator splitting the chunks read by a _ChannelReader into lines. Only
+    whole lines are yielded, however long, as callers such as the job output
+    tail count the lines they have read. What is buffered is bounded by the
+    reader's max_bytes. If the reader was truncated a trailing partial line
+    is dropped.
+    """
+    pending = {
+        STDOUT: b'',
+        STDERR: b''
+    }
+    for (stream, data) in reader.chunks():
+        lines = (pending[stream] + data).split(b'\n')
+        pending[stream] = lines.pop()
+        for line in lines:
+            yield (stream, _decode(line + b'\n'))
+
+    if not reader.truncated:
+        for stream in [STDOUT, STDERR]:
+            if pending[stream]:
+                yield (stream, _decode(pending[stream]))
+
 
 class SshCommandException(Exception):
     def __init__(self, command, exit_code, output):
@@ -39,18 +126,40 @@ class SshCommandException(Exception):
         self.output = output
 
 
+class _CommandStream(object):
+    """
+    The stdin and stdout of a command running on a channel.
+    """
+    def __init__(self, command, chan):
+        self._command = command
+        self._chan = chan
+        self.stdin = chan.makefile('wb', -1)
+        self.stdout = chan.makefile('rb', -1)
+
+    def close_stdin(self):
+        self.stdin.flush()
+        self._chan.shutdown_write()
+
+    def wait(self):
+        exit_code = self._chan.recv_exit_status()
+        if exit_code != 0:
+            stderr = self._chan.makefile_stderr('r', -1).readlines()
+            raise SshCommandException(self._command, exit_code, stderr)
+
+
 class SshClusterConnection(AbstractConnection):
     def __init__(self, girder_token, cluster):
         self._girder_token = girder_token
         self._cluster = cluster
+        self._sftp_client = None
+        # The directories known to exist, see makedirs(...)
+        self._known_dirs = set()
 
     def _load_rsa_key(self, path, passphrase):
-        return RSAKey.from_private_key_file(path, password=passphrase)
+        return paramiko.RSAKey.from_private_key_file(
+            path, password=passphrase)
 
     def __enter__(self):
-        self._client = SSHClient()
-        self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
         username = parse('config.ssh.user').find(self._cluster)[0].value
         hostname = parse('config.host').find(self._cluster)[0].value
 
@@ -71,99 +180,295 @@ class SshClusterConnection(AbstractConnection):
         key_path = os.path.join(cumulus.config.ssh.keyStore,
                                 key_name)
 
-        private_key = self._load_rsa_key(key_path, passphrase)
-
-        self._client.connect(hostname=hostname, port=port,
-                             username=username, pkey=private_key)
+        self._connect_args = (hostname, port, username, key_path, passphrase)
+        with timed(self, 'connect'):
+            self._pooled = get_ssh_pool().acquire(*self._connect_args,
+                                                  load_key=self._load_rsa_key)
+        self._client = self._pooled.client
 
         return self
 
     def __exit__(self, type, value, traceback):
-        self._client.close()
+        self._close_sftp()
+        pool = get_ssh_pool()
+        if type is not None and issubclass(type, CONNECTION_ERRORS):
+            pool.discard(self._pooled)
+        else:
+            pool.release(self._pooled)
+
+    def _reconnect(self):
+        """
+        Replace a pooled connection that has died with a fresh one.
+        """
+        self._close_sftp()
+        pool = get_ssh_pool()
+        pool.discard(self._pooled)
+        with timed(self, 'connect'):
+            self._pooled = pool.acquire(*self._connect_args,
+                                        load_key=self._load_rsa_key)
+        self._client = self._pooled.client
+
+    def _transport(self):
+        transport = self._client.get_transport()
+        if transport is None or not transport.is_active():
+            self._reconnect()
+            transport = self._client.get_transport()
+
+        return transport
+
+    def _open_session(self):
+        try:
+            return self._transport().open_session()
+        except CONNECTION_ERRORS:
+            # The pooled transport went away under us, reconnect once.
+            self._reconnect()
+            return self._transport().open_session()
+
+    def _snapshot_profile(self):
+        marker = new_marker()
+        output = b''.join(data for (stream, data) in self.execute_stream(
+            snapshot_command(marker), source_profile=False, chunks=True)
+            if stream == STDOUT)
+        try:
+            return ProfileSnapshot(parse_snapshot(output, marker))
+        except ValueError:
+            return ProfileSnapshot(None)
+
+    def _profile_prefix(self):
+        """
+        Returns the prefix setting up the login environment for a command.
+        The environment the profile produces is captured once per pooled
+        connection and replayed, as sourcing the profile can be expensive.
+        """
+        (enabled, ttl) = profile_config()
+        if not enabled:
+            return '%s && ' % SOURCE_PROFILE
+
+        snapshot = self._pooled.profile
+        if snapshot is None or snapshot.expired(ttl):
+            snapshot = self._snapshot_profile()
+            self._pooled.profile = snapshot
+
+        return snapshot.prefix
 
     def execute(self, command, ignore_exit_status=False, source_profile=True):
+        output = {
+            STDOUT: [],
+            STDERR: []
+        }
+        # Both streams are drained as data arrives so a command writing a lot
+        # to stderr can't stall while we are reading stdout.
+        for (stream, line) in self.execute_stream(
+                command, ignore_exit_status=ignore_exit_status,
+                source_profile=source_profile):
+            output[stream].append(line)
+
+        return output[STDOUT] + output[STDERR]
+
+    def execute_stream(self, command, ignore_exit_status=False,
+                       source_profile=True, max_bytes=None, chunks=False):
         if source_profile:
-            command = 'source /etc/profile && %s' % command
-
-        chan = self._client.get_transport().open_session()
-        chan.exec_command(command)
-        stdout = chan.makefile('r', -1)
-        stderr = chan.makefile_stderr('r', -1)
+            command = self._profile_prefix() + command
 
-        output = stdout.readlines() + stderr.readlines()
-        exit_code = chan.recv_exit_status()
-        if ignore_exit_status and exit_code != 0:
-            raise SshCommandException(command, exit_code, output)
-
-        return output
+        with timed(self, 'execute') as measurement:
+            chan = self._open_session()
+            reader = _ChannelReader(chan, max_bytes)
+            try:
+                chan.exec_command(command)
+                output = []
+                for (stream, data) in (reader.chunks() if chunks
+                                       else _lines(reader)):
+                    if ignore_exit_status and not chunks:
+                        output.append(data)
+                    yield (stream, data)
+
+                # If we stopped reading early we don't know how the command
+                # exited
+                if reader.truncated:
+                    return
+
+                exit_code = chan.recv_exit_status()
+                if ignore_exit_status and exit_code != 0:
+                    raise SshCommandException(command, exit_code, output)
+            finally:
+                measurement.add_bytes(reader.received)
+                chan.close()
 
     @contextmanager
-    def get(self, remote_path):
-        sftp = None
-        file = None
+    def open_command(self, command, source_profile=True):
+        if source_profile:
+            command = self._profile_prefix() + command
+
+        chan = self._open_session()
         try:
-            sftp = self._client.get_transport().open_sftp_client()
-            file = sftp.open(remote_path)
-            yield file
+            chan.exec_command(command)
+            stream = _CommandStream(command, chan)
+            stream.stdin = self._throttled(stream.stdin)
+            stream.stdout = self._throttled(stream.stdout)
+            yield stream
         finally:
-            if file:
-                file.close()
-                sftp.close()
+            chan.close()
 
-    def isfile(self, remote_path):
+    @property
+    def _sftp(self):
+        """
+        The SFTP session for this connection, it is opened on first use and
+        reused for the lifetime of the connection.
+        """
+        if self._sftp_client is None:
+            self._sftp_client = self._transport().open_sftp_client()
+
+        return self._sftp_client
 
-        with self._client.get_transport().open_sftp_client() as sftp:
+    def _close_sftp(self):
+        if self._sftp_client is not None:
             try:
-                s = sftp.stat(remote_path)
-            except IOError:
-                return False
+                self._sftp_client.close()
+            except Exception:
+                pass
+            self._sftp_client = None
+
+    def _sftp_dead(self):
+        return self._sftp_client is None or \
+            self._sftp_client.get_channel().closed
+
+    def _with_sftp(self, func):
+        """
+        Call func with the SFTP session, if the session's channel has died
+        a new one is opened and the call is retried once.
+        """
+        try:
+            return func(self._sftp)
+        except Exception:
+            if not self._sftp_dead():
+                raise
 
-            return stat.S_ISDIR(s.st_mode)
+        self._close_sftp()
 
-    def mkdir(self, remote_path, ignore_failure=False):
-        with self._client.get_transport().open_sftp_client() as sftp:
+        return func(self._sftp)
+
+    @contextmanager
+    def get(self, remote_path, offset=0):
+        file = None
+        with timed(self, 'get') as measurement:
             try:
-                sftp.mkdir(remote_path)
-            except IOError:
-                if not ignore_failure:
-                    raise
+                file = self._with_sftp(lambda sftp: sftp.open(remote_path))
+                (chunk_size, _, _) = transfer_config()
+                yield self._throttled(CountingStream(
+                    PipelinedReader(file, file.stat().st_size,
+                                    window=chunk_size, offset=offset),
+                    measurement))
+            finally:
+                if file:
+                    file.close()
+
+    def read_range(self, remote_path, offset=0, length=None):
+        file = None
+        with timed(self, 'get') as measurement:
+            try:
+                file = self._with_sftp(lambda sftp: sftp.open(remote_path))
+                size = file.stat().st_size
+                if offset < 0:
+                    offset = max(0, size + offset)
+                end = size if length is None else min(size, offset + length)
+                if offset >= end:
+                    return b''
+
+                (chunk_size, _, _) = transfer_config()
+                data = PipelinedReader(file, end, window=chunk_size,
+                                       offset=offset).read()
+                measurement.add_bytes(len(data))
+
+                return data
+            finally:
+                if file:
+                    file.close()
+
+    @instrumented('stat')
+    def isfile(self, remote_path):
+        try:
+            s = self._with_sftp(lambda sftp: sftp.stat(remote_path))
+        except IOError:
+            return False
 
-    def makedirs(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
-            current_path = ''
-            if remote_path[0] == '/':
-                current_path = '/'
+        return not stat.S_ISDIR(s.st_mode)
 
-            for path in remote_path.split('/'):
-                if not path:
-                    continue
-                current_path = os.path.join(current_path, path)
-                try:
-                    sftp.listdir(current_path)
-                except IOError:
-                    sftp.mkdir(current_path)
+    def mkdir(self, remote_path, ignore_failure=False):
+        try:
+            self._with_sftp(lambda sftp: sftp.mkdir(remote_path))
+        except IOError:
+            if not ignore_failure:
+                raise
+
+    def makedirs(self, remote_path):
+        """
+        Create remote_path and any missing parents with a single mkdir -p.
+        The directories created are remembered, so staging more files into
+        the same tree doesn't go back to the cluster.
+        """
+        remote_path = os.path.normpath(remote_path)
+        if remote_path in self._known_dirs:
+            return
+
+        with timed(self, 'makedirs'):
+            check_results(self.execute_many(
+                ['mkdir -p %s' % quote(remote_path)], source_profile=False))
+
+        # The parents must exist as well
+        while remote_path not in self._known_dirs:
+            self._known_dirs.add(remote_path)
+            parent = os.path.dirname(remote_path)
+            if parent == remote_path or not parent:
+                break
+            remote_path = parent
 
     def put(self, stream, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
-            sftp.putfo(stream, remote_path)
+        with timed(self, 'put') as measurement:
+            stream = self._throttled(CountingStream(stream, measurement))
+            self._with_sftp(lambda sftp: sftp.putfo(stream, remote_path))
+
+    def put_ranges(self, read_range, size, remote_path, offset=0,
+                   progress=None):
+        (chunk_size, concurrency, threshold) = transfer_config()
+        # Small files are written whole, so aren't resumed
+        if size < threshold or concurrency < 2:
+            return super(SshClusterConnection, self).put_ranges(
+                read_range, size, remote_path, offset=offset,
+                progress=progress)
+
+        # Only resume if the file left by the previous attempt is still there
+        if offset:
+            try:
+                if self.stat(remote_path).st_size != size:
+                    offset = 0
+            except IOError:
+                offset = 0
+
+        with timed(self, 'put') as measurement:
+            parallel_put(lambda: self._transport().open_sftp_client(),
+                         self._throttled_range(read_range), size, remote_path,
+                         chunk_size=chunk_size, concurrency=concurrency,
+                         offset=offset, progress=progress)
+            measurement.add_bytes(size - offset)
 
+    @instrumented('stat')
     def stat(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
-            return sftp.stat(remote_path)
+        return self._with_sftp(lambda sftp: sftp.stat(remote_path))
 
     def remove(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
-            return sftp.remove(remote_path)
+        return self._with_sftp(lambda sftp: sftp.remove(remote_path))
 
     def list(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
-            for path in sftp.listdir_iter(remote_path):
-                yield {
-                    'name': path.filename,
-                    'user': path.st_uid,
-                    'group': path.st_gid,
-                    'mode': path.st_mode,
-                    # For now just pass mtime through
-                    'date': path.st_mtime,
-                    'size': path.st_size
-                }
+        with timed(self, 'list'):
+            paths = list(self._with_sftp(
+                lambda sftp: sftp.listdir_iter(remote_path)))
+        for path in paths:
+            yield {
+                'name': path.filename,
+                'user': path.st_uid,
+                'group': path.st_gid,
+                'mode': path.st_mode,
+                # For now just pass mtime through
+                'date': path.st_mtime,
+                'size': path.st_size
+            }
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import threading
+
+from six.moves import queue
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+
+# Defaults, these can be overridden in the transfer section of the config.
+CHUNK_SIZE = 8 * 1024 * 1024
+CONCURRENCY = 4
+# Files smaller than this are sent as a single stream
+THRESHOLD = 32 * 1024 * 1024
+
+
+def transfer_config():
+    """
+    Returns a tuple ( chunk_size, concurrency, threshold ) from the
+    configuration.
+    """
+    config = cumulus.config
+
+    return (get_property('transfer.chunkSize', config, default=CHUNK_SIZE),
+            get_property('transfer.concurrency', config, default=CONCURRENCY),
+            get_property('transfer.threshold', config, default=THRESHOLD))
+
+
+def chunk_ranges(size, chunk_size, offset=0):
+    """
+    Generator yielding the ( offset, length ) ranges a file of size should be
+    split into, starting at offset.
+    """
+    while offset < size:
+        length = min(chunk_size, size - offset)
+        yield (offset, length)
+        offset += length
+
+
+class RangeReader(object):
+    """
+    File like object reading sequentially through a read_range callable, used
+    to fall back to a single stream.
+    """
+    def __init__(self, read_range, size, chunk_size=CHUNK_SIZE):
+        self._read_range = read_range
+        self._size = size
+        self._chunk_size = chunk_size
+        self._offset = 0
+        self._buffer = b''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size
+
+        while len(self._buffer) < size and self._offset < self._size:
+            length = min(self._chunk_size, self._size - self._offset)
+            self._buffer += self._read_range(self._offset, length)
+            self._offset += length
+
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return data
+
+
+class PipelinedReader(object):
+    """
+    File like wrapper around a SFTPFile that reads ahead a window at a time.
+    All the requests for a window are issued up front, so a read costs one
+    round trip per window rather than one per 32KiB request, while the amount
+    of data held in memory stays bounded by the window.
+    """
+    def __init__(self, sftp_file, size, window=CHUNK_SIZE, offset=0):
+        self._file = sftp_file
+        self._size = size
+        self._window = window
+        self._offset = offset
+        self._buffer = b''
+
+    def _fill(self):
+        length = min(self._window, self._size - self._offset)
+        data = b''.join(self._file.readv([(self._offset, length)]))
+        self._offset += len(data)
+        self._buffer += data
+
+        return len(data) > 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size
+
+        while len(self._buffer) < size and self._offset < self._size:
+            if not self._fill():
+                break
+
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class _ProgressTracker(object):
+    """
+    Tracks the offset a file has been written up to, as the ranges are
+    written out of order by several threads.
+    """
+    def __init__(self, offset, progress):
+        self._lock = threading.Lock()
+        self._offset = offset
+        self._progress = progress
+        # The ranges written beyond the offset
+        self._pending = {}
+
+    def written(self, fp, offset, length):
+        if self._progress is None:
+            return
+
+        # The writes are pipelined, a synchronous request only returns once
+        # the server has processed them.
+        fp.flush()
+        fp.stat()
+
+        with self._lock:
+            self._pending[offset] = length
+            while self._offset in self._pending:
+                self._offset += self._pending.pop(self._offset)
+            current = self._offset
+
+        self._progress(current)
+
+
+def parallel_put(open_sftp, read_range, size, remote_path,
+                 chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY, offset=0,
+                 progress=None):
+    """
+    Write a file to remote_path by splitting it into ranges that are written
+    concurrently, each worker uses its own SFTP channel and pipelines its
+    writes so we are not bound by the window of a single channel.
+
+    :param open_sftp: Callable returning a new SFTPClient.
+    :param read_range: Callable taking ( offset, length ) returning the bytes
+                       for that range of the source, it is called from several
+                       threads.
+    :param size: The size of the file.
+    :param remote_path: The path to write to.
+    :param offset: Resume a previous transfer, remote_path exists and the
+                   bytes before offset have already been written to it.
+    :param progress: Callable taking the offset the file has been written up
+                     to, it is called from several threads.
+    """
+    ranges = queue.Queue()
+    for r in chunk_ranges(size, chunk_size, offset):
+        ranges.put(r)
+
+    concurrency = max(1, min(concurrency, ranges.qsize()))
+    clients = []
+    errors = []
+    failed = threading.Event()
+    tracker = _ProgressTracker(offset, progress)
+
+    def _worker(sftp):
+        try:
+            with sftp.open(remote_path, 'r+b') as fp:
+                fp.set_pipelined(True)
+                while not failed.is_set():
+                    try:
+                        (offset, length) = ranges.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    data = read_range(offset, length)
+                    if len(data) != length:
+                        raise IOError('Short read at offset %d of %s, '
+                                      'expected %d bytes got %d'
+                                      % (offset, remote_path, length,
+                                         len(data)))
+                    fp.seek(offset)
+                    fp.write(data)
+                    tracker.written(fp, offset, length)
+        except Exception as ex:
+            errors.append(ex)
+            failed.set()
+
+    try:
+        for _ in range(concurrency):
+            clients.append(open_sftp())
+
+        # Create the file so the workers can open it for update, when
+        # resuming what has already been written is kept.
+        with clients[0].open(remote_path, 'r+b' if offset else 'wb') as fp:
+            fp.truncate(size)
+
+        threads = [threading.Thread(target=_worker, args=(sftp,))
+                   for sftp in clients]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        for sftp in clients:
+            sftp.close()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import stat
+
+from .batch import quote
+
+# The find -printf format used to describe an entry: type, size, mtime,
+# permissions and the path relative to the root. Entries are NUL terminated
+# so any path can be represented.
+WALK_FORMAT = '%y\\t%s\\t%T@\\t%m\\t%P\\0'
+
+_types = {
+    'f': stat.S_IFREG,
+    'd': stat.S_IFDIR,
+    'l': stat.S_IFLNK,
+    'b': stat.S_IFBLK,
+    'c': stat.S_IFCHR,
+    'p': stat.S_IFIFO,
+    's': stat.S_IFSOCK
+}
+
+
+def walk_command(root_path, max_depth=None):
+    """
+    Returns the find command describing the entries under root_path.
+    """
+    command = 'find %s -mindepth 1' % quote(root_path)
+    if max_depth is not None:
+        command += ' -maxdepth %d' % max_depth
+
+    return "%s -printf '%s'" % (command, WALK_FORMAT)
+
+
+def parse_entry(entry):
+    """
+    Parse an entry produced by walk_command(...) into a dict of the form:
+
+    {
+        'path': <path relative to the root>,
+        'name': <name>,
+        'mode': <mode>,
+        'size': <size>,
+        'mtime': <mtime>
+    }
+
+    :returns The dict or None if the entry can't be parsed.
+    """
+    parts = entry.split('\t', 4)
+    if len(parts) != 5:
+        return None
+
+    (type, size, mtime, perms, path) = parts
+    try:
+        return {
+            'path': path,
+            'name': os.path.basename(path),
+            'mode': _types.get(type, 0) | int(perms, 8),
+            'size': int(size),
+            'mtime': float(mtime)
+        }
+    except ValueError:
+        return None
+
+
+def parse_entries(chunks):
+    """
+    Generator parsing the entries in a stream of byte chunks, so entries are
+    yielded as the output of the command arrives.
+    """
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        entries = pending.split(b'\0')
+        pending = entries.pop()
+        for entry in entries:
+            entry = parse_entry(entry.decode('utf8', 'replace'))
+            if entry is not None:
+                yield entry
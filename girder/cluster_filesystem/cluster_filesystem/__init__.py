@@ -41,45 +41,6 @@ from girder.api.rest import getCurrentUser, getCurrentToken, RestException
 
 import datetime as dt
 
-def date_parser(timestring):
-    """
-        Parse a datetime string from ls -l and return a standard isotime
-
-        ls -l returns dates in two different formats:
-
-        May  2 09:06 (for dates within 6 months from now)
-        May  2 2018  (for dates further away)
-
-        Best would be to return ls -l --full-time,
-        but unfortunately we have no control over the remote API
-    """
-
-    recent_time_format = "%b %d %H:%M"
-    older_time_format = "%b %d %Y"
-    try:
-        date = dt.datetime.strptime(timestring, recent_time_format)
-        now = dt.datetime.now()
-        this_year = dt.datetime(year=now.year,
-                           month=date.month, day=date.day,
-                           hour=date.hour, minute=date.minute)
-        last_year = dt.datetime(year=now.year-1,
-                           month=date.month, day=date.day,
-                           hour=date.hour, minute=date.minute)
-
-        delta_this = abs((now-this_year).total_seconds())
-        delta_last = abs((now-last_year).total_seconds())
-        if (delta_this > delta_last):
-            date = last_year
-        else:
-            date = this_year
-
-    except ValueError:
-        try:
-            date = dt.datetime.strptime(timestring, older_time_format)
-        except ValueError:
-            return timestring
-    return date.isoformat()
-
 def _mtime_isoformat(mtime):
     return dt.datetime.fromtimestamp(mtime).isoformat()
 
@@ -138,21 +99,21 @@ def _decode_id(func=None, key='id'):
 @_decode_id(key='parentId')
 def _folder_before(conn, path, cluster, encoded_id, **rest):
     folders = []
-    for entry in conn.list(path):
-        if stat.S_ISDIR(entry['mode']) and entry['name'] not in ['.', '..']:
+    for entry in conn.walk(path, max_depth=1):
+        if stat.S_ISDIR(entry['mode']):
             entry_path = os.path.join(path, entry['name'])
             entry_id = _generate_id(cluster['_id'], entry_path)
             folders.append({
                 '_id': entry_id,
                 '_modelType': 'folder',
-                'created': date_parser(entry['date']),
+                'created': _mtime_isoformat(entry['mtime']),
                 'description': '',
                 'name': entry['name'],
                 'parentCollection': 'folder',
                 'parentId': encoded_id,
                 'public': False,
                 'size': entry['size'],
-                'updated': date_parser(entry['date'])
+                'updated': _mtime_isoformat(entry['mtime'])
             })
 
     return folders
@@ -160,42 +121,43 @@ def _folder_before(conn, path, cluster, encoded_id, **rest):
 @access.user(scope=TokenScope.DATA_READ)
 @_decode_id
 def _folder_id_before(conn, path, cluster, encoded_id):
-    for entry in conn.list(path):
-        if entry['name'] == '.':
-            parent_path = os.path.dirname(path)
-            name = os.path.basename(path)
-            parent_id = _generate_id(cluster['_id'], parent_path)
-            return {
-                '_id': encoded_id,
-                '_modelType': 'folder',
-                'created': date_parser(entry['date']),
-                'description': '',
-                'name': name,
-                'parentCollection': 'folder',
-                'parentId': parent_id,
-                'public': False,
-                'size': entry['size'],
-                'updated': date_parser(entry['date'])
-            }
+    file_stat = conn.stat(path)
+
+    parent_path = os.path.dirname(path)
+    name = os.path.basename(path)
+    parent_id = _generate_id(cluster['_id'], parent_path)
+
+    return {
+        '_id': encoded_id,
+        '_modelType': 'folder',
+        'created': _mtime_isoformat(file_stat.st_mtime),
+        'description': '',
+        'name': name,
+        'parentCollection': 'folder',
+        'parentId': parent_id,
+        'public': False,
+        'size': file_stat.st_size,
+        'updated': _mtime_isoformat(file_stat.st_mtime)
+    }
 
 
 @access.user(scope=TokenScope.DATA_READ)
 @_decode_id(key='folderId')
 def _item_before(conn, path, cluster, encoded_id):
     items = []
-    for entry in conn.list(path):
+    for entry in conn.walk(path, max_depth=1):
         if not stat.S_ISDIR(entry['mode']):
             item_path = os.path.join(path, entry['name'])
             item_id = _generate_id(cluster['_id'], item_path)
             items.append({
                 "_id": item_id,
                 "_modelType": "item",
-                "created": date_parser(entry['date']),
+                "created": _mtime_isoformat(entry['mtime']),
                 "description": "",
                 "folderId": encoded_id,
                 "name": entry['name'],
                 "size": entry['size'],
-                "updated": date_parser(entry['date']),
+                "updated": _mtime_isoformat(entry['mtime']),
             })
 
     return items
@@ -21,7 +21,7 @@ CURR_DIR = {
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFDIR,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 0
 }
 
@@ -30,61 +30,67 @@ PARENT_DIR = {
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFDIR,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 0
 }
 
 DIR1 = {
+    'path': 'dir1',
     'name': 'dir1',
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFDIR,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 0
 }
 
 DIR2 = {
+    'path': 'dir2',
     'name': 'dir2',
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFDIR,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 0
 }
 
 DIR3 = {
+    'path': 'dir3',
     'name': 'dir3',
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFDIR,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 0
 }
 
 FILE1 = {
+    'path': 'file1',
     'name': 'file1',
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFREG,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 123
 }
 
 FILE2 = {
+    'path': 'file2',
     'name': 'file2',
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFREG,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 456
 }
 
 FILE3 = {
+    'path': 'file3',
     'name': 'file3',
     'group': 'group',
     'user': 'user',
     'mode': stat.S_IFREG,
-    'date': 'Feb  7 16:26',
+    'mtime': 1518038760.0,
     'size': 78910
 }
 
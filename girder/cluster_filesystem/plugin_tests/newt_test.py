@@ -16,6 +16,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 ###############################################################################
+import base64
 import json
 import mock
 import stat
@@ -30,7 +31,7 @@ from pytest_girder.assertions import assertStatusOk, assertStatus
 from .constants import (
     CLUSTER_LOAD,
     PATH, DIR_ID_FIELDS, FILE_ID_FIELDS,
-    CURR_DIR, PARENT_DIR,
+    CURR_DIR,
     DIR1, DIR2, DIR3,
     FILE1, FILE2, FILE3
 )
@@ -61,15 +62,15 @@ def _assert_file(listed, received, id_fields):
     assert received['_modelType'] == 'file'
 
 def _assert_base(listed, received, id_fields, is_curr=False):
-    from cluster_filesystem.server.dateutils import date_parser
+    from cluster_filesystem import _mtime_isoformat
     if is_curr:
         dir_name = os.path.basename(id_fields['path'])
         assert dir_name  == received['name']
     else:
         assert listed['name'] == received['name']
     assert listed['size'] == received['size']
-    assert date_parser(listed['date']) == received['created']
-    assert date_parser(listed['date']) == received['updated']
+    assert _mtime_isoformat(listed['mtime']) == received['created']
+    assert _mtime_isoformat(listed['mtime']) == received['updated']
 
     id = json.loads(urllib.parse.unquote_plus(received['_id']))
     assert id['clusterId'] == 'dummy'
@@ -81,12 +82,10 @@ def _assert_parent(listed, received, is_curr=False):
     assert listed == received
 
 
-def _set_mock_connection_list(conn):
-    conn.list.return_value = [PARENT_DIR, CURR_DIR]
+def _set_mock_connection_walk(conn):
     folders = [DIR1, DIR2, DIR3]
     files  = [FILE1, FILE2, FILE3]
-    conn.list.return_value.extend(folders)
-    conn.list.return_value.extend(files)
+    conn.walk.return_value = folders + files
     return folders, files
 
 def _set_mock_cluster(cluster):
@@ -101,7 +100,7 @@ def _set_mock_cluster(cluster):
 @mock.patch('cluster_filesystem.Cluster')
 def test_folder(cluster, get_connection, unbound_server, user):
     conn = get_connection.return_value.__enter__.return_value
-    folders, files = _set_mock_connection_list(conn)
+    folders, files = _set_mock_connection_walk(conn)
     _set_mock_cluster(cluster)
 
     id = urllib.parse.quote_plus(json.dumps(DIR_ID_FIELDS))
@@ -118,16 +117,16 @@ def test_folder(cluster, get_connection, unbound_server, user):
     for listed, received in zip(folders, received_folders):
         _assert_dir(listed, received, DIR_ID_FIELDS)
 
-    assert conn.list.call_args == mock.call(PATH)
+    assert conn.walk.call_args == mock.call(PATH, max_depth=1)
 
 @pytest.mark.plugin('cluster_filesystem')
 @mock.patch('cluster_filesystem.get_connection')
 @mock.patch('cluster_filesystem.Cluster')
 def test_folder_id(cluster, get_connection, unbound_server, user):
     conn = get_connection.return_value.__enter__.return_value
-    conn.list.return_value = [
-        CURR_DIR
-    ]
+    stat_attr = conn.stat.return_value = SFTPAttributes()
+    stat_attr.st_size = CURR_DIR['size']
+    stat_attr.st_mtime = CURR_DIR['mtime']
 
     _set_mock_cluster(cluster)
 
@@ -139,7 +138,7 @@ def test_folder_id(cluster, get_connection, unbound_server, user):
     folder = r.json
     _assert_dir(CURR_DIR, folder, DIR_ID_FIELDS, is_curr=True)
 
-    assert conn.list.call_args == mock.call(PATH)
+    assert conn.stat.call_args == mock.call(PATH)
 
 
 @pytest.mark.plugin('cluster_filesystem')
@@ -147,7 +146,7 @@ def test_folder_id(cluster, get_connection, unbound_server, user):
 @mock.patch('cluster_filesystem.Cluster')
 def test_item(cluster, get_connection, unbound_server, user):
     conn = get_connection.return_value.__enter__.return_value
-    folders, files = _set_mock_connection_list(conn)
+    folders, files = _set_mock_connection_walk(conn)
     _set_mock_cluster(cluster)
 
     id = urllib.parse.quote_plus(json.dumps(DIR_ID_FIELDS))
@@ -164,7 +163,7 @@ def test_item(cluster, get_connection, unbound_server, user):
     for listed, received in zip(files, received_files):
         _assert_item(listed, received, DIR_ID_FIELDS)
 
-    assert conn.list.call_args == mock.call(PATH)
+    assert conn.walk.call_args == mock.call(PATH, max_depth=1)
 
 
 @pytest.mark.plugin('cluster_filesystem')
@@ -229,3 +228,43 @@ def test_file_id(cluster, get_connection, unbound_server, user):
     received_file = r.json
     _assert_file(FILE1, received_file, FILE_ID_FIELDS)
 
+
+
+@pytest.mark.plugin('cluster_filesystem')
+@mock.patch('cluster_filesystem.get_connection')
+@mock.patch('cluster_filesystem.Cluster')
+def test_folder_newt_walk(cluster, get_connection, unbound_server, user):
+    # A NEWT cluster is listed by a single find run through a shell, the
+    # output is base64 encoded as NEWT returns it as text.
+    from cumulus.transport.newt import NewtClusterConnection
+    conn = NewtClusterConnection('token', CLUSTER_LOAD)
+    output = ''.join('%s\t%d\t%f\t755\t%s\0' % (type, entry['size'],
+                                                  entry['mtime'],
+                                                  entry['name'])
+                     for (type, entry) in [('d', DIR1), ('f', FILE1)])
+    encoded = base64.encodebytes(output.encode('utf8')).decode('utf8')
+    conn.execute = mock.Mock(return_value=encoded.split('\n'))
+    conn.list = mock.Mock()
+    get_connection.return_value.__enter__.return_value = conn
+    _set_mock_cluster(cluster)
+
+    id = urllib.parse.quote_plus(json.dumps(DIR_ID_FIELDS))
+
+    r = unbound_server.request('/folder', method='GET',
+                       type='application/json', params={'parentId': id},
+                       user=user)
+    assertStatusOk(r)
+    assert [f['name'] for f in r.json] == [DIR1['name']]
+
+    r = unbound_server.request('/item', method='GET',
+                       type='application/json', params={'folderId': id},
+                       user=user)
+    assertStatusOk(r)
+    assert [i['name'] for i in r.json] == [FILE1['name']]
+    assert r.json[0]['size'] == FILE1['size']
+
+    assert conn.execute.call_count == 2
+    command = conn.execute.call_args[0][0]
+    assert command.startswith('/bin/bash -c ')
+    assert 'find %s -mindepth 1 -maxdepth 1' % PATH in command
+    conn.list.assert_not_called()
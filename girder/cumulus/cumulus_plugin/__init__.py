@@ -30,7 +30,11 @@ from . import aws
 from .models.aws import Aws as AwsModel
 from .models.cluster import Cluster as ClusterModel
 from .models.job import Job as JobModel
+from .models.queue_snapshot import QueueSnapshot as QueueSnapshotModel
+from .models.scheduler_metadata import SchedulerMetadata as \
+    SchedulerMetadataModel
 from .models.script import Script as ScriptModel
+from .models.transfer_lease import TransferLease as TransferLeaseModel
 from .models.volume import Volume as VolumeModel
 
 class CumulusPlugin(GirderPlugin):
@@ -42,6 +46,12 @@ class CumulusPlugin(GirderPlugin):
         ModelImporter.registerModel('job', JobModel, 'cumulus')
         ModelImporter.registerModel('script', ScriptModel, 'cumulus')
         ModelImporter.registerModel('volume', VolumeModel, 'cumulus')
+        ModelImporter.registerModel('transfer_lease', TransferLeaseModel,
+                                    'cumulus')
+        ModelImporter.registerModel('queue_snapshot', QueueSnapshotModel,
+                                    'cumulus')
+        ModelImporter.registerModel('scheduler_metadata',
+                                    SchedulerMetadataModel, 'cumulus')
 
         info['apiRoot'].clusters = Cluster()
         info['apiRoot'].jobs = Job()
@@ -33,7 +33,9 @@ from girder.utility.model_importer import ModelImporter
 from .base import BaseResource
 from cumulus.constants import ClusterType, ClusterStatus
 from .utility.cluster_adapters import get_cluster_adapter
+from .utility.file_ranges import read_file_range
 from cumulus.ssh.tasks.key import generate_key_pair
+from cumulus.tasks import cluster as cluster_tasks
 from cumulus.common import update_dict
 from cumulus.common.jsonpath import get_property
 
@@ -46,6 +48,22 @@ class Cluster(BaseResource):
         self.route('POST', (), self.create)
         self.route('POST', (':id', 'log'), self.handle_log_record)
         self.route('GET', (':id', 'log'), self.log)
+        self.route('POST', (':id', 'metrics'), self.add_metrics)
+        self.route('GET', (':id', 'metrics'), self.metrics)
+        self.route('POST', (':id', 'transfers'), self.acquire_transfer)
+        self.route('PUT', (':id', 'transfers', ':leaseId'),
+                   self.renew_transfer)
+        self.route('DELETE', (':id', 'transfers', ':leaseId'),
+                   self.release_transfer)
+        self.route('GET', (':id', 'files', 'range'), self.read_file_range)
+        self.route('GET', (':id', 'queue'), self.queue_snapshot)
+        self.route('PUT', (':id', 'queue'), self.save_queue_snapshot)
+        self.route('GET', (':id', 'scheduler'), self.scheduler_metadata)
+        self.route('PUT', (':id', 'scheduler'), self.save_scheduler_metadata)
+        self.route('DELETE', (':id', 'scheduler'),
+                   self.invalidate_scheduler_metadata)
+        self.route('PUT', (':id', 'scheduler', 'refresh'),
+                   self.refresh_scheduler_metadata)
         self.route('PUT', (':id', 'start'), self.start)
         self.route('PUT', (':id', 'launch'), self.launch)
         self.route('PUT', (':id', 'provision'), self.provision)
@@ -53,6 +71,7 @@ class Cluster(BaseResource):
         self.route('GET', (':id', 'status'), self.status)
         self.route('PUT', (':id', 'terminate'), self.terminate)
         self.route('PUT', (':id', 'job', ':jobId', 'submit'), self.submit_job)
+        self.route('PUT', (':id', 'jobs', 'submit'), self.submit_jobs)
         self.route('GET', (':id', ), self.get)
         self.route('DELETE', (':id', ), self.delete)
         self.route('GET', (), self.find)
@@ -355,6 +374,10 @@ class Cluster(BaseResource):
 
             update_dict(cluster['config'], body['config'])
 
+            # The scheduler may have changed
+            ModelImporter.model('scheduler_metadata', 'cumulus') \
+                .invalidate(cluster)
+
         cluster = self._model.update_cluster(user, cluster)
 
         # Now do any updates the adapter provides
@@ -455,6 +478,314 @@ class Cluster(BaseResource):
             'The offset to start getting entries at.', required=False,
             paramType='query'))
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def add_metrics(self, id, params):
+        user = self.getCurrentUser()
+
+        if not self._model.load(id, user=user, level=AccessType.ADMIN):
+            raise RestException('Cluster not found.', code=404)
+
+        self._model.add_metrics(user, id, getBodyJson())
+
+    add_metrics.description = None
+
+    @access.user(scope=TokenScope.DATA_READ)
+    def metrics(self, id, params):
+        user = self.getCurrentUser()
+
+        if not self._model.load(id, user=user, level=AccessType.READ):
+            raise RestException('Cluster not found.', code=404)
+
+        return self._model.metrics(user, id)
+
+    metrics.description = (Description(
+        'Get the transport metrics recorded for a cluster. These are pushed '
+        'by workers using the girder metrics sink, for each operation '
+        '( connect, execute, put, get, list, stat ) there is a count, error '
+        'count, total time, bytes transferred and a latency histogram keyed '
+        'by bucket upper bound in milliseconds.'
+    )
+        .param(
+            'id',
+            'The cluster to get metrics for.', paramType='path'))
+
+    def _load_for_transfer(self, id):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.READ)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        return (user, cluster)
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def acquire_transfer(self, id, params):
+        (user, cluster) = self._load_for_transfer(id)
+        lease_model = ModelImporter.model('transfer_lease', 'cumulus')
+
+        owner_id = params.get('ownerId')
+        if owner_id is not None:
+            if not ObjectId.is_valid(owner_id):
+                raise RestException('Invalid ownerId.', code=400)
+            owner_id = ObjectId(owner_id)
+
+        return lease_model.acquire(user, cluster, owner_id=owner_id)
+
+    acquire_transfer.description = (Description(
+        'Request a lease to transfer data to or from a cluster. The number of '
+        'concurrent transfers per cluster is limited by '
+        'config.transfer.maxSessions, if no slot is free the lease is '
+        'returned with a status of waiting and should be renewed after '
+        'retryAfter seconds. An active lease carries the rate in bytes per '
+        'second the transfer should be throttled to, if '
+        'config.transfer.maxBandwidth is set.'
+    )
+        .param(
+            'id',
+            'The cluster to transfer data to or from.', paramType='path')
+        .param(
+            'ownerId',
+            'The user the transfer is made for, slots are shared fairly '
+            'between owners. Defaults to the current user.', required=False))
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def renew_transfer(self, id, leaseId, params):
+        (user, cluster) = self._load_for_transfer(id)
+        lease_model = ModelImporter.model('transfer_lease', 'cumulus')
+
+        lease = lease_model.acquire(user, cluster, lease_id=leaseId)
+        if lease is None:
+            raise RestException('Lease not found.', code=404)
+
+        return lease
+
+    renew_transfer.description = (Description(
+        'Renew a transfer lease, a waiting lease is activated if a slot is '
+        'free and it is next in line. Leases expire if they are not renewed, '
+        'renewing an expired lease returns 404 and a new lease has to be '
+        'requested.'
+    )
+        .param(
+            'id',
+            'The cluster id.', paramType='path')
+        .param(
+            'leaseId',
+            'The lease to renew.', paramType='path'))
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def release_transfer(self, id, leaseId, params):
+        (user, cluster) = self._load_for_transfer(id)
+        lease_model = ModelImporter.model('transfer_lease', 'cumulus')
+        lease_model.release(user, cluster, leaseId)
+
+    release_transfer.description = (Description(
+        'Release a transfer lease, freeing its slot for another transfer.'
+    )
+        .param(
+            'id',
+            'The cluster id.', paramType='path')
+        .param(
+            'leaseId',
+            'The lease to release.', paramType='path'))
+
+    @access.user(scope=TokenScope.DATA_READ)
+    def queue_snapshot(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.READ)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        self.requireParams(['maxAge'], params)
+        try:
+            max_age = float(params['maxAge'])
+            after = float(params['after']) if 'after' in params else None
+        except ValueError:
+            raise RestException('maxAge and after must be numbers.',
+                                code=400)
+
+        snapshot_model = ModelImporter.model('queue_snapshot', 'cumulus')
+
+        return snapshot_model.get(cluster, max_age, after=after)
+
+    queue_snapshot.description = (Description(
+        'Get the last snapshot of the scheduler queue of a cluster, shared '
+        'by the tasks monitoring jobs on the cluster. If the snapshot is '
+        'older than maxAge, or was taken before after, refresh is set for '
+        'the one caller that should query the scheduler and save a new '
+        'snapshot with the time given by refreshTime, other callers should '
+        'retry after retryAfter seconds if the snapshot is too old for them.'
+    )
+        .param(
+            'id',
+            'The cluster id.', paramType='path')
+        .param(
+            'maxAge',
+            'The age in seconds at which the snapshot should be refreshed.',
+            dataType='number', paramType='query')
+        .param(
+            'after',
+            'The snapshot must have been taken after this time, in seconds '
+            'since the epoch by the clock of this server, such as the '
+            'queuedAt of a job.', required=False, dataType='number',
+            paramType='query'))
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def save_queue_snapshot(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        body = getBodyJson()
+        self.requireParams(['time', 'states'], body)
+        if not isinstance(body['states'], list):
+            raise RestException('states must be a list.', code=400)
+
+        snapshot_model = ModelImporter.model('queue_snapshot', 'cumulus')
+        snapshot_model.save_snapshot(cluster, body['time'], body['states'])
+
+    save_queue_snapshot.description = None
+
+    @access.user(scope=TokenScope.DATA_READ)
+    def scheduler_metadata(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.READ)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        max_age = None
+        if 'maxAge' in params:
+            try:
+                max_age = float(params['maxAge'])
+            except ValueError:
+                raise RestException('maxAge must be a number.', code=400)
+
+        metadata_model = ModelImporter.model('scheduler_metadata', 'cumulus')
+
+        return metadata_model.get(cluster, max_age=max_age,
+                                  key=params.get('key'))
+
+    scheduler_metadata.description = (Description(
+        'Get the cached metadata about the scheduler of a cluster, the slots '
+        'of each parallel environment and the queues with their limits for '
+        'example. The cache is filled as the scheduler is queried, or by '
+        'refreshing it.'
+    )
+        .param(
+            'id',
+            'The cluster id.', paramType='path')
+        .param(
+            'key',
+            'Only return this entry.', required=False, paramType='query')
+        .param(
+            'maxAge',
+            'Leave out entries older than this, in seconds.', required=False,
+            dataType='number', paramType='query'))
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def save_scheduler_metadata(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        metadata_model = ModelImporter.model('scheduler_metadata', 'cumulus')
+        metadata_model.save_metadata(cluster, getBodyJson())
+
+    save_scheduler_metadata.description = None
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def invalidate_scheduler_metadata(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        metadata_model = ModelImporter.model('scheduler_metadata', 'cumulus')
+        metadata_model.invalidate(cluster, key=params.get('key'))
+
+    invalidate_scheduler_metadata.description = (
+        Description('Invalidate the cached scheduler metadata of a cluster, '
+                    'it is fetched from the scheduler again when next needed')
+        .param(
+            'id',
+            'The cluster id.', paramType='path')
+        .param(
+            'key',
+            'Only invalidate this entry.', required=False,
+            paramType='query'))
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def refresh_scheduler_metadata(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        if cluster['status'] != ClusterStatus.RUNNING:
+            raise RestException('Cluster is not running', code=400)
+
+        metadata_model = ModelImporter.model('scheduler_metadata', 'cumulus')
+        metadata_model.invalidate(cluster)
+
+        girder_token = self.get_task_token(cluster)['_id']
+        cluster_tasks.refresh_scheduler_metadata.delay(
+            self._model.filter(cluster, user, passphrase=False),
+            girder_token=girder_token)
+
+    refresh_scheduler_metadata.description = (
+        Description('Fetch the scheduler metadata of a cluster again, in the '
+                    'background')
+        .param(
+            'id',
+            'The cluster id.', paramType='path'))
+
+    @access.user(scope=TokenScope.DATA_READ)
+    def read_file_range(self, id, params):
+        user = self.getCurrentUser()
+        # Any file the cluster's credentials can read is readable, so this is
+        # limited to those that administer the cluster. Job.read_file_range
+        # gives access to the files of a job.
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        if 'path' not in params:
+            raise RestException('path parameter is required.', code=400)
+
+        return read_file_range(cluster, params['path'], params)
+
+    read_file_range.description = (Description(
+        'Read a range of bytes from a file on a cluster, without transferring '
+        'the whole file. The bytes are returned as the raw response.'
+    )
+        .param(
+            'id',
+            'The cluster id.', paramType='path')
+        .param(
+            'path',
+            'The path of the file on the cluster.', paramType='query')
+        .param(
+            'offset',
+            'The offset to start reading at.', required=False,
+            dataType='integer', paramType='query')
+        .param(
+            'length',
+            'The number of bytes to read, at most 16MiB.', required=False,
+            dataType='integer', paramType='query')
+        .param(
+            'tail',
+            'Read this many bytes from the end of the file, rather than '
+            'using offset and length.', required=False, dataType='integer',
+            paramType='query'))
+
     @access.user(scope=TokenScope.DATA_WRITE)
     def submit_job(self, id, jobId, params):
         job_id = jobId
@@ -501,6 +832,66 @@ class Cluster(BaseResource):
             'The properties to template on submit.', dataType='object',
             paramType='body'))
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def submit_jobs(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        if cluster['status'] != ClusterStatus.RUNNING:
+            raise RestException('Cluster is not running', code=400)
+
+        body = getBodyJson()
+        self.requireParams(['jobIds'], body)
+        job_ids = body['jobIds']
+        if not isinstance(job_ids, list) or not job_ids:
+            raise RestException('jobIds must be a non-empty list.', code=400)
+
+        job_model = ModelImporter.model('job', 'cumulus')
+        jobs = []
+        for job_id in job_ids:
+            job = job_model.load(job_id, user=user, level=AccessType.ADMIN)
+            if not job:
+                raise RestException('Job not found: %s' % job_id, code=404)
+
+            # Input is downloaded per job before it is submitted
+            if job.get('input'):
+                raise RestException(
+                    'Jobs with input can not be submitted together: %s'
+                    % job_id, code=400)
+            jobs.append(job)
+
+        for job in jobs:
+            # Set the clusterId on the job for termination
+            job['clusterId'] = ObjectId(id)
+
+            # Add any job parameters to be used when templating job script
+            if 'params' in body:
+                job['params'] = body['params']
+
+            job_model.save(job)
+            del job['access']
+            del job['log']
+
+        cluster_adapter = get_cluster_adapter(cluster)
+        cluster_adapter.submit_jobs(jobs)
+
+    submit_jobs.description = (
+        Description('Submit related jobs to the cluster as a single job '
+                    'array, one script is submitted and each job tracks its '
+                    'own element')
+        .param(
+            'id',
+            'The cluster to submit the jobs to.', required=True,
+            paramType='path')
+        .param(
+            'body',
+            'The jobIds to submit and the params to template on submit, the '
+            'scheduler parameters apply to the whole array.',
+            dataType='object', paramType='body'))
+
     @access.user(scope=TokenScope.DATA_READ)
     def get(self, id, params):
         user = self.getCurrentUser()
@@ -528,6 +919,8 @@ class Cluster(BaseResource):
         adapter = get_cluster_adapter(cluster)
         adapter.delete()
 
+        ModelImporter.model('scheduler_metadata', 'cumulus') \
+            .invalidate(cluster)
         self._model.delete(user, id)
 
     delete.description = (
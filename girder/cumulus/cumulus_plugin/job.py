@@ -18,6 +18,9 @@
 ###############################################################################
 
 import cherrypy
+import hmac
+import os
+import time
 import cumulus
 
 from girder.api import access
@@ -27,6 +30,7 @@ from girder.api.docs import addModel
 from girder.api.rest import RestException, getBodyJson, loadmodel
 from girder.utility.model_importer import ModelImporter
 from .base import BaseResource
+from .utility.file_ranges import read_file_range
 
 from cumulus import tasks
 from cumulus.constants import JobState
@@ -40,9 +44,12 @@ class Job(BaseResource):
         self.route('PATCH', (':id',), self.update)
         self.route('GET', (':id', 'status'), self.status)
         self.route('PUT', (':id', 'terminate'), self.terminate)
+        self.route('PUT', ('terminate',), self.terminate_jobs)
+        self.route('PUT', (':id', 'complete'), self.complete)
         self.route('POST', (':id', 'log'), self.append_to_log)
         self.route('GET', (':id', 'log'), self.log)
         self.route('GET', (':id', 'output'), self.output)
+        self.route('GET', (':id', 'files', 'range'), self.read_file_range)
         self.route('DELETE', (':id', ), self.delete)
         self.route('GET', (':id',), self.get)
         self.route('GET', (), self.find)
@@ -52,6 +59,7 @@ class Job(BaseResource):
     def _clean(self, job):
         del job['access']
         del job['log']
+        job.pop('callbackSecret', None)
         job['_id'] = str(job['_id'])
         job['userId'] = str(job['userId'])
 
@@ -225,6 +233,97 @@ class Job(BaseResource):
         Description('Terminate a job')
         .param('id', 'The job id', paramType='path'))
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def terminate_jobs(self, params):
+        user = self.getCurrentUser()
+        body = getBodyJson()
+        self.requireParams(['jobIds'], body)
+        job_ids = body['jobIds']
+        if not isinstance(job_ids, list):
+            raise RestException('jobIds must be a list.', code=400)
+
+        jobs = []
+        for id in job_ids:
+            job = self._model.load(id, user=user, level=AccessType.ADMIN)
+            if not job:
+                raise RestException('Job not found: %s' % id, code=404)
+            if 'clusterId' not in job:
+                raise RestException('Job has not been submitted: %s' % id,
+                                    code=400)
+            jobs.append(job)
+
+        # The jobs on each cluster are terminated by a single task
+        cluster_model = ModelImporter.model('cluster', 'cumulus')
+        girder_token = self.get_task_token()['_id']
+        by_cluster = {}
+        for job in jobs:
+            by_cluster.setdefault(job['clusterId'], []).append(job)
+
+        terminated = []
+        for (cluster_id, cluster_jobs) in by_cluster.items():
+            cluster = cluster_model.load(cluster_id, user=user,
+                                         level=AccessType.ADMIN)
+            for job in cluster_jobs:
+                self._model.update_status(user, job['_id'],
+                                          JobState.TERMINATING)
+
+            cluster_jobs = [self._clean(job) for job in cluster_jobs]
+            tasks.job.terminate_jobs.delay(cluster, cluster_jobs,
+                                           girder_token=girder_token)
+            terminated += cluster_jobs
+
+        return terminated
+
+    terminate_jobs.description = (
+        Description('Terminate several jobs, the jobs on each cluster are '
+                    'passed to the scheduler together')
+        .param(
+            'body',
+            'The jobIds to terminate.', dataType='object',
+            paramType='body', required=True))
+
+    @access.public
+    def complete(self, id, params):
+        """
+        Called by the submission script of a job when it exits, the job
+        authenticates with the secret it was given when it was submitted.
+        """
+        body = getBodyJson()
+        self.requireParams(['secret'], body)
+
+        job = self._model.load(id, force=True)
+        secret = job.get('callbackSecret') if job else None
+        if not secret or not hmac.compare_digest(str(body['secret']),
+                                                 str(secret)):
+            raise RestException('Job not found.', code=404)
+
+        job['completion'] = {
+            key: body[key] for key in ['exitCode', 'startTime', 'endTime']
+            if key in body
+        }
+        self._model.update({'_id': job['_id']}, {
+            '$set': {'completion': job['completion']}
+        })
+
+        cluster_model = ModelImporter.model('cluster', 'cumulus')
+        cluster = cluster_model.load(job['clusterId'], force=True)
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        owner = ModelImporter.model('user').load(job['userId'], force=True)
+
+        base_url = cumulus.config.girder.baseUrl
+        log_url = '%s/jobs/%s/log' % (base_url, id)
+        girder_token = self.get_task_token(cluster, owner)['_id']
+        cluster = cluster_model.filter(cluster, owner, passphrase=False)
+        tasks.job.job_complete.delay(cluster, self._clean(job),
+                                     log_write_url=log_url,
+                                     girder_token=girder_token)
+
+        return {'status': job['status']}
+
+    complete.description = None
+
     @access.user(scope=TokenScope.DATA_WRITE)
     def update(self, id, params):
         user = self.getCurrentUser()
@@ -234,11 +333,25 @@ class Job(BaseResource):
         if not job:
             raise RestException('Job not found.', code=404)
 
+        if 'previousStatus' in body:
+            self.requireParams(['status'], body)
+            # Only one of the tasks racing to move the job on should win
+            if not self._model.claim_status(job, body['previousStatus'],
+                                            body['status']):
+                raise RestException('Job status has already changed.',
+                                    code=409)
+
         if 'status' in body:
             job['status'] = body['status']
 
+        if 'callbackSecret' in body:
+            job['callbackSecret'] = body['callbackSecret']
+
         if 'queueJobId' in body:
             job['queueJobId'] = body['queueJobId']
+            # When the job entered the queue by this server's clock, a queue
+            # snapshot taken before then doesn't include it.
+            job['queuedAt'] = time.time()
 
         if 'output' in body:
             job['output'] = body['output']
@@ -261,6 +374,8 @@ class Job(BaseResource):
         del job['access']
         # Don't return the log
         del job['log']
+        # Don't return the completion callback secret
+        job.pop('callbackSecret', None)
 
         return job
 
@@ -271,6 +386,17 @@ class Job(BaseResource):
                 '$ref': '#/definitions/JobStatus',
                 'description': 'The new status. (optional)'
             },
+            'previousStatus': {
+                '$ref': '#/definitions/JobStatus',
+                'description': 'Only update the status if the job is still '
+                               'in this status, otherwise a 409 is '
+                               'returned. (optional)'
+            },
+            'callbackSecret': {
+                'type': 'string',
+                'description': 'The secret the job passes to report its '
+                               'completion. (optional)'
+            },
             'queueJobId': {'type': 'integer',
                            'description': 'The native queue job id. (optional)'},
             'metadata': {'type': 'object',
@@ -401,6 +527,61 @@ class Job(BaseResource):
             'The offset to start getting entries at.', required=False,
             paramType='query'))
 
+    @access.user(scope=TokenScope.DATA_READ)
+    def read_file_range(self, id, params):
+        user = self.getCurrentUser()
+
+        if 'path' not in params:
+            raise RestException('path parameter is required.', code=400)
+
+        job = self._model.load(id, user=user, level=AccessType.READ)
+
+        if not job:
+            raise RestException('Job not found.', code=404)
+
+        if 'dir' not in job or 'clusterId' not in job:
+            raise RestException('Job has not been submitted.', code=400)
+
+        # Only allow access to files in the job directory
+        path = os.path.normpath(params['path'])
+        if os.path.isabs(path) or path.split(os.sep)[0] == '..':
+            raise RestException('path must be within the job directory.',
+                                code=400)
+
+        cluster = ModelImporter.model('cluster', 'cumulus').load(
+            job['clusterId'], user=user, level=AccessType.READ)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        return read_file_range(cluster, os.path.join(job['dir'], path),
+                               params)
+
+    read_file_range.description = (
+        Description('Read a range of bytes from a file in the job directory, '
+                    'without transferring the whole file. The bytes are '
+                    'returned as the raw response.')
+        .param(
+            'id',
+            'The job id.', paramType='path')
+        .param(
+            'path',
+            'The path of the file relative to the job directory.',
+            paramType='query')
+        .param(
+            'offset',
+            'The offset to start reading at.', required=False,
+            dataType='integer', paramType='query')
+        .param(
+            'length',
+            'The number of bytes to read, at most 16MiB.', required=False,
+            dataType='integer', paramType='query')
+        .param(
+            'tail',
+            'Read this many bytes from the end of the file, rather than '
+            'using offset and length.', required=False, dataType='integer',
+            paramType='query'))
+
     @access.user(scope=TokenScope.DATA_READ)
     def get(self, id, params):
         user = self.getCurrentUser()
@@ -247,6 +247,47 @@ class Cluster(BaseModel):
 
         return self.save(current_cluster)
 
+    def add_metrics(self, user, id, metrics):
+        """
+        Add transport metrics pushed by a worker to the running totals held
+        on the cluster.
+
+        :param metrics: Stats keyed by operation, as produced by the metrics
+                        sinks in cumulus.transport.metrics.
+        """
+        # Load first to force access check
+        self.load(id, user=user, level=AccessType.WRITE)
+
+        def _key(*parts):
+            for part in parts:
+                if not part or '.' in part or '$' in part:
+                    raise ValidationException('Invalid metrics key: %s' % part)
+
+            return '.'.join(('metrics',) + parts)
+
+        def _number(value):
+            if not isinstance(value, six.integer_types + (float,)) or \
+                    isinstance(value, bool):
+                raise ValidationException('Invalid metrics value: %s' % value)
+
+            return value
+
+        inc = {}
+        for (operation, stats) in six.iteritems(metrics):
+            for field in ['count', 'errors', 'totalTime', 'bytes']:
+                if field in stats:
+                    inc[_key(operation, field)] = _number(stats[field])
+            for (label, count) in six.iteritems(stats.get('histogram', {})):
+                inc[_key(operation, 'histogram', label)] = _number(count)
+
+        if inc:
+            self.update({'_id': ObjectId(id)}, {'$inc': inc})
+
+    def metrics(self, user, id):
+        cluster = self.load(id, user=user, level=AccessType.READ)
+
+        return cluster.get('metrics', {})
+
     def log_records(self, user, id, offset=0):
         # TODO Need to figure out perms a remove this force
         cluster = self.load(id, user=user, level=AccessType.READ)
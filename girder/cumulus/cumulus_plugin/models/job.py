@@ -75,6 +75,27 @@ class Job(BaseModel):
 
         return job
 
+    def claim_status(self, job, previous_status, status):
+        """
+        Atomically move a job to status, only if it is still in
+        previous_status. Returns False if its status has already been changed.
+        """
+        result = self.collection.update_one({
+            '_id': ObjectId(job['_id']),
+            'status': previous_status
+        }, {
+            '$set': {
+                'status': status
+            }
+        })
+        if result.modified_count != 1:
+            return False
+
+        job['status'] = status
+        send_status_notification('job', job)
+
+        return True
+
     def update_job(self, user, job):
         job_id = job['_id']
         current_job = self.load(job_id, user=user, level=AccessType.WRITE)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+import time
+
+from girder.models.model_base import Model
+from pymongo.errors import DuplicateKeyError
+
+# How long a worker has to refresh a snapshot once it has been told to, in
+# seconds. If the refresh doesn't arrive in time another worker is asked.
+REFRESH_TIMEOUT = 30
+# How long a worker that needs a newer snapshot than the one being refreshed
+# should wait before asking again.
+RETRY_AFTER = 1
+
+
+class QueueSnapshot(Model):
+    """
+    The last state of the scheduler queue of each cluster, shared by all the
+    tasks monitoring jobs on the cluster. Only one worker at a time is asked
+    to query the scheduler when the snapshot gets old, the rest are served
+    the snapshot.
+    """
+
+    def initialize(self):
+        self.name = 'queue_snapshots'
+        self.ensureIndices([('clusterId', {'unique': True})])
+
+    def validate(self, doc):
+        return doc
+
+    def _claim_refresh(self, cluster_id, now):
+        """
+        Returns True if the caller should refresh the snapshot, only one
+        caller is told to until the refresh is saved or times out.
+        """
+        try:
+            result = self.collection.update_one({
+                'clusterId': cluster_id,
+                '$or': [
+                    {'refreshExpires': {'$lt': now}},
+                    {'refreshExpires': {'$exists': False}}
+                ]
+            }, {
+                '$set': {
+                    'refreshExpires':
+                        now + datetime.timedelta(seconds=REFRESH_TIMEOUT)
+                }
+            }, upsert=True)
+        except DuplicateKeyError:
+            # Someone else is refreshing
+            return False
+
+        return bool(result.modified_count or result.upserted_id)
+
+    def get(self, cluster, max_age, after=None):
+        """
+        Returns the snapshot for a cluster. If it is older than max_age
+        seconds, or was taken before after, refresh is set in the response of
+        the one caller that should query the scheduler and save a new
+        snapshot, along with the refreshTime to save it with.
+
+        Snapshot times, refreshTime and after ( the queuedAt of a job ) are
+        all taken from this server's clock, so they can be compared whatever
+        the skew between the workers.
+        """
+        cluster_id = cluster['_id']
+        refresh_time = time.time()
+        now = datetime.datetime.utcnow()
+        snapshot = self.findOne({'clusterId': cluster_id}) or {}
+
+        fresh = 'updated' in snapshot and \
+            snapshot['updated'] >= now - datetime.timedelta(seconds=max_age)
+        if fresh and after is not None:
+            fresh = snapshot['time'] >= after
+
+        refresh = False
+        if not fresh:
+            refresh = self._claim_refresh(cluster_id, now)
+
+        return {
+            'time': snapshot.get('time'),
+            'states': snapshot.get('states', []),
+            'refresh': refresh,
+            'refreshTime': refresh_time if refresh else None,
+            'retryAfter': RETRY_AFTER
+        }
+
+    def save_snapshot(self, cluster, snapshot_time, states):
+        """
+        Save a snapshot taken at snapshot_time ( the refreshTime handed to the
+        worker that queried the scheduler ), a snapshot older than the one
+        already saved is dropped. The states are a list of entries holding
+        their queueJobId, the ids of array elements can contain '.' so they
+        can't be used as keys.
+        """
+        try:
+            self.collection.update_one({
+                'clusterId': cluster['_id'],
+                '$or': [
+                    {'time': {'$lt': snapshot_time}},
+                    {'time': {'$exists': False}}
+                ]
+            }, {
+                '$set': {
+                    'time': snapshot_time,
+                    'states': states,
+                    'updated': datetime.datetime.utcnow()
+                },
+                '$unset': {
+                    'refreshExpires': ''
+                }
+            }, upsert=True)
+        except DuplicateKeyError:
+            # A newer snapshot has already been saved
+            pass
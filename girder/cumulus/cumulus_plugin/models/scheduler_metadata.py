@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import datetime
+
+from girder.models.model_base import Model
+
+
+class SchedulerMetadata(Model):
+    """
+    Metadata about the scheduler of each cluster, the slots of its parallel
+    environments and its queues for example, cached so that submissions, the
+    UI and taskflows don't have to ask the scheduler. Each entry is kept
+    under a key, with the time it was saved.
+    """
+
+    def initialize(self):
+        self.name = 'scheduler_metadata'
+        self.ensureIndices([([('clusterId', 1), ('key', 1)],
+                             {'unique': True})])
+
+    def validate(self, doc):
+        return doc
+
+    def _query(self, cluster, key=None):
+        query = {'clusterId': cluster['_id']}
+        if key is not None:
+            query['key'] = key
+
+        return query
+
+    def get(self, cluster, max_age=None, key=None):
+        """
+        Returns a dict of the cached entries of a cluster, only key if it is
+        given, entries older than max_age seconds are left out.
+        """
+        query = self._query(cluster, key)
+        if max_age is not None:
+            query['updated'] = {
+                '$gte': datetime.datetime.utcnow() -
+                datetime.timedelta(seconds=max_age)
+            }
+
+        return {doc['key']: doc['value'] for doc in self.find(query)}
+
+    def save_metadata(self, cluster, entries):
+        now = datetime.datetime.utcnow()
+        for (key, value) in entries.items():
+            self.collection.update_one(self._query(cluster, key), {
+                '$set': {
+                    'value': value,
+                    'updated': now
+                }
+            }, upsert=True)
+
+    def invalidate(self, cluster, key=None):
+        """
+        Drop the cached entries of a cluster, or just key if it is given.
+        """
+        self.collection.delete_many(self._query(cluster, key))
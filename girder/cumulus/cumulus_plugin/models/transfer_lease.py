@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+
+from bson.objectid import ObjectId
+from girder.models.model_base import Model
+from girder.utility.model_importer import ModelImporter
+
+from cumulus.common.jsonpath import get_property
+
+# Defaults for the limits, these can be overridden in the transfer section of
+# the cluster config.
+MAX_SESSIONS = 4
+# How long a lease lasts without being renewed, in seconds
+LEASE_TTL = 60
+# How long a worker waiting for a lease should wait before polling again
+RETRY_AFTER = 5
+
+
+class LeaseStatus:
+    ACTIVE = 'active'
+    WAITING = 'waiting'
+
+
+class TransferLease(Model):
+    """
+    Leases granting a worker the right to transfer data to or from a cluster.
+    The number of active leases per cluster is bounded, requests that can't
+    be granted wait in a queue that is served fairly between users.
+    """
+
+    def initialize(self):
+        self.name = 'transfer_leases'
+        self.ensureIndices(['clusterId', 'expires'])
+
+    def validate(self, doc):
+        return doc
+
+    def _limits(self, cluster):
+        config = cluster.get('config', {})
+
+        return (get_property('transfer.maxSessions', config,
+                             default=MAX_SESSIONS),
+                get_property('transfer.maxBandwidth', config, default=None))
+
+    def _cluster_collection(self):
+        return ModelImporter.model('cluster', 'cumulus').collection
+
+    def _release_slot(self, lease_id, cluster_id):
+        # Only the request that removes an active lease gives its slot back, so
+        # the count stays consistent when leases expire concurrently.
+        result = self.collection.delete_one({
+            '_id': lease_id,
+            'status': LeaseStatus.ACTIVE
+        })
+        if result.deleted_count:
+            self._cluster_collection().update_one(
+                {'_id': cluster_id}, {'$inc': {'transferSessions': -1}})
+
+    def _expire(self, cluster_id, now):
+        expired = self.find({
+            'clusterId': cluster_id,
+            'expires': {'$lt': now}
+        })
+        for lease in expired:
+            if lease['status'] == LeaseStatus.ACTIVE:
+                self._release_slot(lease['_id'], cluster_id)
+            else:
+                self.collection.delete_one({'_id': lease['_id']})
+
+        # A slot claimed by a request that didn't get to activate its lease,
+        # a worker crash for example, would otherwise be lost for good.
+        active = self.collection.count_documents({
+            'clusterId': cluster_id,
+            'status': LeaseStatus.ACTIVE
+        })
+        self._cluster_collection().update_one(
+            {'_id': cluster_id}, {'$set': {'transferSessions': active}})
+
+    def _claim_slot(self, cluster_id, max_sessions):
+        result = self._cluster_collection().update_one({
+            '_id': cluster_id,
+            '$or': [
+                {'transferSessions': {'$lt': max_sessions}},
+                {'transferSessions': {'$exists': False}}
+            ]
+        }, {
+            '$inc': {'transferSessions': 1}
+        })
+
+        return result.modified_count == 1
+
+    def _activate(self, lease, cluster_id, max_sessions):
+        """
+        Claim a slot and activate the waiting lease, returns True if it was
+        activated. The slot is given back if the lease is no longer waiting,
+        it may have been expired since it was read.
+        """
+        if not self._claim_slot(cluster_id, max_sessions):
+            return False
+
+        result = self.collection.update_one({
+            '_id': lease['_id'],
+            'status': LeaseStatus.WAITING
+        }, {
+            '$set': {
+                'status': LeaseStatus.ACTIVE,
+                'expires': lease['expires']
+            }
+        })
+        if result.modified_count != 1:
+            self._cluster_collection().update_one(
+                {'_id': cluster_id}, {'$inc': {'transferSessions': -1}})
+
+            return False
+
+        return True
+
+    def _owner(self, lease):
+        # The user the transfer is made for, the lease is requested with the
+        # token of the cumulus user for most clusters.
+        return lease.get('ownerId', lease['userId'])
+
+    def _next_waiting(self, cluster_id):
+        """
+        Returns the waiting lease that should be granted next. The owner with
+        the fewest active leases goes first, so one user queueing lots of
+        transfers can't starve the others, then the oldest request.
+        """
+        active = {}
+        for lease in self.find({'clusterId': cluster_id,
+                                'status': LeaseStatus.ACTIVE}):
+            owner = self._owner(lease)
+            active[owner] = active.get(owner, 0) + 1
+
+        waiting = self.find({'clusterId': cluster_id,
+                             'status': LeaseStatus.WAITING},
+                            sort=[('created', 1)])
+
+        return min(waiting,
+                   key=lambda lease: (active.get(self._owner(lease), 0),
+                                      lease['created']),
+                   default=None)
+
+    def _describe(self, lease, max_bandwidth):
+        doc = {
+            '_id': lease['_id'],
+            'status': lease['status'],
+            'expires': lease['expires'],
+            'ttl': LEASE_TTL,
+            'rate': None
+        }
+        if lease['status'] == LeaseStatus.WAITING:
+            doc['retryAfter'] = RETRY_AFTER
+        elif max_bandwidth:
+            # Share the bandwidth between the active leases, the rate is
+            # recalculated each time the lease is renewed.
+            active = self.collection.count_documents({
+                'clusterId': lease['clusterId'],
+                'status': LeaseStatus.ACTIVE
+            })
+            doc['rate'] = max_bandwidth / max(active, 1)
+
+        return doc
+
+    def _find_lease(self, user, cluster, lease_id):
+        if not ObjectId.is_valid(lease_id):
+            return None
+
+        return self.findOne({
+            '_id': ObjectId(lease_id),
+            'clusterId': cluster['_id'],
+            'userId': user['_id']
+        })
+
+    def acquire(self, user, cluster, lease_id=None, owner_id=None):
+        """
+        Request a lease, or renew one that has already been requested. The
+        lease returned is either active or waiting, a waiting lease should be
+        renewed after retryAfter seconds to keep its place in the queue.
+
+        :param owner_id: The user the transfer is made for, slots are shared
+                         fairly between owners. Defaults to the user.
+        :returns The lease or None if lease_id is given but the lease doesn't
+                 exist, it may have expired.
+        """
+        cluster_id = cluster['_id']
+        (max_sessions, max_bandwidth) = self._limits(cluster)
+        now = datetime.datetime.utcnow()
+        expires = now + datetime.timedelta(seconds=LEASE_TTL)
+
+        self._expire(cluster_id, now)
+
+        if lease_id is not None:
+            lease = self._find_lease(user, cluster, lease_id)
+            if lease is None:
+                return None
+        else:
+            lease = self.save({
+                'clusterId': cluster_id,
+                'userId': user['_id'],
+                'ownerId': owner_id or user['_id'],
+                'status': LeaseStatus.WAITING,
+                'created': now,
+                'expires': expires
+            })
+
+        lease['expires'] = expires
+        if lease['status'] == LeaseStatus.WAITING:
+            next_lease = self._next_waiting(cluster_id)
+            if next_lease is not None and \
+                    next_lease['_id'] == lease['_id'] and \
+                    self._activate(lease, cluster_id, max_sessions):
+                lease['status'] = LeaseStatus.ACTIVE
+                return self._describe(lease, max_bandwidth)
+
+        result = self.collection.update_one({
+            '_id': lease['_id'],
+            'status': lease['status']
+        }, {
+            '$set': {'expires': lease['expires']}
+        })
+        if result.matched_count != 1 and lease_id is not None:
+            # Expired while it was being renewed
+            return None
+
+        return self._describe(lease, max_bandwidth)
+
+    def release(self, user, cluster, lease_id):
+        lease = self._find_lease(user, cluster, lease_id)
+        if lease is None:
+            return
+
+        if lease['status'] == LeaseStatus.ACTIVE:
+            self._release_slot(lease['_id'], cluster['_id'])
+        else:
+            self.collection.delete_one({'_id': lease['_id']})
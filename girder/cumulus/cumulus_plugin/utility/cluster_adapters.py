@@ -109,6 +109,16 @@ class AbstractClusterAdapter(ModelImporter):
             self._model.filter(self.cluster, getCurrentUser(), passphrase=False),
             job, log_url)
 
+    def submit_jobs(self, jobs):
+        # The log of the first job collects the submission log
+        log_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
+                                      jobs[0]['_id'])
+
+        girder_token = get_task_token()['_id']
+        cluster = self._model.filter(self.cluster, getCurrentUser(),
+                                     passphrase=False)
+        cumulus.tasks.job.submit_array(girder_token, cluster, jobs, log_url)
+
 
 class AnsibleClusterAdapter(AbstractClusterAdapter):
     """
@@ -382,6 +392,15 @@ class NewtClusterAdapter(AbstractClusterAdapter):
             self._model.filter(self.cluster, getCurrentUser(), passphrase=False),
             job, log_url)
 
+    def submit_jobs(self, jobs):
+        log_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
+                                      jobs[0]['_id'])
+
+        girder_token = get_task_token(self.cluster)['_id']
+        cluster = self._model.filter(self.cluster, getCurrentUser(),
+                                     passphrase=False)
+        cumulus.tasks.job.submit_array(girder_token, cluster, jobs, log_url)
+
 
 type_to_adapter = {
     ClusterType.EC2: AnsibleClusterAdapter,
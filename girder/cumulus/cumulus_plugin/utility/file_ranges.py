@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import errno
+
+import requests
+
+from girder.api.rest import RestException, getCurrentToken, \
+    setRawResponse, setResponseHeader
+
+from cumulus.transport import get_connection
+
+# The most that can be read by a single request
+MAX_RANGE_LENGTH = 16 * 1024 * 1024
+
+
+def _int_param(params, name):
+    try:
+        return int(params[name])
+    except ValueError:
+        raise RestException('%s must be an integer.' % name, code=400)
+
+
+def range_params(params):
+    """
+    Returns the ( offset, length ) to read from the offset, length and tail
+    query parameters. tail reads the last tail bytes of the file.
+    """
+    if 'tail' in params:
+        length = _int_param(params, 'tail')
+        offset = -length
+    else:
+        offset = _int_param(params, 'offset') if 'offset' in params else 0
+        length = _int_param(params, 'length') if 'length' in params \
+            else MAX_RANGE_LENGTH
+
+    if length < 0 or (offset < 0 and 'tail' not in params):
+        raise RestException('Invalid range.', code=400)
+
+    if length > MAX_RANGE_LENGTH:
+        raise RestException('At most %d bytes can be read at once.'
+                            % MAX_RANGE_LENGTH, code=400)
+
+    return (offset, length)
+
+
+def _not_found(ex):
+    if isinstance(ex, requests.exceptions.HTTPError):
+        return ex.response is not None and ex.response.status_code == 404
+
+    return getattr(ex, 'errno', None) == errno.ENOENT
+
+
+def read_file_range(cluster, path, params):
+    """
+    Read the range of a file on a cluster given by the query parameters, the
+    bytes are returned as the raw response.
+    """
+    (offset, length) = range_params(params)
+    token = getCurrentToken()
+
+    try:
+        with get_connection(token['_id'], cluster) as conn:
+            data = conn.read_range(path, offset=offset, length=length)
+    except (IOError, OSError) as ex:
+        if _not_found(ex):
+            raise RestException('File not found: %s' % path, code=404)
+        # The HTTP errors of NEWT are IOErrors too, they are a failure of the
+        # cluster rather than of the request.
+        if isinstance(ex, requests.exceptions.RequestException):
+            raise RestException('Unable to read file: %s' % path, code=502)
+        raise
+
+    setRawResponse()
+    setResponseHeader('Content-Type', 'application/octet-stream')
+
+    return data
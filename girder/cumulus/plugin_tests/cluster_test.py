@@ -18,14 +18,17 @@
 ###############################################################################
 
 from tests import base
+import errno
 import json
 import mock
+import requests
 from bson.objectid import ObjectId
 
 import cumulus
 from cumulus.transport.files import get_assetstore_url_base
 from cumulus.testing import AssertCallsMixin
 
+from girder.constants import AccessType
 from girder.utility.model_importer import ModelImporter
 
 def setUpModule():
@@ -499,6 +502,123 @@ class ClusterTestCase(AssertCallsMixin, base.TestCase):
         self.assertStatusOk(r)
         self.assertEqual(len(r.json['log']), 1)
 
+    def test_metrics(self):
+        body = {
+            'profileId': str(self._user_profile['_id']),
+            'name': 'test'
+        }
+
+        r = self.request('/clusters', method='POST',
+                         type='application/json', body=json.dumps(body),
+                         user=self._user)
+        self.assertStatus(r, 201)
+        cluster_id = r.json['_id']
+
+        r = self.request('/clusters/546a1844ff34c70456111185/metrics',
+                         method='GET', user=self._user)
+        self.assertStatus(r, 404)
+
+        metrics = {
+            'execute': {
+                'count': 2,
+                'errors': 1,
+                'totalTime': 0.5,
+                'bytes': 100,
+                'histogram': {
+                    '250': 2
+                }
+            }
+        }
+        for _ in range(2):
+            r = self.request('/clusters/%s/metrics' % str(cluster_id),
+                             method='POST', type='application/json',
+                             body=json.dumps(metrics), user=self._user)
+            self.assertStatusOk(r)
+
+        r = self.request('/clusters/%s/metrics' % str(cluster_id),
+                         method='GET', user=self._user)
+        self.assertStatusOk(r)
+        expected = {
+            'execute': {
+                'count': 4,
+                'errors': 2,
+                'totalTime': 1.0,
+                'bytes': 200,
+                'histogram': {
+                    '250': 4
+                }
+            }
+        }
+        self.assertEqual(r.json, expected)
+
+        # Keys that are not safe to use in Mongo should be rejected
+        r = self.request('/clusters/%s/metrics' % str(cluster_id),
+                         method='POST', type='application/json',
+                         body=json.dumps({'$set': {'count': 1}}),
+                         user=self._user)
+        self.assertStatus(r, 400)
+
+    @mock.patch('cumulus_plugin.utility.file_ranges.get_connection')
+    def test_read_file_range(self, get_connection):
+        conn = get_connection.return_value.__enter__.return_value
+        conn.read_range.return_value = b'data'
+        body = {
+            'profileId': str(self._user_profile['_id']),
+            'name': 'test'
+        }
+
+        r = self.request('/clusters', method='POST',
+                         type='application/json', body=json.dumps(body),
+                         user=self._user)
+        self.assertStatus(r, 201)
+        cluster_id = r.json['_id']
+        url = '/clusters/%s/files/range' % cluster_id
+
+        r = self.request(url, method='GET', user=self._user,
+                         params={'path': '/tmp/log', 'offset': 10,
+                                 'length': 4},
+                         isJson=False)
+        self.assertStatusOk(r)
+        self.assertEqual(self.getBody(r), 'data')
+        conn.read_range.assert_called_once_with('/tmp/log', offset=10,
+                                                length=4)
+
+        r = self.request(url, method='GET', user=self._user,
+                         params={'path': '/tmp/log', 'tail': 100},
+                         isJson=False)
+        self.assertStatusOk(r)
+        conn.read_range.assert_called_with('/tmp/log', offset=-100,
+                                           length=100)
+
+        # Too much in one go
+        r = self.request(url, method='GET', user=self._user,
+                         params={'path': '/tmp/log',
+                                 'length': 1024 * 1024 * 1024})
+        self.assertStatus(r, 400)
+
+        conn.read_range.side_effect = IOError(errno.ENOENT, 'No such file')
+        r = self.request(url, method='GET', user=self._user,
+                         params={'path': '/tmp/missing'})
+        self.assertStatus(r, 404)
+
+        # A failure of NEWT isn't reported as a missing file
+        response = requests.Response()
+        response.status_code = 503
+        conn.read_range.side_effect = requests.exceptions.HTTPError(
+            response=response)
+        r = self.request(url, method='GET', user=self._user,
+                         params={'path': '/tmp/log'})
+        self.assertStatus(r, 502)
+
+        # Read access to the cluster isn't enough
+        cluster_model = ModelImporter.model('cluster', 'cumulus')
+        cluster = cluster_model.load(cluster_id, force=True)
+        cluster_model.setUserAccess(cluster, self._another_user,
+                                    AccessType.READ, save=True)
+        r = self.request(url, method='GET', user=self._another_user,
+                         params={'path': '/tmp/log'})
+        self.assertStatus(r, 403)
+
     @mock.patch('cumulus.ansible.tasks.cluster.start_cluster.delay')
     def test_start(self, start_cluster):
 
@@ -103,16 +103,19 @@ class UploadTestCase(base.TestCase):
         cluster_connection.mkdir.assert_has_calls(
             [mock.call(u'/tmp/subfolder')])
 
-        self.assertEqual(len(cluster_connection.put.call_args_list), 3)
-        _, (request, path), _ = cluster_connection.put.mock_calls[0]
+        self.assertEqual(len(cluster_connection.put_ranges.call_args_list), 3)
+        _, (read_range, size, path), _ = \
+            cluster_connection.put_ranges.mock_calls[0]
         self.assertEqual(path, '/tmp/bill.txt')
-        self.assertEqual(request.read().decode('utf8').strip(), 'bill')
+        self.assertEqual(read_range(0, size).decode('utf8').strip(), 'bill')
 
-        _, (request, path), _ = cluster_connection.put.mock_calls[1]
+        _, (read_range, size, path), _ = \
+            cluster_connection.put_ranges.mock_calls[1]
         self.assertEqual(path, '/tmp/bob.txt')
-        self.assertEqual(request.read().decode('utf8').strip(), 'bob')
+        self.assertEqual(read_range(0, size).decode('utf8').strip(), 'bob')
 
-        _, (request, path), _ = cluster_connection.put.mock_calls[2]
+        _, (read_range, size, path), _ = \
+            cluster_connection.put_ranges.mock_calls[2]
         self.assertEqual(path, '/tmp/subfolder/will.txt')
-        self.assertEqual(request.read().decode('utf8').strip(), 'will')
+        self.assertEqual(read_range(0, size).decode('utf8').strip(), 'will')
 
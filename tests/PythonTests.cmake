@@ -51,11 +51,21 @@ function(python_tests_init)
 endfunction()
 
 function(add_python_style_test name input)
+  set(_multival_args PY3_ONLY_FILES)
+  cmake_parse_arguments(fn "" "" "${_multival_args}" ${ARGN})
+
+  # Files that only parse in python 3 are left out when running under 2
+  set(_exclude_args "")
+  if(fn_PY3_ONLY_FILES AND PYTHON_VERSION MATCHES "^2")
+    string(REPLACE ";" "," _exclude "${fn_PY3_ONLY_FILES}")
+    set(_exclude_args "--extend-exclude=${_exclude}")
+  endif()
+
   if(PYTHON_STATIC_ANALYSIS)
     add_test(
       NAME ${name}
       WORKING_DIRECTORY "${PROJECT_SOURCE_DIR}"
-      COMMAND "${FLAKE8_EXECUTABLE}" "--config=${flake8_config}" "${input}"
+      COMMAND "${FLAKE8_EXECUTABLE}" "--config=${flake8_config}" ${_exclude_args} "${input}"
     )
   endif()
 endfunction()
@@ -63,7 +73,7 @@ endfunction()
 function(add_python_test case)
   set(name "${PROJECT_NAME}_${case}")
 
-  set(_options BIND_SERVER PY2_ONLY)
+  set(_options BIND_SERVER PY2_ONLY PY3_ONLY)
   set(_args PLUGIN)
   set(_multival_args RESOURCE_LOCKS TIMEOUT)
   cmake_parse_arguments(fn "${_options}" "${_args}" "${_multival_args}" ${ARGN})
@@ -73,6 +83,11 @@ function(add_python_test case)
     return()
   endif()
 
+  if(fn_PY3_ONLY AND PYTHON_VERSION MATCHES "^2")
+    message(STATUS " !!! Not adding test ${name}, cannot run in python version ${PYTHON_VERSION}.")
+    return()
+  endif()
+
   if(fn_PLUGIN)
     set(name "server_${fn_PLUGIN}.${case}")
     set(module plugin_tests.${case}_test)
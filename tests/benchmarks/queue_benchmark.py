@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Benchmarks parsing scheduler table output in the queue adapters, using the
+recorded output in cases/fixtures/queue scaled up to --jobs jobs. Run from the
+tests directory:
+
+    python -m benchmarks.queue_benchmark --output results.jsonl
+
+Each run appends a record, tagged with the current commit, to the output
+file. --compare prints the change from the previous record in that file.
+"""
+
+import argparse
+import json
+import os
+import re
+
+from cumulus.constants import QueueType
+from cumulus.queue import get_queue_adapter
+from cumulus.queue.abstract import AbstractQueueAdapter
+
+from .utility import add_output_arguments, report, timed
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'cases', 'fixtures', 'queue')
+
+# The fixture and cluster for each scheduler
+schedulers = {
+    QueueType.SGE: ('sge_qstat.txt', {
+        'type': 'trad',
+        'config': {'scheduler': {'type': QueueType.SGE,
+                                 'structuredOutput': False}}
+    }),
+    QueueType.PBS: ('pbs_qstat.txt', {
+        'type': 'trad',
+        'config': {'scheduler': {'type': QueueType.PBS,
+                                 'structuredOutput': False}}
+    }),
+    QueueType.SLURM: ('slurm_squeue.txt', {
+        'type': 'trad',
+        'config': {'scheduler': {'type': QueueType.SLURM,
+                                 'structuredOutput': False}}
+    }),
+    QueueType.NEWT: ('newt_queue.json', {
+        'type': 'newt',
+        'config': {'host': 'cori', 'user': 'cdc'}
+    })
+}
+
+JOB_ID = re.compile(r'^(\s*)(\d+)')
+
+
+class _Response(object):
+    def __init__(self, content):
+        self._content = content
+        self.status_code = 200
+
+    def json(self):
+        return self._content
+
+
+class _Connection(object):
+    """
+    Stands in for the cluster connection, returning the same output for any
+    command.
+    """
+    def __init__(self, output):
+        self._output = output
+        self.session = self
+
+    def execute(self, command):
+        return self._output
+
+    def get(self, url):
+        return _Response(self._output)
+
+
+def _scale(output, jobs):
+    """
+    Repeat the recorded output, with the job ids shifted each time, until it
+    holds at least jobs jobs. Returns the output and the job ids in it.
+    """
+    if isinstance(output, list) and output and isinstance(output[0], dict):
+        entries = [e for e in output if 'jobid' in e]
+        span = max(int(e['jobid']) for e in entries) + 1
+        scaled = []
+        for i in range(-(-jobs // len(entries))):
+            for entry in entries:
+                entry = dict(entry)
+                entry['jobid'] = str(int(entry['jobid']) + i * span)
+                scaled.append(entry)
+
+        return (scaled, [e['jobid'] for e in scaled])
+
+    header = [line for line in output if not JOB_ID.match(line)]
+    lines = [line for line in output if JOB_ID.match(line)]
+    span = max(int(JOB_ID.match(line).group(2)) for line in lines) + 1
+    scaled = list(header)
+    ids = []
+    for i in range(-(-jobs // len(lines))):
+        for line in lines:
+            m = JOB_ID.match(line)
+            job_id = str(int(m.group(2)) + i * span)
+            scaled.append(m.group(1) + job_id + line[m.end():])
+            ids.append(job_id)
+
+    # The tasks of an array job share an id
+    return (scaled, sorted(set(ids), key=ids.index))
+
+
+def _load(name):
+    with open(os.path.join(FIXTURES, name)) as fp:
+        if name.endswith('.json'):
+            return json.load(fp)
+
+        return fp.read().splitlines()
+
+
+def bench_scheduler(scheduler, args):
+    (fixture, cluster) = schedulers[scheduler]
+    (output, job_ids) = _scale(_load(fixture), args.jobs)
+    adapter = get_queue_adapter(cluster, _Connection(output))
+    jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+            for job_id in job_ids]
+
+    return {
+        '%s_jobs' % scheduler: len(jobs),
+        '%s_parse_s' % scheduler: timed(adapter.queue_states, args.repeat),
+        '%s_statuses_s' % scheduler: timed(
+            lambda: adapter.job_statuses(jobs), args.repeat)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark parsing scheduler output')
+    parser.add_argument('--schedulers', nargs='+', default=sorted(schedulers),
+                        choices=sorted(schedulers))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The best of this many runs is reported')
+    parser.add_argument('--jobs', type=int, default=10000,
+                        help='The number of jobs in the queue')
+    add_output_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for scheduler in args.schedulers:
+        results.update(bench_scheduler(scheduler, args))
+
+    report(results, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Benchmarks the SSH transport against the in-process SSH server. Run from the
+tests directory:
+
+    python -m benchmarks.transport_benchmark --output results.jsonl
+
+Each run appends a record, tagged with the current commit, to the output
+file. --compare prints the change from the previous record in that file.
+"""
+
+import argparse
+import io
+import os
+
+import mock
+
+from cumulus.transport import get_connection
+from cumulus.transport.files.download import download_path
+from cumulus.transport.pool import get_ssh_pool
+
+from cases.ssh_server import SshServer
+
+from .utility import add_output_arguments, report, timed
+
+MB = 1024 * 1024
+
+
+def _make_tree(root, depth, fanout, files, size):
+    """
+    Create a synthetic tree fanout directories wide and depth deep, with files
+    in each directory.
+    """
+    data = os.urandom(size)
+    count = 0
+    dirs = [root]
+    for _ in range(depth + 1):
+        next_dirs = []
+        for path in dirs:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            for i in range(files):
+                with open(os.path.join(path, 'file%d' % i), 'wb') as fp:
+                    fp.write(data)
+                count += 1
+            next_dirs += [os.path.join(path, 'dir%d' % i)
+                          for i in range(fanout)]
+        dirs = next_dirs
+
+    return count
+
+
+def bench_connect(server, args):
+    def _connect():
+        # Don't let the pool hide the cost of the handshake
+        get_ssh_pool().clear()
+        with get_connection('token', server.cluster()):
+            pass
+
+    return {
+        'connect_s': timed(_connect, args.repeat)
+    }
+
+
+def bench_commands(server, args):
+    with get_connection('token', server.cluster()) as conn:
+        conn.execute('true')
+
+        def _commands():
+            for _ in range(args.commands):
+                conn.execute('true')
+
+        duration = timed(_commands, args.repeat)
+
+    return {
+        'commands_per_s': args.commands / duration
+    }
+
+
+def bench_transfers(server, args):
+    results = {}
+    small = os.urandom(args.small_size)
+    large = os.urandom(args.large_size * MB)
+
+    with get_connection('token', server.cluster()) as conn:
+        conn.makedirs('bench/small')
+
+        def _put_small():
+            for i in range(args.small_files):
+                conn.put(io.BytesIO(small), 'bench/small/file%d' % i)
+
+        def _get_small():
+            for i in range(args.small_files):
+                with conn.get('bench/small/file%d' % i) as fp:
+                    fp.read()
+
+        def _put_large():
+            conn.put_ranges(lambda offset, length:
+                            large[offset:offset + length],
+                            len(large), 'bench/large')
+
+        def _get_large():
+            with conn.get('bench/large') as fp:
+                while fp.read(MB):
+                    pass
+
+        small_bytes = float(args.small_files * args.small_size)
+        results['small_put_mb_per_s'] \
+            = small_bytes / timed(_put_small, args.repeat) / MB
+        results['small_get_mb_per_s'] \
+            = small_bytes / timed(_get_small, args.repeat) / MB
+        results['large_put_mb_per_s'] \
+            = args.large_size / timed(_put_large, args.repeat)
+        results['large_get_mb_per_s'] \
+            = args.large_size / timed(_get_large, args.repeat)
+
+    return results
+
+
+def bench_import(server, args):
+    count = _make_tree(os.path.join(server.home, 'tree'), args.depth,
+                       args.fanout, args.files, args.file_size)
+    results = {
+        'tree_files': count
+    }
+
+    # Girder is mocked out, so this measures the cost on the cluster side
+    with mock.patch('cumulus.transport.files.download.GirderClient') as gc:
+        girder_client = gc.return_value
+        girder_client.createItem.return_value = {'_id': 'item'}
+        girder_client.createFolder.return_value = {'_id': 'folder'}
+        girder_client.listFolder.side_effect = lambda *a, **k: iter([])
+        girder_client.uploadFile.side_effect \
+            = lambda item, stream, *a, **k: stream.read()
+
+        with get_connection('token', server.cluster()) as conn:
+            def _walk():
+                list(conn.walk('tree'))
+
+            def _import(upload=False, bulk=False):
+                download_path(conn, 'token', 'parent', 'tree',
+                              'sftp_assetstores', 'assetstore',
+                              upload=upload, bulk=bulk)
+
+            results['walk_s'] = timed(_walk, args.repeat)
+            results['import_s'] = timed(_import, args.repeat)
+            results['import_upload_s'] = timed(
+                lambda: _import(upload=True), args.repeat)
+            results['import_bulk_s'] = timed(
+                lambda: _import(upload=True, bulk=True), args.repeat)
+
+    return results
+
+
+benchmarks = {
+    'connect': bench_connect,
+    'commands': bench_commands,
+    'transfers': bench_transfers,
+    'import': bench_import
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the SSH transport against a local server')
+    parser.add_argument('--benchmarks', nargs='+', default=sorted(benchmarks),
+                        choices=sorted(benchmarks))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The best of this many runs is reported')
+    parser.add_argument('--commands', type=int, default=50,
+                        help='The number of commands run')
+    parser.add_argument('--small-files', type=int, default=100)
+    parser.add_argument('--small-size', type=int, default=4096,
+                        help='The size of a small file in bytes')
+    parser.add_argument('--large-size', type=int, default=64,
+                        help='The size of the large file in MiB')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='The depth of the synthetic tree')
+    parser.add_argument('--fanout', type=int, default=4,
+                        help='The number of sub directories per directory')
+    parser.add_argument('--files', type=int, default=5,
+                        help='The number of files per directory')
+    parser.add_argument('--file-size', type=int, default=1024,
+                        help='The size of the files in the tree in bytes')
+    add_output_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with SshServer() as server:
+        try:
+            for name in args.benchmarks:
+                results.update(benchmarks[name](server, args))
+        finally:
+            get_ssh_pool().clear()
+
+    report(results, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def timed(func, repeat=1):
+    """
+    Returns the best time of repeat calls to func.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+
+    return best
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous(path):
+    if not path or not os.path.exists(path):
+        return None
+
+    record = None
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                record = json.loads(line)
+
+    return record
+
+
+def _print_results(results, previous):
+    for name in sorted(results):
+        line = '%-22s %12.4f' % (name, results[name])
+        if previous and name in previous['results'] \
+                and previous['results'][name]:
+            change = (results[name] - previous['results'][name]) \
+                / previous['results'][name] * 100
+            line += '   %+7.1f%% vs %s' % (change, previous['commit'])
+        print(line)
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--output',
+                        help='Append the results to this JSON lines file')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare with the last record in --output')
+
+
+def report(results, args):
+    """
+    Print the results, compared with the previous record if --compare was
+    given, and append a record tagged with the current commit to --output.
+    """
+    previous = _previous(args.output) if args.compare else None
+    _print_results(results, previous)
+
+    if args.output:
+        record = {
+            'commit': _commit(),
+            'date': datetime.datetime.utcnow().isoformat(),
+            'python': sys.version.split()[0],
+            'parameters': {k: v for (k, v) in vars(args).items()
+                           if k not in ['output', 'compare']},
+            'results': results
+        }
+        with open(args.output, 'a') as fp:
+            fp.write(json.dumps(record) + '\n')
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import threading
+import time
+import unittest
+import mock
+
+from cumulus.transport.aio import AsyncConnection, SyncConnection, \
+    get_async_connection, AsyncSshClusterConnection, \
+    AsyncNewtClusterConnection
+
+
+class AsyncTransportTestCase(unittest.TestCase):
+
+    def _connection(self):
+        conn = mock.MagicMock()
+        conn.get.return_value.__enter__.return_value = io.BytesIO(b'data')
+        conn.list.return_value = iter([{'name': 'a'}])
+
+        return conn
+
+    def test_operations(self):
+        conn = self._connection()
+        conn.execute.return_value = ['output']
+
+        async def _run():
+            async with AsyncConnection(conn) as c:
+                self.assertEqual(await c.execute('ls'), ['output'])
+                self.assertEqual(await c.get('/a'), b'data')
+                self.assertEqual(await c.list('/'), [{'name': 'a'}])
+                await c.put(b'data', '/b')
+                self.assertEqual(await c.run(lambda c: c.stat('/c')),
+                                 conn.stat.return_value)
+
+        asyncio.run(_run())
+
+        conn.__enter__.assert_called_once_with()
+        conn.__exit__.assert_called_once_with(None, None, None)
+        conn.execute.assert_called_once_with('ls', ignore_exit_status=False,
+                                             source_profile=True)
+        (stream, path) = conn.put.call_args[0]
+        self.assertEqual(stream.read(), b'data')
+        self.assertEqual(path, '/b')
+
+    def test_concurrent(self):
+        count = 10
+        barrier = threading.Barrier(count, timeout=5)
+
+        def _execute(command, **kwargs):
+            # Only returns if all the connections are executing at once
+            barrier.wait()
+            return [command]
+
+        connections = []
+        for i in range(count):
+            conn = self._connection()
+            conn.execute.side_effect = _execute
+            connections.append(AsyncConnection(conn))
+
+        async def _poll(c, i):
+            async with c:
+                return await c.execute('qstat %d' % i)
+
+        async def _run():
+            return await asyncio.gather(
+                *[_poll(c, i) for (i, c) in enumerate(connections)])
+
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            for c in connections:
+                c._executor = executor
+            results = asyncio.run(_run())
+
+        self.assertEqual(results, [['qstat %d' % i] for i in range(count)])
+
+    def test_operations_serialized(self):
+        conn = self._connection()
+        active = []
+
+        def _execute(command, **kwargs):
+            active.append(command)
+            self.assertEqual(len(active), 1)
+            time.sleep(0.01)
+            active.remove(command)
+            return [command]
+        conn.execute.side_effect = _execute
+
+        async def _run():
+            c = AsyncConnection(conn)
+            return await asyncio.gather(c.execute('a'), c.execute('b'))
+
+        self.assertEqual(asyncio.run(_run()), [['a'], ['b']])
+
+    def test_sync_shim(self):
+        conn = self._connection()
+        conn.execute.return_value = ['output']
+
+        with SyncConnection(AsyncConnection(conn)) as c:
+            self.assertEqual(c.execute('ls'), ['output'])
+
+        conn.__exit__.assert_called_once_with(None, None, None)
+
+    def test_sync_shim_get(self):
+        conn = self._connection()
+        content = b'0123456789' * 10
+
+        def _read_range(remote_path, offset=0, length=None):
+            end = None if length is None else offset + length
+            return content[offset:end]
+        conn.read_range.side_effect = _read_range
+
+        with mock.patch('cumulus.transport.aio.GET_CHUNK_SIZE', 16), \
+                SyncConnection(AsyncConnection(conn)) as c:
+            with c.get('/a') as fp:
+                self.assertEqual(fp.read(5), content[:5])
+                self.assertEqual(fp.read(20), content[5:25])
+            with c.get('/a', offset=90) as fp:
+                self.assertEqual(fp.read(), content[90:])
+
+        # The file is streamed in parts rather than read as a whole
+        conn.get.assert_not_called()
+        self.assertEqual(conn.read_range.call_args_list[0],
+                         mock.call('/a', offset=0, length=16))
+
+        conn.__exit__.assert_called_once_with(None, None, None)
+
+    def test_get_async_connection(self):
+        self.assertIsInstance(get_async_connection('token', {'type': 'trad'}),
+                              AsyncSshClusterConnection)
+        newt_cluster = {'type': 'newt', 'config': {'host': 'cori'}}
+        self.assertIsInstance(get_async_connection('token', newt_cluster),
+                              AsyncNewtClusterConnection)
+        with self.assertRaises(Exception):
+            get_async_connection('token', {'type': 'bogus'})
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import os
+import shutil
+import subprocess
+import tempfile
+
+from cumulus.transport.abstract import AbstractConnection
+from cumulus.transport.batch import BatchOutputError, CommandResult, \
+    check_results, parse_batch_output, write_file_command
+
+
+class LocalConnection(AbstractConnection):
+    """
+    Runs commands using a local bash so the generated scripts are exercised.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def execute(self, command, ignore_exit_status=False, source_profile=True):
+        self.calls += 1
+        output = subprocess.check_output(['bash', '-c', command])
+
+        return output.decode('utf8').splitlines(True)
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._conn = LocalConnection()
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_execute_many(self):
+        results = self._conn.execute_many([
+            'echo hello',
+            'echo world 1>&2; exit 3',
+            'printf "no newline"'
+        ])
+
+        self.assertEqual(self._conn.calls, 1)
+        self.assertEqual(results, [
+            CommandResult('echo hello', 0, ['hello'], []),
+            CommandResult('echo world 1>&2; exit 3', 3, [], ['world']),
+            CommandResult('printf "no newline"', 0, ['no newline'], [])
+        ])
+
+        with self.assertRaises(Exception):
+            check_results(results)
+
+    def test_execute_many_stop_on_error(self):
+        results = self._conn.execute_many(['false', 'echo skipped'],
+                                          stop_on_error=True)
+
+        self.assertEqual(results[0].exit_code, 1)
+        self.assertEqual(results[1], CommandResult('echo skipped', None, [],
+                                                   []))
+
+    def test_write_file(self):
+        path = os.path.join(self._dir, 'my script.sh')
+        content = 'echo "$HOME"\necho \'quoted\'\n'
+        results = self._conn.execute_many([
+            write_file_command(path, content, mode='700'),
+            'cat "%s"' % path
+        ])
+
+        check_results(results)
+        with open(path) as fp:
+            self.assertEqual(fp.read(), content)
+        self.assertTrue(os.access(path, os.X_OK))
+        self.assertEqual(results[1].stdout, ['echo "$HOME"', 'echo \'quoted\''])
+
+    def test_execute_many_empty(self):
+        conn = mock.MagicMock(spec=LocalConnection)
+        self.assertEqual(AbstractConnection.execute_many(conn, []), [])
+        self.assertFalse(conn.execute.called)
+
+    def test_parse_batch_output_error(self):
+        # Output without the markers can't be attributed to the commands
+        with self.assertRaises(BatchOutputError):
+            parse_batch_output(['echo test'], ['garbage'], 'MARKER')
@@ -4,10 +4,13 @@ import mock
 import json
 from jsonpath_rw import parse
 import stat
+import io
+import tarfile
 
 import cumulus
 from cumulus.transport.files.download import download_path
 from cumulus.transport.files.download import _ensure_path
+from cumulus.transport.files.checkpoint import CHECKPOINT_METADATA_KEY
 
 class DownloadTestCase(unittest.TestCase):
 
@@ -19,19 +22,25 @@ class DownloadTestCase(unittest.TestCase):
 
     def test_import_path(self):
         file = {
+                'path': 'test.txt',
                 'name': 'test.txt',
-                'mode': 1,
-                'size': 123
+                'mode': stat.S_IFREG,
+                'size': 123,
+                'mtime': 1458000000.0
         }
 
         folder = {
+                  'path': 'folder',
                   'name':  'folder',
                   'mode': stat.S_IFDIR,
                   'size': 1234
         }
 
+        nested_file = dict(file, path='folder/test.txt')
+
         cluster_connection = mock.MagicMock()
-        cluster_connection.list.side_effect = [[file, folder], [file]]
+        cluster_connection.walk.return_value = iter([file, folder,
+                                                     nested_file])
 
         girder_token = 'dummy'
         parent = {
@@ -112,7 +121,21 @@ class DownloadTestCase(unittest.TestCase):
         list_folder = httmock.urlmatch(
             path=r'^%s$' % folder_url, method='GET')(_list_folder)
 
-        with httmock.HTTMock(create_item, create_file, create_folder, list_folder):
+        # Mock get folder, the parent has no checkpoint
+        def _get_folder(url, request):
+            content = json.dumps({'_id': 'dummy_id'}).encode('utf8')
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        get_folder = httmock.urlmatch(
+            path=r'^%s/.+$' % folder_url, method='GET')(_get_folder)
+
+        with httmock.HTTMock(create_item, create_file, create_folder, list_folder,
+                             get_folder):
             download_path(cluster_connection, girder_token, parent, path,
                 'sftp_assetstores', assetstore_id, upload=False)
 
@@ -120,6 +143,132 @@ class DownloadTestCase(unittest.TestCase):
         self.assertEqual(len(self._item_requests), 2)
         self.assertEqual(len(self._file_requests), 2)
         self.assertEqual(len(self._folder_requests), 1)
+        cluster_connection.walk.assert_called_once_with(path)
+
+    @mock.patch('cumulus.transport.files.download.GirderClient')
+    def test_import_path_bulk(self, girder_client):
+        girder_client = girder_client.return_value
+        girder_client.createItem.return_value = {'_id': 'item_id'}
+        girder_client.createFolder.return_value = {'_id': 'folder_id'}
+        girder_client.listFolder.return_value = iter([])
+        uploaded = {}
+
+        def _upload_file(item_id, stream, name, size, parentType):
+            uploaded[name] = stream.read()
+        girder_client.uploadFile.side_effect = _upload_file
+
+        tar_stream = io.BytesIO()
+        with tarfile.open(mode='w', fileobj=tar_stream) as tar:
+            for (name, data) in [('a.txt', b'a'), ('sub/b.txt', b'bb')]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        tar_stream.seek(0)
+
+        cluster_connection = mock.MagicMock()
+        cluster_connection.walk.return_value = iter([
+            {'path': 'a.txt', 'mode': stat.S_IFREG},
+            {'path': 'sub', 'mode': stat.S_IFDIR},
+            {'path': 'sub/b.txt', 'mode': stat.S_IFREG},
+            {'path': 'c.log', 'mode': stat.S_IFREG},
+            # Left by an upload that failed, never imported
+            {'path': '.cumulus_checkpoint.json', 'mode': stat.S_IFREG}])
+        cmd = cluster_connection.open_command.return_value.__enter__.return_value
+        cmd.stdout = tar_stream
+
+        download_path(cluster_connection, 'dummy', 'parent_id', '/my/path',
+                      'sftp_assetstores', 'dummy_id', upload=True,
+                      exclude=[r'.*\.log'], bulk=True)
+
+        # Only the filtered files should be requested
+        written = b''.join(c[0][0] for c in cmd.stdin.write.call_args_list)
+        self.assertEqual(written, b'a.txt\0sub/b.txt\0')
+        self.assertEqual(cluster_connection.open_command.call_args[0][0],
+                         'tar -cf - -C /my/path --null -T -')
+        self.assertEqual(uploaded, {'a.txt': b'a', 'b.txt': b'bb'})
+        girder_client.createFolder.assert_called_once_with(
+            'parent_id', 'sub', parentType='folder')
+        cmd.wait.assert_called_once_with()
+
+    @mock.patch('cumulus.transport.files.download.transfer_config')
+    @mock.patch('cumulus.transport.files.download.GirderClient')
+    def test_import_path_resume(self, girder_client, transfer_config):
+        transfer_config.return_value = (8, 4, 32)
+        girder_client = girder_client.return_value
+        girder_client.getFolder.return_value = {
+            '_id': 'parent_id',
+            'meta': {
+                CHECKPOINT_METADATA_KEY: {
+                    'source': '/my/path',
+                    'files': [{
+                        'path': 'a.txt',
+                        'size': 1,
+                        'mtime': 1.0,
+                        'done': True
+                    }, {
+                        'path': 'big.dat',
+                        'size': 20,
+                        'mtime': 2.0,
+                        'itemId': 'big_item_id',
+                        'uploadId': 'upload_id'
+                    }]
+                }
+            }
+        }
+        girder_client.createItem.side_effect = \
+            lambda folder_id, name, description, reuseExisting: \
+            {'_id': '%s_id' % name}
+        girder_client.get.return_value = {'offset': 8}
+        # The previous attempt imported imported.txt after the checkpoint
+        # was last saved.
+        girder_client.listFile.side_effect = \
+            lambda item_id: [{'name': 'imported.txt', 'size': 4}] \
+            if item_id == 'imported.txt_id' else []
+        data = b'0123456789abcdefghij'
+
+        cluster_connection = mock.MagicMock()
+        cluster_connection.walk.return_value = iter([
+            {'path': 'a.txt', 'mode': stat.S_IFREG, 'size': 1, 'mtime': 1.0},
+            {'path': 'big.dat', 'mode': stat.S_IFREG, 'size': 20,
+             'mtime': 2.0},
+            {'path': 'imported.txt', 'mode': stat.S_IFREG, 'size': 4,
+             'mtime': 4.0},
+            {'path': 'new.txt', 'mode': stat.S_IFREG, 'size': 3,
+             'mtime': 3.0}])
+
+        def _get(path, offset=0):
+            stream = mock.MagicMock()
+            stream.__enter__.return_value = io.BytesIO(data[offset:])
+
+            return stream
+        cluster_connection.get.side_effect = _get
+
+        download_path(cluster_connection, 'dummy', 'parent_id', '/my/path',
+                      'sftp_assetstores', 'dummy_id', upload=True)
+
+        # The upload is continued from where Girder says it got to
+        girder_client.get.assert_called_once_with(
+            'file/offset', parameters={'uploadId': 'upload_id'})
+        self.assertEqual(girder_client.post.call_args_list, [
+            mock.call('file/chunk', parameters={'uploadId': 'upload_id',
+                                                'offset': 8},
+                      data=data[8:16]),
+            mock.call('file/chunk', parameters={'uploadId': 'upload_id',
+                                                'offset': 16},
+                      data=data[16:])
+        ])
+        # The items of files that weren't recorded are reused if they exist,
+        # only the file that wasn't started is uploaded.
+        self.assertEqual(girder_client.createItem.call_args_list, [
+            mock.call('parent_id', 'imported.txt', '', reuseExisting=True),
+            mock.call('parent_id', 'new.txt', '', reuseExisting=True)
+        ])
+        self.assertEqual(girder_client.uploadFile.call_count, 1)
+        self.assertEqual(girder_client.uploadFile.call_args[0][0],
+                         'new.txt_id')
+        # Once done the checkpoint is removed
+        girder_client.addMetadataToFolder.assert_called_once_with(
+            'parent_id', {CHECKPOINT_METADATA_KEY: None})
 
     def test_ensure_path(self):
         girder_client = mock.MagicMock()
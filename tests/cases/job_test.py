@@ -20,6 +20,7 @@
 import unittest
 import mock
 import httmock
+import requests
 import cumulus
 import json
 from celery.app import task
@@ -27,7 +28,9 @@ import sys
 import six
 
 from cumulus.tasks import job
+from cumulus.queue.abstract import QueueQueryError
 from cumulus.testing import AssertCallsMixin
+from cumulus.transport.batch import CommandResult
 
 class MockContext(task.Context):
 
@@ -47,6 +50,22 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         self._get_status_called  = False
         self._set_status_called  = False
         self._upload_job_output = cumulus.tasks.job.upload_job_output.delay = mock.Mock()
+        # These tests cover the scheduler output, so query it directly rather
+        # than going through the shared queue snapshot ...
+        patcher = mock.patch('cumulus.queue.snapshot.snapshot_enabled',
+                             return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # and use the table output
+        patcher = mock.patch('cumulus.queue.abstract.structured_output_enabled',
+                             return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # and ask the scheduler for its metadata
+        patcher = mock.patch('cumulus.queue.metadata.metadata_cache_enabled',
+                             return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @mock.patch('cumulus.tasks.job.get_connection')
     def test_monitor_job_terminated(self, get_connection):
@@ -235,6 +254,83 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         self.assertTrue(self._get_status_called, 'Expect get status endpoint to be hit')
         self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
 
+    @mock.patch('cumulus.tasks.job.get_queue_adapter')
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_job_transient_error(self, retry, get_connection,
+                                         get_queue_adapter):
+        cluster = {
+            '_id': 'jill',
+            'type': 'newt',
+            'name': 'dummy',
+            'config': {
+                'host': 'cori'
+            }
+        }
+        job_model = {
+            '_id': 'dummy',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'output': []
+        }
+
+        response = requests.Response()
+        response.status_code = 502
+        adapter = get_queue_adapter.return_value
+        adapter.job_statuses.side_effect \
+            = requests.exceptions.HTTPError(response=response)
+        cluster_patched = []
+
+        def _patch_cluster(url, request):
+            cluster_patched.append(request)
+
+            return httmock.response(200, None, {}, request=request)
+
+        patch_cluster = httmock.urlmatch(
+            path=r'^/api/v1/clusters/jill$', method='PATCH')(_patch_cluster)
+
+        with httmock.HTTMock(patch_cluster):
+            job.monitor_job(cluster, job_model, girder_token='s',
+                            log_write_url=1)
+
+        # The monitor should try again rather than error the cluster
+        self.assertTrue(retry.called)
+        self.assertEqual(cluster_patched, [])
+
+        # Other failures still put the cluster into error
+        response.status_code = 400
+        with httmock.HTTMock(patch_cluster):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                job.monitor_job(cluster, job_model, girder_token='s',
+                                log_write_url=1)
+
+        self.assertEqual(len(cluster_patched), 1)
+
+    @mock.patch('cumulus.tasks.job.get_queue_adapter')
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_job_queue_query_error(self, retry, get_connection,
+                                           get_queue_adapter):
+        cluster = {
+            '_id': 'jill',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {}
+        }
+        job_model = {
+            '_id': 'dummy',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'output': []
+        }
+        adapter = get_queue_adapter.return_value
+        adapter.job_statuses.side_effect = QueueQueryError('qstat failed')
+
+        # The scheduler couldn't be queried, so the job is monitored again
+        # rather than being treated as complete.
+        job.monitor_job(cluster, job_model, girder_token='s', log_write_url=1)
+        retry.assert_called_once_with(countdown=job.MONITOR_INTERVAL)
+
 
     @mock.patch('cumulus.celery.monitor.Task.retry')
     @mock.patch('cumulus.tasks.job.get_connection')
@@ -321,9 +417,12 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         }
 
         conn = get_connection.return_value.__enter__.return_value
-        conn.execute.side_effect = [ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
+        conn.execute.side_effect = [[ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
                              '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     r     09/09/2009 14:58:14                1'], ['i have a tail', 'asdfas']
+                             '1 0.00000 hostname   sgeadmin     r     09/09/2009 14:58:14                1']]
+        conn.execute_stream.return_value = iter([
+            ('stdout', 'i have a tail'), ('stderr', 'ignored'),
+            ('stdout', 'asdfas')])
 
         def _get_status(url, request):
             content = {
@@ -402,7 +501,13 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         qsub_output = ['Your job 74 ("test.sh") has been submitted']
 
         conn = get_connection.return_value.__enter__.return_value
-        conn.execute.side_effect = [['/home/test'], qconf_output, qsub_output]
+        conn.execute.side_effect = [['/home/test'], qconf_output]
+        submit_results = [
+            CommandResult('mkdir', 0, [], []),
+            CommandResult('cat', 0, [], []),
+            CommandResult('qsub', 0, qsub_output, [])
+        ]
+        conn.execute_many.return_value = submit_results
 
         def _get_status(url, request):
             content = {
@@ -460,6 +565,15 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
                          mock.call('qconf -sp orte'), 'Unexpected qconf command: %s' %
                          str(conn.execute.call_args_list[0]))
 
+        # The script should be staged and submitted in a single batch
+        self.assertEqual(conn.execute_many.call_count, 1)
+        commands = conn.execute_many.call_args[0][0]
+        self.assertEqual(len(commands), 3)
+        self.assertEqual(commands[0], 'mkdir -p /home/test/dummy')
+        self.assertTrue(commands[1].startswith(
+            "cat > /home/test/dummy/dummy <<'CUMULUS_EOF_"))
+        self.assertEqual(commands[2], 'cd /home/test/dummy && qsub -cwd ./dummy')
+
         # Specifying and parallel environment
         job_model = {
             '_id': job_id,
@@ -485,7 +599,8 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
                         'accounting_summary FALSE']
 
         conn.reset_mock()
-        conn.execute.side_effect = [['/home/test'], qconf_output, qsub_output]
+        conn.execute.side_effect = [['/home/test'], qconf_output]
+        conn.execute_many.return_value = submit_results
 
         with httmock.HTTMock(get_status, set_status, log):
             job.submit_job(cluster, job_model, log_write_url='log_write_url',
@@ -520,7 +635,8 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         }
 
         conn.reset_mock()
-        conn.execute.side_effect = [['/home/test'], ['Your job 74 ("test.sh") has been submitted']]
+        conn.execute.side_effect = [['/home/test']]
+        conn.execute_many.return_value = submit_results
 
         with httmock.HTTMock(get_status, set_status, log):
             job.submit_job(cluster, job_model, log_write_url='log_write_url',
@@ -558,7 +674,8 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         }
 
         conn.reset_mock()
-        conn.execute.side_effect = [['/home/test'], qconf_output, ['Your job 74 ("test.sh") has been submitted']]
+        conn.execute.side_effect = [['/home/test'], qconf_output]
+        conn.execute_many.return_value = submit_results
 
         with httmock.HTTMock(get_status, set_status, log):
             job.submit_job(cluster, job_model, log_write_url='log_write_url',
@@ -567,6 +684,128 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         self.assertEqual(conn.execute.call_args_list[1], mock.call('qconf -sp mype'))
         self.assertEqual(job_model['params']['numberOfSlots'], 10)
 
+    @mock.patch('cumulus.tasks.job.monitor_jobs')
+    @mock.patch('cumulus.tasks.job.get_connection', autospec=True)
+    def test_submit_jobs(self, get_connection, monitor_jobs):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'scheduler': {
+                    'type': 'slurm'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'job%d' % i,
+            'name': 'dummy',
+            'commands': ['echo {{ job._id }}'],
+            'output': []
+        } for i in range(3)]
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute.return_value = ['/home/test']
+        conn.execute_many.return_value = [
+            CommandResult('mkdir', 0, [], []),
+            CommandResult('cat', 0, [], []),
+            CommandResult('sbatch', 0, ['Submitted batch job 74'], [])
+        ]
+
+        patches = {}
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/[^/]+/status$', method='GET')
+        def get_status(url, request):
+            return httmock.response(200, {'status': 'created'}, {},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/([^/]+)$', method='PATCH')
+        def set_status(url, request):
+            job_id = url.path.split('/')[-1]
+            body = json.loads(request.body.decode('utf8'))
+            patches[job_id] = body
+            content = dict(body, _id=job_id)
+
+            return httmock.response(200, content, {}, request=request)
+
+        with httmock.HTTMock(get_status, set_status):
+            job.submit_jobs(cluster, jobs, log_write_url='log_write_url',
+                            girder_token='girder_token')
+
+        # The home directory is only fetched once
+        conn.execute.assert_called_once_with('pwd')
+
+        # One script is staged and submitted for all the jobs
+        self.assertEqual(conn.execute_many.call_count, 1)
+        commands = conn.execute_many.call_args[0][0]
+        self.assertEqual(len(commands), 3)
+        self.assertEqual(commands[0], 'mkdir -p /home/test/job0 '
+                                      '/home/test/job1 /home/test/job2')
+        self.assertTrue(commands[1].startswith(
+            "cat > /home/test/job0/dummy <<'CUMULUS_EOF_"))
+        self.assertIn('#SBATCH --array=0-2', commands[1])
+        self.assertIn('cd /home/test/job2\n', commands[1])
+        self.assertIn('echo job2\n', commands[1])
+        self.assertEqual(commands[2], 'cd /home/test/job0 && sbatch ./dummy')
+
+        # Each job tracks its own element
+        self.assertEqual(patches, {
+            'job%d' % i: {
+                'status': 'queued',
+                'queueJobId': '74_%d' % i,
+                'dir': '/home/test/job%d' % i
+            } for i in range(3)
+        })
+
+        # and they are monitored together
+        [queued] = monitor_jobs.s.call_args[0][1:]
+        self.assertEqual([j['queueJobId'] for j in queued],
+                         ['74_0', '74_1', '74_2'])
+
+    @mock.patch('cumulus.tasks.job.get_connection', autospec=True)
+    def test_terminate_jobs(self, get_connection):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'job%d' % i,
+            'name': 'dummy',
+            'queueJobId': str(100 + i)
+        } for i in range(3)]
+        # Not yet in the queue
+        jobs.append({
+            '_id': 'job3',
+            'name': 'dummy'
+        })
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute_many.return_value = [CommandResult('qdel', 0, [], [])]
+
+        patches = {}
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/([^/]+)$', method='PATCH')
+        def set_status(url, request):
+            patches[url.path.split('/')[-1]] = json.loads(
+                request.body.decode('utf8'))
+
+            return httmock.response(200, {}, {}, request=request)
+
+        with httmock.HTTMock(set_status):
+            job.terminate_jobs(cluster, jobs, girder_token='girder_token')
+
+        # One connection and one scheduler invocation for all the jobs
+        self.assertEqual(get_connection.call_count, 1)
+        conn.execute_many.assert_called_once_with(['qdel 100 101 102'])
+        conn.execute.assert_not_called()
+        self.assertEqual(patches, {'job3': {'status': 'terminated'}})
+
     @mock.patch('cumulus.tasks.job.get_connection')
     @mock.patch('cumulus.celery.monitor.Task.retry')
     def test_monitor_jobs_queued_retry(self, retry, get_connection):
@@ -745,3 +984,184 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
 
 
 
+
+    @mock.patch('cumulus.tasks.job.monitor_job')
+    @mock.patch('cumulus.tasks.job.get_connection', autospec=True)
+    def test_submit_job_completion_callback(self, get_connection, monitor_job):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'scheduler': {
+                    'type': 'slurm',
+                    'completionCallback': True
+                }
+            }
+        }
+        job_model = {
+            '_id': 'job0',
+            'name': 'dummy',
+            'commands': ['ls'],
+            'output': []
+        }
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute.return_value = ['/home/test']
+        conn.execute_many.return_value = [
+            CommandResult('mkdir', 0, [], []),
+            CommandResult('cat', 0, [], []),
+            CommandResult('sbatch', 0, ['Submitted batch job 74'], [])
+        ]
+
+        patches = []
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/job0/status$', method='GET')
+        def get_status(url, request):
+            return httmock.response(200, {'status': 'created'}, {},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/job0$', method='PATCH')
+        def set_status(url, request):
+            body = json.loads(request.body.decode('utf8'))
+            patches.append(body)
+
+            return httmock.response(200, dict(body, _id='job0'), {},
+                                    request=request)
+
+        with httmock.HTTMock(get_status, set_status):
+            job.submit_job(cluster, job_model, log_write_url='log_write_url',
+                           girder_token='girder_token')
+
+        # The secret is saved before the job is submitted
+        secret = patches[0]['callbackSecret']
+        self.assertEqual(len(secret), 32)
+
+        script = conn.execute_many.call_args[0][0][1]
+        self.assertIn('trap cumulus_report_completion EXIT\n', script)
+        self.assertIn('CUMULUS_JOB_ID=job0\n', script)
+        self.assertIn('CUMULUS_CALLBACK_SECRET=%s\n' % secret, script)
+        self.assertIn('"http://localhost:8080/api/v1/jobs/$CUMULUS_JOB_ID/'
+                      'complete"', script)
+        # The directives still come first
+        self.assertLess(script.index('#SBATCH'), script.index('trap'))
+
+        # Polling carries on, but less often
+        self.assertEqual(monitor_job.s.call_args[1]['monitor_interval'],
+                         job.CALLBACK_POLL_INTERVAL)
+
+    def _job_complete(self, claim_status_code, exit_code=0):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': 'dummy',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'output': [{
+                'itemId': 'dummy'
+            }],
+            'dir': '/home/test/dummy',
+            'completion': {
+                'exitCode': exit_code,
+                'startTime': 100,
+                'endTime': 105
+            }
+        }
+
+        patches = []
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/dummy/status$', method='GET')
+        def get_status(url, request):
+            return httmock.response(200, {'status': 'running'}, {},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/dummy$', method='PATCH')
+        def set_status(url, request):
+            body = json.loads(request.body.decode('utf8'))
+            patches.append(body)
+            status_code = 200
+            if 'previousStatus' in body:
+                status_code = claim_status_code
+
+            return httmock.response(status_code, {}, {}, request=request)
+
+        with httmock.HTTMock(get_status, set_status):
+            job.job_complete(cluster, job_model, girder_token='s',
+                             log_write_url=1)
+
+        return patches
+
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    @mock.patch('cumulus.tasks.job.get_connection')
+    def test_job_complete(self, get_connection, retry):
+        conn = get_connection.return_value.__enter__.return_value
+
+        patches = self._job_complete(200)
+
+        # The scheduler isn't queried and the job isn't monitored again
+        conn.execute.assert_not_called()
+        conn.execute_many.assert_not_called()
+        retry.assert_not_called()
+
+        self.assertEqual(patches, [
+            {'status': 'uploading', 'previousStatus': 'running'},
+            {
+                'status': 'uploading',
+                'timings': {'running': 5000},
+                'output': [{'itemId': 'dummy'}]
+            }
+        ])
+        self.assertEqual(self._upload_job_output.call_count, 1)
+
+    @mock.patch('cumulus.tasks.job.get_connection')
+    def test_job_complete_already_claimed(self, get_connection):
+        # The monitor has already moved the job on, so its output isn't
+        # uploaded twice.
+        patches = self._job_complete(409)
+
+        self.assertEqual(patches, [
+            {'status': 'uploading', 'previousStatus': 'running'}
+        ])
+        self._upload_job_output.assert_not_called()
+
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    @mock.patch('cumulus.tasks.job.get_connection')
+    def test_job_complete_exit_code(self, get_connection, retry):
+        # A job that exits with an error isn't treated as a success
+        patches = self._job_complete(200, exit_code=1)
+
+        self.assertEqual(patches, [{
+            'status': 'error',
+            'timings': {'running': 5000},
+            'output': [{'itemId': 'dummy'}]
+        }])
+        self._upload_job_output.assert_not_called()
+        retry.assert_not_called()
+
+    def test_stage_girder_client(self):
+        conn = mock.MagicMock()
+        commands = job._stage_girder_client({'type': 'trad'}, conn,
+                                            'girderclient.py')
+
+        # The client is written by the batch
+        self.assertEqual(len(commands), 1)
+        self.assertIn('girderclient.py', commands[0])
+        conn.put.assert_not_called()
+
+    def test_stage_girder_client_newt(self):
+        conn = mock.MagicMock()
+        commands = job._stage_girder_client({'type': 'newt'}, conn,
+                                            'girderclient.py')
+
+        # NEWT uploads the client rather than sending it in the batch
+        self.assertEqual(commands, [])
+        self.assertEqual(conn.put.call_count, 1)
+        self.assertEqual(conn.put.call_args[0][1], 'girderclient.py')
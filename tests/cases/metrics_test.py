@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import httmock
+import io
+import json
+import threading
+
+from cumulus.transport import metrics
+from cumulus.transport.metrics import MemorySink, GirderSink, timed, \
+    instrumented, CountingStream, bucket
+
+
+class Connection(object):
+    def __init__(self):
+        self._cluster = {'_id': 'cluster'}
+        self._girder_token = 'token'
+
+    @instrumented('stat')
+    def stat(self, fail=False):
+        if fail:
+            raise IOError('No such file')
+
+        return 'stat'
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._sink = MemorySink()
+        metrics.set_sink(self._sink)
+
+    def tearDown(self):
+        metrics.set_sink(None)
+
+    def test_bucket(self):
+        self.assertEqual(bucket(0.001), '10')
+        self.assertEqual(bucket(0.2), '250')
+        self.assertEqual(bucket(1000), 'inf')
+
+    @mock.patch('cumulus.transport.metrics.time.time')
+    def test_timed(self, time):
+        time.side_effect = [0, 0.25, 1, 3, 5, 5.005]
+        conn = Connection()
+
+        with timed(conn, 'get') as measurement:
+            stream = CountingStream(io.BytesIO(b'0123456789'), measurement)
+            stream.read(4)
+            stream.read()
+
+        self.assertEqual(conn.stat(), 'stat')
+        with self.assertRaises(IOError):
+            conn.stat(fail=True)
+
+        self.assertEqual(self._sink.snapshot(), {
+            'cluster': {
+                'get': {
+                    'count': 1,
+                    'errors': 0,
+                    'totalTime': 0.25,
+                    'bytes': 10,
+                    'histogram': {'250': 1}
+                },
+                'stat': {
+                    'count': 2,
+                    'errors': 1,
+                    'totalTime': 2.005,
+                    'bytes': 0,
+                    'histogram': {'2500': 1, '10': 1}
+                }
+            }
+        })
+
+    def test_sink_errors_ignored(self):
+        sink = mock.MagicMock()
+        sink.record.side_effect = Exception('Broken sink')
+        metrics.set_sink(sink)
+
+        self.assertEqual(Connection().stat(), 'stat')
+
+    def _metrics_endpoint(self, requests, pushed=None):
+        @httmock.urlmatch(path=r'^/api/v1/clusters/cluster/metrics$',
+                          method='POST')
+        def _metrics(url, request):
+            requests.append((request.headers['Girder-Token'],
+                             json.loads(request.body.decode('utf8'))))
+            if pushed is not None:
+                pushed.set()
+
+            return httmock.response(200, None, {}, request=request)
+
+        return _metrics
+
+    @mock.patch('cumulus.transport.metrics.atexit.register')
+    def test_girder_sink(self, register):
+        sink = GirderSink(flush_interval=3600)
+        self.addCleanup(sink.stop)
+        requests = []
+
+        with httmock.HTTMock(self._metrics_endpoint(requests)):
+            sink.record('cluster', 'execute', 0.3, nbytes=10,
+                        girder_token='token')
+            # Nothing is pushed as part of the operation being recorded
+            self.assertEqual(requests, [])
+            sink.flush()
+
+        # What is left is pushed when the process exits
+        register.assert_called_once_with(sink.flush)
+        self.assertEqual(requests, [('token', {
+            'execute': {
+                'count': 1,
+                'errors': 0,
+                'totalTime': 0.3,
+                'bytes': 10,
+                'histogram': {'500': 1}
+            }
+        })])
+        # The stats pushed are reset
+        self.assertEqual(sink.snapshot(), {})
+
+    @mock.patch('cumulus.transport.metrics.atexit.register')
+    def test_girder_sink_background(self, register):
+        sink = GirderSink(flush_interval=0.01)
+        requests = []
+        pushed = threading.Event()
+
+        with httmock.HTTMock(self._metrics_endpoint(requests, pushed)):
+            sink.record('cluster', 'execute', 0.3, girder_token='token')
+            self.assertTrue(pushed.wait(5))
+            sink.stop()
+
+        self.assertEqual(requests[0][1]['execute']['count'], 1)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import json
+import mock
+import os
+
+from cumulus.queue import get_queue_adapter
+from cumulus.queue.abstract import AbstractQueueAdapter
+
+
+class NewtQueueAdapterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._cluster_connection = mock.MagicMock()
+        self._session = self._cluster_connection.session
+        self._adapter = get_queue_adapter({
+            'config': {
+                'host': 'cori',
+                'user': 'cdc'
+            },
+            'type': 'newt'
+        }, self._cluster_connection)
+
+    def test_job_statuses_recorded(self):
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'queue',
+                            'newt_queue.json')
+
+        with open(path, 'r') as fp:
+            self._session.get.return_value.json.return_value = json.load(fp)
+
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['880101', '880104', '880126', '882119', '1']]
+        status = self._adapter.job_statuses(jobs)
+        self.assertEqual([state for (_, state) in status],
+                         ['queued', 'complete', 'error', 'running', None])
+        self._session.get.assert_called_once_with(
+            'https://newt.nersc.gov/newt/queue/cori?user=cdc')
+        self.assertEqual(len(self._adapter.queue_states()), 1000)
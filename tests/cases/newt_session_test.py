@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import httmock
+import io
+import json
+import stat
+from six.moves.urllib.parse import parse_qs
+import requests
+from requests.exceptions import HTTPError
+
+from cumulus.transport.newt import NewtClusterConnection, clear_caches, \
+    get_http_session, is_transient_error, NEWT_BASE_URL
+
+
+class NewtSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self._cluster = {
+            '_id': 'cluster',
+            'type': 'newt',
+            'config': {
+                'host': 'cori'
+            }
+        }
+        self._session_requests = 0
+        self._commands = []
+        self._cookies = []
+        self._status = 200
+
+    def tearDown(self):
+        clear_caches()
+
+    def _mocks(self):
+        @httmock.urlmatch(path=r'^/api/v1/newt/sessionId$', method='GET')
+        def _session_id(url, request):
+            self._session_requests += 1
+            content = {
+                'sessionId': 'session%d' % self._session_requests
+            }
+
+            return httmock.response(200, content, {}, request=request)
+
+        @httmock.urlmatch(netloc=r'^newt.nersc.gov$',
+                          path=r'^/newt/command/cori$', method='POST')
+        def _command(url, request):
+            self._cookies.append(request.headers['Cookie'])
+            command = parse_qs(request.body)['executable'][0]
+            self._commands.append(command)
+            content = {
+                'output': '/home/bob',
+                'error': ''
+            }
+
+            return httmock.response(self._status, content, {},
+                                    request=request)
+
+        @httmock.urlmatch(netloc=r'^newt.nersc.gov$',
+                          path=r'^/newt/file/cori/+home/bob/dir$')
+        def _list(url, request):
+            return httmock.response(200, json.dumps([]).encode('utf8'), {},
+                                    request=request)
+
+        return (_session_id, _command, _list)
+
+    def test_session_cached(self):
+        with httmock.HTTMock(*self._mocks()):
+            for _ in range(3):
+                with NewtClusterConnection('token', self._cluster) as conn:
+                    self.assertEqual(list(conn.list('dir/')), [])
+                    self.assertEqual(list(conn.list('dir/')), [])
+
+            # Another user has their own session
+            with NewtClusterConnection('other', self._cluster) as conn:
+                self.assertEqual(conn.session_id, 'session2')
+
+        # The session id and the home directory are only fetched once
+        self.assertEqual(self._session_requests, 2)
+        self.assertEqual(self._commands, ['/bin/pwd '])
+        self.assertEqual(self._cookies, ['newt_sessionid=session1'])
+
+    def test_session_invalidated(self):
+        with httmock.HTTMock(*self._mocks()):
+            with NewtClusterConnection('token', self._cluster) as conn:
+                conn.execute('pwd')
+
+                self._status = 401
+                with self.assertRaises(HTTPError):
+                    conn.execute('pwd')
+
+            # The rejected session should not be reused
+            self._status = 200
+            with NewtClusterConnection('token', self._cluster) as conn:
+                self.assertEqual(conn.session_id, 'session2')
+                conn.put(io.BytesIO(b'data'), '/home/bob/dir/file')
+
+    def test_read_range(self):
+        data = b'0123456789'
+        ranges = []
+        honour_range = [True]
+
+        def _response(status_code, content):
+            response = requests.Response()
+            response.status_code = status_code
+            response.raw = io.BytesIO(content)
+
+            return response
+
+        @httmock.urlmatch(netloc=r'^newt.nersc.gov$',
+                          path=r'^/newt/file/cori/+home/bob/file$')
+        def _read(url, request):
+            byte_range = request.headers.get('Range')
+            ranges.append(byte_range)
+            if not honour_range[0] or byte_range is None:
+                return _response(200, data)
+
+            (start, end) = byte_range[len('bytes='):].split('-')
+            if not start:
+                content = data[-int(end):]
+            else:
+                content = data[int(start):int(end) + 1 if end else None]
+
+            return _response(206, content)
+
+        def _stat(url, request):
+            content = {
+                'output': 'st_mode=81a4,st_ino=1,st_dev=1,st_nlink=1,'
+                          'st_uid=1,st_gid=1,st_size=10,st_atime=0,'
+                          'st_mtime=0',
+                'error': ''
+            }
+            return httmock.response(200, content, {}, request=request)
+
+        (session_id, _, _) = self._mocks()
+        stat = httmock.urlmatch(netloc=r'^newt.nersc.gov$',
+                                path=r'^/newt/command/cori$')(_stat)
+
+        with httmock.HTTMock(session_id, _read, stat):
+            with NewtClusterConnection('token', self._cluster) as conn:
+                path = '/home/bob/file'
+                self.assertEqual(conn.read_range(path, 2, 3), b'234')
+                self.assertEqual(conn.tail(path, 4), b'6789')
+                self.assertEqual(ranges, ['bytes=2-4', 'bytes=-4'])
+
+                # If NEWT ignores the range we skip to it
+                honour_range[0] = False
+                self.assertEqual(conn.read_range(path, 2, 3), b'234')
+                self.assertEqual(conn.tail(path, 4), b'6789')
+                with conn.get(path, offset=7) as fp:
+                    self.assertEqual(fp.read(), b'789')
+
+    def test_http_session(self):
+        session = get_http_session()
+        adapter = session.get_adapter(NEWT_BASE_URL)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertIn(502, adapter.max_retries.status_forcelist)
+        # Only idempotent requests are retried
+        self.assertFalse(adapter.max_retries.is_retry('POST', 502))
+        self.assertTrue(adapter.max_retries.is_retry('GET', 502))
+        self.assertIs(get_http_session(), session)
+
+    def test_is_transient_error(self):
+        response = requests.Response()
+        response.status_code = 503
+        self.assertTrue(is_transient_error(HTTPError(response=response)))
+        self.assertTrue(is_transient_error(
+            requests.exceptions.ConnectTimeout()))
+        response.status_code = 404
+        self.assertFalse(is_transient_error(HTTPError(response=response)))
+        self.assertFalse(is_transient_error(ValueError()))
+
+    def test_walk(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.mkdir(os.path.join(root, 'sub'))
+        with open(os.path.join(root, 'a file'), 'w') as fp:
+            fp.write('0123456789')
+        open(os.path.join(root, 'sub', 'new\nline'), 'w').close()
+
+        @httmock.urlmatch(netloc=r'^newt.nersc.gov$',
+                          path=r'^/newt/command/cori$', method='POST')
+        def _command(url, request):
+            # Run the script locally, as NEWT would on the cluster
+            command = parse_qs(request.body)['executable'][0]
+            self._commands.append(command)
+            output = subprocess.check_output(command, shell=True, cwd=root)
+
+            return httmock.response(200, {'output': output.decode('utf8'),
+                                          'error': ''}, {}, request=request)
+
+        (session_id, _, _) = self._mocks()
+        with httmock.HTTMock(session_id, _command):
+            with NewtClusterConnection('token', self._cluster) as conn:
+                entries = sorted(conn.walk('.'), key=lambda e: e['path'])
+                self.assertEqual([e['path'] for e in entries],
+                                 ['a file', 'sub', 'sub/new\nline'])
+                self.assertEqual(entries[0]['size'], 10)
+                self.assertTrue(stat.S_ISDIR(entries[1]['mode']))
+                self.assertAlmostEqual(
+                    entries[0]['mtime'],
+                    os.stat(os.path.join(root, 'a file')).st_mtime, places=3)
+
+                entries = list(conn.walk('.', max_depth=1))
+                self.assertEqual(len(entries), 2)
+
+        # The whole subtree is described by a single command
+        self.assertEqual(len(self._commands), 2)
+        self.assertTrue(self._commands[0].startswith('/bin/bash -c '))
+        self.assertIn('-maxdepth 1', self._commands[1])
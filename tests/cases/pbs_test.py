@@ -1,11 +1,13 @@
 import unittest
+import json
 import mock
 import os
 
 from cumulus.queue import get_queue_adapter
-from cumulus.queue.abstract import AbstractQueueAdapter
+from cumulus.queue.abstract import AbstractQueueAdapter, QueueQueryError
 from cumulus.constants import QueueType
 from cumulus.tasks import job
+from cumulus.transport.batch import CommandResult
 
 class PbsQueueAdapterTestCase(unittest.TestCase):
 
@@ -19,6 +21,9 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
             },
             'type': 'trad'
         }, self._cluster_connection)
+        # Use the table output unless a test provides structured output
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 2, [], ["qstat: invalid option -- 'F'"])]
 
 
     def test_terminate_job(self):
@@ -31,6 +36,14 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
         expected_call = [mock.call('qdel %d' % job_id)]
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_call)
 
+    def test_terminate_jobs(self):
+        jobs = [{self._adapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['123', '124[0]']]
+
+        self._adapter.terminate_jobs(jobs)
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ["qdel 123 '124[0]'"])
+
     def test_submit_job(self):
         job_id = '123'
         test_output = ['%s.ulex.kitware.com' % job_id]
@@ -54,6 +67,51 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
         self.assertIsNotNone(cm.exception)
 
 
+    def test_submit_array(self):
+        self._cluster_connection.execute.return_value = ['123[].ulex']
+        job = {
+            'dir': '/tmp'
+        }
+        job_ids = self._adapter.submit_array(job, 'script.sh', 2)
+        self._cluster_connection.execute.assert_called_once_with(
+            'cd /tmp && qsub ./script.sh')
+        self.assertEqual(job_ids, ['123[0]', '123[1]'])
+
+    def test_job_statuses_array(self):
+        job_status_output = [
+            'Job ID                    Name             User            Time Use S Queue',
+            '------------------------- ---------------- --------------- -------- - -----',
+            '123[0].ulex               script.sh-0      cdc             00:00:01 R batch',
+            '123[1].ulex               script.sh-1      cdc                    0 Q batch'
+        ]
+        self._cluster_connection.execute.return_value = job_status_output
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['123[0]', '123[1]', '123[2]']]
+        status = self._adapter.job_statuses(jobs)
+        # Array elements are only listed with -t
+        self._cluster_connection.execute.assert_called_once_with(
+            "qstat -t '123[0]' '123[1]' '123[2]'")
+        self.assertEqual([state for (_, state) in status],
+                         ['running', 'queued', None])
+
+    def test_queues(self):
+        self._cluster_connection.execute.return_value = [
+            'Queue: batch',
+            '    queue_type = Execution',
+            '    resources_max.walltime = 24:00:00',
+            '    resources_max.nodect = 64',
+            '    enabled = True',
+            '',
+            'Queue: debug',
+            '    queue_type = Execution'
+        ]
+        self.assertEqual(self._adapter.queues(), [
+            {'name': 'batch', 'maxWallTime': '24:00:00', 'maxNodes': 64},
+            {'name': 'debug'}
+        ])
+        self._cluster_connection.execute.assert_called_once_with(
+            'qstat -Q -f')
+
     def test_job_statuses(self):
         job1_id = '1126'
         job1 = {
@@ -84,6 +142,130 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
         self.assertEqual(status[0][1], 'complete')
         self.assertEqual(status[1][1], 'complete')
 
+    def _recorded_output(self, name):
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'queue', name)
+
+        with open(path, 'r') as fp:
+            return fp.read().splitlines()
+
+    def test_job_statuses_recorded(self):
+        self._cluster_connection.execute.return_value \
+            = self._recorded_output('pbs_qstat.txt')
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['2203', '2205', '2210', '4204', '1']]
+        status = self._adapter.job_statuses(jobs)
+        self.assertEqual([state for (_, state) in status],
+                         ['queued', 'complete', 'queued', 'running', None])
+        self.assertEqual(len(self._adapter.queue_states()), 1000)
+
+    def test_job_statuses_structured(self):
+        output = json.dumps({
+            'pbs_version': '19.1.1',
+            'Jobs': {
+                '1126.ulex': {
+                    'job_state': 'R',
+                    'exec_host': 'node01/0*4',
+                    'stime': 'Wed Nov 18 13:18:09 2015',
+                    'comment': 'Job run at Wed Nov 18 at 13:18 on (node01)'
+                },
+                '1127[].ulex': {
+                    'job_state': 'Q',
+                    'comment': 'Not Running: Insufficient resources'
+                }
+            }
+        }, indent=4).splitlines()
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 0, output, [])]
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127']]
+
+        details = self._adapter.job_details(jobs)
+        self.assertEqual(
+            self._cluster_connection.execute_many.call_args_list,
+            [mock.call(['qstat -f -F json 1126 1127'])])
+        self._cluster_connection.execute.assert_not_called()
+        self.assertEqual([info for (_, info) in details], [
+            {'state': 'running', 'nodes': 'node01/0*4',
+             'startTime': 'Wed Nov 18 13:18:09 2015',
+             'reason': 'Job run at Wed Nov 18 at 13:18 on (node01)'},
+            {'state': 'queued',
+             'reason': 'Not Running: Insufficient resources'}
+        ])
+
+    def test_structured_unsupported(self):
+        # Torque has no JSON output, once that is known for a cluster the
+        # table is used straight away.
+        adapter = get_queue_adapter({
+            '_id': 'torque',
+            'config': {
+                'scheduler': {
+                    'type': QueueType.PBS
+                }
+            },
+            'type': 'trad'
+        }, self._cluster_connection)
+        self._cluster_connection.execute.return_value = [
+            '1126.ulex                    sleep.sh         cjh             '
+            '00:00:00 R batch'
+        ]
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: '1126'}]
+
+        self.assertEqual(adapter.job_statuses(jobs)[0][1], 'running')
+        self.assertEqual(adapter.job_statuses(jobs)[0][1], 'running')
+        self.assertEqual(self._cluster_connection.execute_many.call_count, 1)
+        self.assertEqual(self._cluster_connection.execute.call_count, 2)
+
+    def test_structured_parse_error(self):
+        # Output that can't be parsed falls back to the table for that query
+        # only, the next query still asks for structured output.
+        adapter = get_queue_adapter({
+            '_id': 'truncated',
+            'config': {
+                'scheduler': {
+                    'type': QueueType.PBS
+                }
+            },
+            'type': 'trad'
+        }, self._cluster_connection)
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 0, ['{"Jobs": {'], [])]
+        self._cluster_connection.execute.return_value = [
+            '1126.ulex                    sleep.sh         cjh             '
+            '00:00:00 R batch'
+        ]
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: '1126'}]
+
+        self.assertEqual(adapter.job_statuses(jobs)[0][1], 'running')
+        self.assertEqual(adapter.job_statuses(jobs)[0][1], 'running')
+        self.assertEqual(self._cluster_connection.execute_many.call_count, 2)
+        self.assertEqual(self._cluster_connection.execute.call_count, 2)
+
+    def test_structured_failure(self):
+        # A failure that isn't an unsupported option or an unknown job id
+        # leaves the state of the jobs unknown, it isn't an empty queue.
+        adapter = get_queue_adapter({
+            '_id': 'down',
+            'config': {
+                'scheduler': {
+                    'type': QueueType.PBS
+                }
+            },
+            'type': 'trad'
+        }, self._cluster_connection)
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: '1126'}]
+        for stderr in [[], ['qstat: cannot connect to server ulex']]:
+            self._cluster_connection.execute_many.return_value = [
+                CommandResult('', 1, [], stderr)]
+            with self.assertRaises(QueueQueryError):
+                adapter.job_statuses(jobs)
+
+        # Jobs that have left the queue aren't an error
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 153, [], ['qstat: Unknown Job Id 1126.ulex'])]
+        self.assertEqual(adapter.job_statuses(jobs), [(jobs[0], None)])
+        self._cluster_connection.execute.assert_not_called()
+
     def test_submission_template_pbs(self):
         cluster = {
             '_id': 'dummy',
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import time
+
+from cumulus.transport.pool import PooledClient, SshConnectionPool
+
+
+class PoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = SshConnectionPool(max_quiet=60)
+        self._key = ('host', 22, 'user', 'key')
+        connect = mock.patch.object(SshConnectionPool, '_connect')
+        self._connect = connect.start()
+        self.addCleanup(connect.stop)
+        load_key = mock.patch.object(SshConnectionPool, '_load_key')
+        load_key.start()
+        self.addCleanup(load_key.stop)
+
+    def _client(self, active=True):
+        client = mock.MagicMock()
+        client.get_transport.return_value.is_active.return_value = active
+
+        return client
+
+    def _idle(self, client, quiet):
+        entry = PooledClient(self._key, client)
+        self._pool.release(entry)
+        entry.last_used = time.time() - quiet
+
+        return entry
+
+    def test_acquire_reuses_recent(self):
+        entry = self._idle(self._client(), 10)
+
+        self.assertIs(self._pool.acquire(*self._key), entry)
+        self._connect.assert_not_called()
+
+    def test_acquire_skips_quiet(self):
+        # A connection that hasn't been used for a while may be half-open,
+        # a packet queued on it would succeed, so it isn't handed out.
+        client = self._client()
+        entry = self._idle(client, 120)
+
+        self.assertIsNot(self._pool.acquire(*self._key), entry)
+        self.assertEqual(self._connect.call_count, 1)
+        client.close.assert_called_once_with()
+        client.get_transport.return_value.send_ignore.assert_not_called()
+
+    def test_acquire_skips_inactive(self):
+        client = self._client()
+        entry = self._idle(client, 0)
+        client.get_transport.return_value.is_active.return_value = False
+
+        self.assertIsNot(self._pool.acquire(*self._key), entry)
+        self.assertEqual(self._connect.call_count, 1)
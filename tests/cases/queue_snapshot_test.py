@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import httmock
+import json
+import mock
+
+from cumulus.constants import JobQueueState
+from cumulus.queue import get_queue_adapter
+from cumulus.queue.abstract import QueueQueryError
+from cumulus.transport.batch import CommandResult
+
+QSTAT_OUTPUT = [
+    'job-ID  prior   name       user         state submit/start at     '
+    'queue                          slots ja-task-ID',
+    '-----------------------------------------------------------------'
+    '------------------------------------------------',
+    '      1 0.50000 job1.sh    ubuntu       r     11/19/2015 21:37:33 '
+    'all.q@node                     1',
+    '      2 0.00000 job2.sh    ubuntu       qw    11/19/2015 21:37:34 '
+    '                               1'
+]
+
+
+class QueueSnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._cluster = {
+            '_id': 'cluster',
+            'type': 'ec2',
+            'config': {
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        self._conn = mock.MagicMock()
+        self._conn.execute.return_value = QSTAT_OUTPUT
+        self._conn.execute_many.return_value = [
+            CommandResult('qstat -xml', 2, [], ['invalid option'])]
+        self._jobs = [{'queueJobId': '1'}, {'queueJobId': '2'},
+                      {'queueJobId': '3'}]
+        self._snapshots = []
+        self._gets = []
+        self._puts = []
+
+    def _mocks(self):
+        @httmock.urlmatch(path=r'^/api/v1/clusters/cluster/queue$',
+                          method='GET')
+        def _get(url, request):
+            self._gets.append(url.query)
+            content = self._snapshots.pop(0)
+            content.setdefault('retryAfter', 0)
+
+            return httmock.response(200, content, {}, request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/cluster/queue$',
+                          method='PUT')
+        def _put(url, request):
+            self._puts.append(json.loads(request.body.decode('utf8')))
+
+            return httmock.response(200, None, {}, request=request)
+
+        return httmock.HTTMock(_get, _put)
+
+    def _statuses(self):
+        adapter = get_queue_adapter(self._cluster, self._conn,
+                                    girder_token='token')
+        with self._mocks():
+            return [state for (_, state) in adapter.job_statuses(self._jobs)]
+
+    def test_refresh(self):
+        self._snapshots = [{'time': None, 'states': [], 'refresh': True,
+                            'refreshTime': 30.0}]
+        self.assertEqual(self._statuses(), [JobQueueState.RUNNING,
+                                            JobQueueState.QUEUED, None])
+        self._conn.execute.assert_called_once_with('qstat')
+        self.assertEqual(len(self._puts), 1)
+        # The snapshot is saved with the time Girder gave, not the worker's
+        self.assertEqual(self._puts[0]['time'], 30.0)
+        # Stored as a list, the ids of array elements contain '.'
+        self.assertEqual(
+            sorted(self._puts[0]['states'], key=lambda e: e['queueJobId']),
+            [{'queueJobId': '1', 'state': 'r'},
+             {'queueJobId': '2', 'state': 'qw'}])
+
+    def test_shared(self):
+        self._jobs.append({'queueJobId': '4.1'})
+        self._snapshots = [{'time': 10.0,
+                            'states': [{'queueJobId': '1', 'state': 'qw'},
+                                       {'queueJobId': '3', 'state': 'r'},
+                                       {'queueJobId': '4.1', 'state': 'r'}],
+                            'refresh': False}]
+        self.assertEqual(self._statuses(), [JobQueueState.QUEUED, None,
+                                            JobQueueState.RUNNING,
+                                            JobQueueState.RUNNING])
+        # The scheduler wasn't queried
+        self._conn.execute.assert_not_called()
+        self.assertEqual(self._puts, [])
+
+    def test_submitted_after(self):
+        # Job 2 was queued after the snapshot was taken, so it must not be
+        # reported as gone from the queue.
+        self._jobs[1]['queuedAt'] = 20.0
+        self._snapshots = [
+            {'time': 10.0, 'states': [{'queueJobId': '1', 'state': 'r'}],
+             'refresh': False},
+            {'time': 21.0, 'states': [{'queueJobId': '1', 'state': 'r'},
+                                      {'queueJobId': '2', 'state': 'qw'}],
+             'refresh': False}
+        ]
+        self.assertEqual(self._statuses(), [JobQueueState.RUNNING,
+                                            JobQueueState.QUEUED, None])
+        self.assertEqual(len(self._gets), 2)
+        self.assertIn('after=20.0', self._gets[0])
+        self._conn.execute.assert_not_called()
+
+    @mock.patch('cumulus.queue.abstract._structured_unsupported', set())
+    @mock.patch('cumulus.queue.abstract.structured_output_enabled',
+                return_value=True)
+    def test_refresh_failure(self, *args):
+        # A failed query isn't saved as an empty queue for the other monitors
+        self._snapshots = [{'time': None, 'states': [], 'refresh': True,
+                            'refreshTime': 30.0}]
+        self._conn.execute_many.return_value = [
+            CommandResult('qstat -xml', 1, [], ['error: commlib error'])]
+        with self.assertRaises(QueueQueryError):
+            self._statuses()
+        self.assertEqual(self._puts, [])
+
+    @mock.patch('cumulus.queue.snapshot.WAIT_TIMEOUT', -1)
+    def test_wait_timeout(self):
+        self._jobs[1]['queuedAt'] = 20.0
+        self._snapshots = [{'time': 10.0, 'states': [], 'refresh': False}]
+        self.assertEqual(self._statuses(), [JobQueueState.RUNNING,
+                                            JobQueueState.QUEUED, None])
+        # Fall back to querying the scheduler, without saving the result
+        self._conn.execute.assert_called_once_with('qstat')
+        self.assertEqual(self._puts, [])
+
+    @mock.patch('cumulus.queue.snapshot.snapshot_enabled', return_value=False)
+    def test_disabled(self, snapshot_enabled):
+        self.assertEqual(self._statuses(), [JobQueueState.RUNNING,
+                                            JobQueueState.QUEUED, None])
+        self.assertEqual(self._gets, [])
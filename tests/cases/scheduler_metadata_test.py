@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import unittest
+import httmock
+import json
+import mock
+
+from cumulus.queue import get_queue_adapter
+
+QCONF_OUTPUT = [
+    'pe_name            orte',
+    'slots              10',
+    'user_lists         NONE'
+]
+
+
+class SchedulerMetadataTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._cluster = {
+            '_id': 'cluster',
+            'type': 'ec2',
+            'config': {
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        self._conn = mock.MagicMock()
+        self._conn.execute.return_value = QCONF_OUTPUT
+        self._cached = {}
+        self._gets = []
+        self._puts = []
+
+    def _mocks(self):
+        @httmock.urlmatch(path=r'^/api/v1/clusters/cluster/scheduler$',
+                          method='GET')
+        def _get(url, request):
+            self._gets.append(url.query)
+
+            return httmock.response(200, self._cached, {}, request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/cluster/scheduler$',
+                          method='PUT')
+        def _put(url, request):
+            entries = json.loads(request.body.decode('utf8'))
+            self._puts.append(entries)
+            self._cached.update(entries)
+
+            return httmock.response(200, None, {}, request=request)
+
+        return httmock.HTTMock(_get, _put)
+
+    def _slots(self):
+        adapter = get_queue_adapter(self._cluster, self._conn,
+                                    girder_token='token')
+        with self._mocks():
+            return adapter.number_of_slots('orte')
+
+    def test_cached(self):
+        self._cached = {'slots:orte': 12}
+        self.assertEqual(self._slots(), 12)
+        # The scheduler wasn't asked
+        self._conn.execute.assert_not_called()
+        self.assertIn('key=slots%3Aorte', self._gets[0])
+        self.assertIn('maxAge=3600', self._gets[0])
+
+    def test_miss(self):
+        self.assertEqual(self._slots(), 10)
+        self._conn.execute.assert_called_once_with('qconf -sp orte')
+        self.assertEqual(self._puts, [{'slots:orte': 10}])
+
+        # The next lookup is served from the cache
+        self.assertEqual(self._slots(), 10)
+        self.assertEqual(self._conn.execute.call_count, 1)
+
+    @mock.patch('cumulus.queue.metadata.metadata_cache_enabled',
+                return_value=False)
+    def test_disabled(self, metadata_cache_enabled):
+        self.assertEqual(self._slots(), 10)
+        self.assertEqual(self._gets, [])
+
+    def test_scheduler_metadata(self):
+        self._conn.execute.side_effect = [
+            ['all.q', 'gpu.q'],
+            ['orte', 'smp'],
+            QCONF_OUTPUT,
+            ['pe_name            smp', 'slots              4']
+        ]
+        adapter = get_queue_adapter(self._cluster, self._conn,
+                                    girder_token='token')
+        with self._mocks():
+            metadata = adapter.scheduler_metadata()
+
+        self.assertEqual(metadata, {
+            'queues': [{'name': 'all.q'}, {'name': 'gpu.q'}],
+            'slots': {'orte': 10, 'smp': 4}
+        })
+        self.assertEqual(self._cached, {
+            'queues': [{'name': 'all.q'}, {'name': 'gpu.q'}],
+            'parallelEnvironments': ['orte', 'smp'],
+            'slots:orte': 10,
+            'slots:smp': 4
+        })
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import httmock
+import io
+import mock
+
+from cumulus.transport.abstract import AbstractConnection
+from cumulus.transport.scheduler import Throttle, ThrottledStream, \
+    TransferLease, TransferLeaseTimeout, transfer_lease
+
+
+class Connection(AbstractConnection):
+    pass
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._cluster = {
+            '_id': 'cluster',
+            'config': {
+                'transfer': {
+                    'maxSessions': 1
+                }
+            }
+        }
+        self._statuses = []
+        self._rates = []
+        self._requests = []
+        self._queries = []
+        self._expired = 0
+
+    def _mocks(self):
+        @httmock.urlmatch(path=r'^/api/v1/clusters/cluster/transfers(/.*)?$')
+        def _lease(url, request):
+            self._requests.append((request.method, url.path))
+            self._queries.append(url.query)
+            if request.method == 'DELETE':
+                return httmock.response(200, None, {}, request=request)
+
+            if request.method == 'PUT' and self._expired:
+                self._expired -= 1
+                return httmock.response(404, {'message': 'Lease not found.'},
+                                        {}, request=request)
+
+            status = self._statuses.pop(0) if self._statuses else 'active'
+            content = {
+                '_id': 'lease',
+                'status': status,
+                'ttl': 60,
+                'rate': self._rates.pop(0) if self._rates else None,
+                'retryAfter': 0
+            }
+
+            return httmock.response(200, content, {}, request=request)
+
+        return httmock.HTTMock(_lease)
+
+    @mock.patch('cumulus.transport.scheduler.time.sleep')
+    @mock.patch('cumulus.transport.scheduler.time.time')
+    def test_throttle(self, time, sleep):
+        time.side_effect = [0, 0, 0, 1]
+        throttle = Throttle(100)
+
+        # The bucket starts empty so the first read waits for its bytes
+        throttle.consume(50)
+        sleep.assert_called_once_with(0.5)
+        sleep.reset_mock()
+
+        # Reads beyond the rate go into debt
+        throttle.consume(100)
+        sleep.assert_called_once_with(1.5)
+        sleep.reset_mock()
+
+        # Once the time has passed the debt has been paid
+        throttle.consume(10)
+        sleep.assert_called_once_with(0.6)
+        sleep.reset_mock()
+
+        throttle.set_rate(None)
+        throttle.consume(1000)
+        sleep.assert_not_called()
+
+    def test_throttled_stream(self):
+        throttle = mock.MagicMock()
+        input = ThrottledStream(io.BytesIO(b'data'), throttle)
+        self.assertEqual(input.read(), b'data')
+        throttle.consume.assert_called_once_with(4)
+
+        throttle.reset_mock()
+        output = ThrottledStream(io.BytesIO(), throttle)
+        output.write(b'abc')
+        throttle.consume.assert_called_once_with(3)
+        self.assertEqual(output.getvalue(), b'abc')
+
+    def test_connection_throttle(self):
+        conn = Connection()
+        stream = io.BytesIO(b'data')
+        self.assertIs(conn._throttled(stream), stream)
+
+        throttle = mock.MagicMock()
+        conn.set_throttle(throttle)
+        self.assertEqual(conn._throttled(stream).read(), b'data')
+        read_range = conn._throttled_range(lambda offset, length: b'x' *
+                                           length)
+        self.assertEqual(read_range(0, 3), b'xxx')
+        self.assertEqual(throttle.consume.call_args_list,
+                         [mock.call(4), mock.call(3)])
+
+    def test_acquire(self):
+        self._statuses = ['waiting', 'waiting', 'active']
+        self._rates = [None, None, 1024]
+        with self._mocks():
+            lease = TransferLease('cluster', 'token')
+            lease.acquire()
+            self.assertEqual(lease.throttle.rate, 1024)
+            lease.release()
+
+        self.assertEqual(self._requests, [
+            ('POST', '/api/v1/clusters/cluster/transfers'),
+            ('PUT', '/api/v1/clusters/cluster/transfers/lease'),
+            ('PUT', '/api/v1/clusters/cluster/transfers/lease'),
+            ('DELETE', '/api/v1/clusters/cluster/transfers/lease')
+        ])
+
+    def test_acquire_expired(self):
+        # A waiting lease that expired is requested again
+        self._statuses = ['waiting', 'active']
+        self._expired = 1
+        with self._mocks():
+            lease = TransferLease('cluster', 'token', owner_id='owner')
+            lease.acquire()
+            lease.release()
+
+        self.assertEqual([method for (method, _) in self._requests],
+                         ['POST', 'PUT', 'POST', 'DELETE'])
+        self.assertEqual(self._queries[0], 'ownerId=owner')
+        self.assertEqual(self._queries[2], 'ownerId=owner')
+
+    def test_renew_lost(self):
+        # An active lease that is lost holds the transfer until a slot is
+        # granted again.
+        self._statuses = ['active', 'waiting', 'active']
+        self._expired = 1
+        with self._mocks():
+            lease = TransferLease('cluster', 'token')
+            lease.acquire()
+            lease._released.set()
+            lease._renew_thread.join()
+
+            # Run the renew loop three times, recording whether the transfer
+            # is held each time.
+            paused = []
+
+            def _wait(delay):
+                paused.append(not lease.throttle._running.is_set())
+                return len(paused) > 2
+            lease._released = mock.MagicMock()
+            lease._released.wait.side_effect = _wait
+            lease._renew_loop()
+            lease.release()
+
+        self.assertEqual([method for (method, _) in self._requests],
+                         ['POST', 'PUT', 'POST', 'PUT', 'DELETE'])
+        # Paused while waiting, resumed once active again
+        self.assertEqual(paused, [False, True, False])
+        self.assertTrue(lease.throttle._running.is_set())
+
+    def test_acquire_timeout(self):
+        self._statuses = ['waiting'] * 10
+        with self._mocks():
+            lease = TransferLease('cluster', 'token')
+            with self.assertRaises(TransferLeaseTimeout):
+                lease.acquire(timeout=-1)
+
+        # The place in the queue is given up
+        self.assertEqual(self._requests[-1][0], 'DELETE')
+
+    def test_transfer_lease(self):
+        conn = Connection()
+        self._rates = [2048]
+        with self._mocks():
+            with transfer_lease(self._cluster, 'token', conn) as lease:
+                self.assertIs(conn._throttle, lease.throttle)
+                self.assertEqual(conn._throttle.rate, 2048)
+
+        self.assertIsNone(conn._throttle)
+        self.assertEqual([method for (method, _) in self._requests],
+                         ['POST', 'DELETE'])
+        # The slots are shared between owners, the cluster's by default
+        self.assertEqual(self._queries[0], '')
+
+        self._cluster['userId'] = 'cluster owner'
+        with self._mocks():
+            with transfer_lease(self._cluster, 'token', conn):
+                pass
+            with transfer_lease(self._cluster, 'token', conn,
+                                owner_id='job owner'):
+                pass
+
+        self.assertEqual(self._queries[2], 'ownerId=cluster+owner')
+        self.assertEqual(self._queries[4], 'ownerId=job+owner')
+
+    def test_transfer_lease_no_limits(self):
+        conn = Connection()
+        del self._cluster['config']['transfer']
+        with self._mocks():
+            with transfer_lease(self._cluster, 'token', conn) as lease:
+                self.assertIsNone(lease)
+
+        self.assertEqual(self._requests, [])
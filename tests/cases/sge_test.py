@@ -25,6 +25,7 @@ from cumulus.queue import get_queue_adapter
 from cumulus.queue.abstract import AbstractQueueAdapter
 from cumulus.constants import QueueType
 from cumulus.tasks import job
+from cumulus.transport.batch import CommandResult
 
 
 class SgeQueueAdapterTestCase(unittest.TestCase):
@@ -39,6 +40,9 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
             },
             'type': 'trad'
         }, self._cluster_connection)
+        # Use the table output unless a test provides structured output
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 2, [], ['qstat: invalid option argument "-xml"'])]
 
 
     def test_terminate_job(self):
@@ -51,6 +55,25 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
         expected_call = [mock.call('qdel %d' % job_id)]
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_call)
 
+    def test_terminate_jobs(self):
+        jobs = [{self._adapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['123', '124.2']]
+
+        self._adapter.terminate_jobs(jobs)
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['qdel 123 124.2'])
+        self._cluster_connection.execute.assert_not_called()
+
+    @mock.patch('cumulus.queue.abstract.MAX_TERMINATE_COMMAND_LENGTH', 20)
+    def test_terminate_jobs_chunked(self):
+        jobs = [{self._adapter.QUEUE_JOB_ID: str(job_id)}
+                for job_id in range(1000, 1006)]
+
+        self._adapter.terminate_jobs(jobs)
+        # The ids are split across invocations run in one batch
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['qdel 1000 1001 1002', 'qdel 1003 1004 1005'])
+
     def test_submit_job(self):
         job_id = '123'
         test_output = ['Your job %s ("test.sh") has been submitted' % job_id]
@@ -74,6 +97,31 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
         self.assertIsNotNone(cm.exception)
 
 
+    def test_submit_array(self):
+        test_output = ['Your job-array 123.1-3:1 ("test.sh") has been submitted']
+        job = {
+            'dir': '/tmp'
+        }
+        self._cluster_connection.execute.return_value = test_output
+        job_ids = self._adapter.submit_array(job, 'script.sh', 3)
+        self._cluster_connection.execute.assert_called_once_with(
+            'cd /tmp && qsub -cwd ./script.sh')
+        self.assertEqual(job_ids, ['123.1', '123.2', '123.3'])
+
+    def test_job_statuses_array(self):
+        job_status_output = [
+            'job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID',
+            '-----------------------------------------------------------------------------------------------------------------',
+            '    123 0.50000 test.sh    cjh          r     11/18/2015 13:18:09 main.q@ulmus.kitware.com           1 1',
+            '    123 0.50000 test.sh    cjh          qw    11/18/2015 13:18:09                                    1 2-3:1'
+        ]
+        self._cluster_connection.execute.return_value = job_status_output
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['123.1', '123.2', '123.3', '123.4']]
+        status = self._adapter.job_statuses(jobs)
+        self.assertEqual([state for (_, state) in status],
+                         ['running', 'queued', 'queued', None])
+
     def test_job_statuses(self):
         job1_id = '1126'
         job1 = {
@@ -104,6 +152,80 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
         self.assertEqual(status[0][1], 'running')
         self.assertEqual(status[1][1], 'queued')
 
+    def _recorded_output(self, name):
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'queue', name)
+
+        with open(path, 'r') as fp:
+            return fp.read().splitlines()
+
+    def test_job_statuses_recorded(self):
+        self._cluster_connection.execute.return_value \
+            = self._recorded_output('sge_qstat.txt')
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['104402', '104416', '106146', '1']]
+        status = self._adapter.job_statuses(jobs)
+        self.assertEqual([state for (_, state) in status],
+                         ['running', 'running', 'queued', None])
+
+        # The tasks of an array job share an id, the first line wins. Each
+        # task is also indexed as id.task, pending ranges are expanded.
+        states = self._adapter.queue_states()
+        self.assertEqual(states['104443'], {'state': 'r'})
+        self.assertEqual(states['104443.2'], {'state': 'r'})
+        self.assertEqual(states['104443.4'], {'state': 'qw'})
+        self.assertEqual(states['104443.100'], {'state': 'qw'})
+        self.assertNotIn('104443.3', states)
+        self.assertEqual(len([s for s in states if '.' not in s]), 888)
+
+    def test_job_statuses_structured(self):
+        output = [
+            "<?xml version='1.0'?>",
+            '<job_info>',
+            '  <queue_info>',
+            '    <job_list state="running">',
+            '      <JB_job_number>1126</JB_job_number>',
+            '      <state>r</state>',
+            '      <JAT_start_time>2015-11-18T13:18:09</JAT_start_time>',
+            '      <queue_name>main.q@node01.cluster</queue_name>',
+            '    </job_list>',
+            '  </queue_info>',
+            '  <job_info>',
+            '    <job_list state="pending">',
+            '      <JB_job_number>1127</JB_job_number>',
+            '      <state>qw</state>',
+            '      <queue_name></queue_name>',
+            '    </job_list>',
+            '  </job_info>',
+            '</job_info>'
+        ]
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('qstat -xml', 0, output, [])]
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1']]
+
+        details = self._adapter.job_details(jobs)
+        self.assertEqual(
+            self._cluster_connection.execute_many.call_args_list,
+            [mock.call(['qstat -xml'])])
+        self._cluster_connection.execute.assert_not_called()
+        self.assertEqual([info for (_, info) in details], [
+            {'state': 'running', 'nodes': 'node01.cluster',
+             'startTime': '2015-11-18T13:18:09'},
+            {'state': 'queued'},
+            {'state': None}
+        ])
+
+        # Output that can't be parsed falls back to the table
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('qstat -xml', 0, ['<job_info>'], [])]
+        self._cluster_connection.execute.return_value = [
+            '1126 0.50000 test.sh    cjh          r     11/18/2015 13:18:09'
+        ]
+        status = self._adapter.job_statuses(jobs[:1])
+        self.assertEqual(status[0][1], 'running')
+        self._cluster_connection.execute.assert_called_once_with('qstat')
+
     def test_unsupported(self):
         with self.assertRaises(Exception) as cm:
             get_queue_adapter({
@@ -6,6 +6,7 @@ from cumulus.queue import get_queue_adapter
 from cumulus.queue.abstract import AbstractQueueAdapter
 from cumulus.constants import QueueType
 from cumulus.tasks import job
+from cumulus.transport.batch import CommandResult
 
 
 class SlurmQueueAdapterTestCase(unittest.TestCase):
@@ -20,6 +21,9 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
             },
             'type': 'trad'
         }, self._cluster_connection)
+        # Use the table output unless a test provides structured output
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 2, [], ["squeue: unrecognized option '--format'"])]
 
 
     def test_terminate_job(self):
@@ -32,6 +36,14 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
         expected_call = [mock.call('scancel %d' % job_id)]
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_call)
 
+    def test_terminate_jobs(self):
+        jobs = [{self._adapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['123', '124_0']]
+
+        self._adapter.terminate_jobs(jobs)
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['scancel 123 124_0'])
+
     def test_submit_job(self):
         job_id = '123'
         test_output = ['Submitted batch job %s' % job_id]
@@ -55,6 +67,49 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
         self.assertIsNotNone(cm.exception)
 
 
+    def test_submit_array(self):
+        self._cluster_connection.execute.return_value \
+            = ['Submitted batch job 123']
+        job = {
+            'dir': '/tmp'
+        }
+        job_ids = self._adapter.submit_array(job, 'script.sh', 2)
+        self._cluster_connection.execute.assert_called_once_with(
+            'cd /tmp && sbatch ./script.sh')
+        self.assertEqual(job_ids, ['123_0', '123_1'])
+
+    def test_job_statuses_array(self):
+        job_status_output = [
+              'JOBID PARTITION     NAME     USER  ST       TIME  NODES NODELIST(REASON)',
+              '123_0 general-c      hello_te cdc   R       0:14      2 f16n[10-11]',
+              '123_1 general-c      hello_te cdc   PD      0:00      2 (Resources)'
+        ]
+        self._cluster_connection.execute.return_value = job_status_output
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['123_0', '123_1', '123_2']]
+        status = self._adapter.job_statuses(jobs)
+        # Array elements are listed one per line with -r
+        self._cluster_connection.execute.assert_called_once_with(
+            'squeue -r -j 123_0,123_1,123_2')
+        self.assertEqual([state for (_, state) in status],
+                         ['running', 'queued', None])
+
+    def test_queues(self):
+        self._cluster_connection.execute.return_value = [
+            'debug*|30:00|1-4',
+            'regular|2-00:00:00|1-infinite',
+            'regular|2-00:00:00|1-infinite',
+            'shared|infinite|1'
+        ]
+        self.assertEqual(self._adapter.queues(), [
+            {'name': 'debug', 'default': True, 'maxWallTime': '30:00',
+             'maxNodes': 4},
+            {'name': 'regular', 'maxWallTime': '2-00:00:00'},
+            {'name': 'shared', 'maxNodes': 1}
+        ])
+        self._cluster_connection.execute.assert_called_once_with(
+            "sinfo --noheader --format='%P|%l|%s'")
+
     def test_job_statuses(self):
         job1_id = '1126'
         job1 = {
@@ -77,6 +132,56 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
         self.assertEqual(status[0][1], 'running')
         self.assertEqual(status[1][1], 'error')
 
+    def _recorded_output(self, name):
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'queue', name)
+
+        with open(path, 'r') as fp:
+            return fp.read().splitlines()
+
+    def test_job_statuses_recorded(self):
+        self._cluster_connection.execute.return_value \
+            = self._recorded_output('slurm_squeue.txt')
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['880101', '880104', '880126', '882119', '1']]
+        status = self._adapter.job_statuses(jobs)
+        self.assertEqual([state for (_, state) in status],
+                         ['queued', 'complete', 'error', 'running', None])
+        self.assertEqual(len(self._adapter.queue_states()), 1000)
+
+    def test_job_statuses_structured(self):
+        output = [
+            '1126|R|f16n[10-11]|2015-11-18T13:18:09|None',
+            '1127|PD||N/A|Resources',
+            '1127|PD||N/A|Resources'
+        ]
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 0, output, [])]
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1']]
+
+        details = self._adapter.job_details(jobs)
+        self.assertEqual(
+            self._cluster_connection.execute_many.call_args_list,
+            [mock.call(["squeue --noheader --format='%i|%t|%N|%S|%r' "
+                        "-j 1126,1127,1"])])
+        self._cluster_connection.execute.assert_not_called()
+        self.assertEqual([info for (_, info) in details], [
+            {'state': 'running', 'nodes': 'f16n[10-11]',
+             'startTime': '2015-11-18T13:18:09'},
+            {'state': 'queued', 'reason': 'Resources'},
+            {'state': None}
+        ])
+
+        # An unknown job id fails without output, that isn't a reason to
+        # fall back to the table.
+        self._cluster_connection.execute_many.return_value = [
+            CommandResult('', 1, [], [
+                'slurm_load_jobs error: Invalid job id specified'])]
+        self.assertEqual(self._adapter.job_statuses(jobs[2:]),
+                         [(jobs[2], None)])
+        self._cluster_connection.execute.assert_not_called()
+
     def test_submission_template(self):
         cluster = {
             '_id': 'dummy',
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import io
+import os
+import stat
+
+from cumulus.transport import get_connection
+from cumulus.transport.abstract import AbstractConnection, STDOUT
+from cumulus.transport.batch import CommandResult
+from cumulus.transport.files.download import download_path
+from cumulus.transport.pool import get_ssh_pool
+
+from .ssh_server import SshServer
+
+
+class SshConnectionTestCase(unittest.TestCase):
+    """
+    Exercises SshClusterConnection against a local SSH server.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._server = SshServer()
+        cls._server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        get_ssh_pool().clear()
+        cls._server.stop()
+
+    def setUp(self):
+        self._cluster = self._server.cluster()
+
+    def _path(self, *path):
+        return os.path.join(self._server.home, *path)
+
+    def test_execute(self):
+        with get_connection('token', self._cluster) as conn:
+            self.assertEqual(conn.execute('pwd'), [self._server.home + '\n'])
+            output = list(conn.execute_stream('echo out; echo err 1>&2'))
+            self.assertIn((STDOUT, 'out\n'), output)
+
+            results = conn.execute_many(['echo a', 'exit 3', 'echo b'],
+                                        stop_on_error=True)
+            self.assertEqual(results, [
+                CommandResult('echo a', 0, ['a'], []),
+                CommandResult('exit 3', 3, [], []),
+                CommandResult('echo b', None, [], [])
+            ])
+
+    def test_open_command(self):
+        with get_connection('token', self._cluster) as conn:
+            with conn.open_command('tr a-z A-Z') as cmd:
+                cmd.stdin.write(b'hello')
+                cmd.close_stdin()
+                self.assertEqual(cmd.stdout.read(), b'HELLO')
+                cmd.wait()
+
+    def test_read_range(self):
+        data = b'0123456789' * 1000
+        with open(self._path('range'), 'wb') as fp:
+            fp.write(data)
+
+        with get_connection('token', self._cluster) as conn:
+            # Both the SFTP and the default shell implementation
+            for read_range in [conn.read_range,
+                               lambda *args, **kwargs:
+                               AbstractConnection.read_range(conn, *args,
+                                                             **kwargs)]:
+                self.assertEqual(read_range('range', offset=5, length=10),
+                                 data[5:15])
+                self.assertEqual(read_range('range', offset=9995), data[-5:])
+                self.assertEqual(read_range('range', offset=-3), data[-3:])
+                self.assertEqual(read_range('range', offset=-20, length=5),
+                                 data[-20:-15])
+                self.assertEqual(read_range('range', offset=20000), b'')
+
+            self.assertEqual(conn.tail('range', 4), b'6789')
+            self.assertEqual(conn.tail('range', 20000), data)
+
+    def test_put_get(self):
+        data = os.urandom(1024 * 1024 + 3)
+        with get_connection('token', self._cluster) as conn:
+            conn.makedirs('transfer/small')
+            conn.put(io.BytesIO(b'small'), 'transfer/small/file')
+            with conn.get('transfer/small/file') as fp:
+                self.assertEqual(fp.read(), b'small')
+
+            # Force a parallel ranged put
+            with mock.patch('cumulus.transport.ssh.transfer_config',
+                            return_value=(64 * 1024, 4, 0)):
+                conn.put_ranges(lambda offset, length:
+                                data[offset:offset + length],
+                                len(data), 'transfer/large')
+
+            with conn.get('transfer/large') as fp:
+                self.assertEqual(fp.read(), data)
+
+            # A small file is written whole when resumed, and the progress
+            # is still reported.
+            progress = mock.Mock()
+            conn.put_ranges(lambda offset, length:
+                            data[offset:offset + length],
+                            10, 'transfer/small/resumed', offset=4,
+                            progress=progress)
+            with conn.get('transfer/small/resumed') as fp:
+                self.assertEqual(fp.read(), data[:10])
+            progress.assert_called_once_with(10)
+
+            self.assertTrue(conn.isfile('transfer/large'))
+            self.assertEqual(conn.stat('transfer/large').st_size, len(data))
+            self.assertEqual(sorted(e['name'] for e in conn.list('transfer')),
+                             ['large', 'small'])
+
+    def test_walk(self):
+        os.makedirs(self._path('walk', 'a', 'b'))
+        with open(self._path('walk', 'a', 'b', 'file'), 'w') as fp:
+            fp.write('data')
+
+        with get_connection('token', self._cluster) as conn:
+            entries = {e['path']: e for e in conn.walk('walk')}
+
+        self.assertEqual(sorted(entries), ['a', 'a/b', 'a/b/file'])
+        self.assertTrue(stat.S_ISDIR(entries['a/b']['mode']))
+        self.assertEqual(entries['a/b/file']['size'], 4)
+
+    @mock.patch('cumulus.transport.files.download.GirderClient')
+    def test_import_path(self, girder_client):
+        girder_client = girder_client.return_value
+        girder_client.createItem.return_value = {'_id': 'item'}
+        girder_client.createFolder.return_value = {'_id': 'folder'}
+        girder_client.listFolder.return_value = iter([])
+        uploaded = {}
+
+        def _upload_file(item_id, stream, name, size, parentType):
+            uploaded[name] = stream.read()
+        girder_client.uploadFile.side_effect = _upload_file
+
+        os.makedirs(self._path('import', 'sub'))
+        for (path, data) in [('one', b'1'), ('sub/two', b'22')]:
+            with open(self._path('import', path), 'wb') as fp:
+                fp.write(data)
+
+        for bulk in [False, True]:
+            uploaded.clear()
+            with get_connection('token', self._cluster) as conn:
+                download_path(conn, 'token', 'parent', 'import',
+                              'sftp_assetstores', 'assetstore', upload=True,
+                              bulk=bulk)
+
+            self.assertEqual(uploaded, {'one': b'1', 'two': b'22'})
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+An in-process SSH/SFTP server backed by the local filesystem, so the SSH
+transport can be exercised against a real paramiko stack without a network.
+Commands are run with a local bash whose working directory is the server's
+home directory, relative SFTP paths are resolved against it as well.
+"""
+
+import errno
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import uuid
+
+import paramiko
+from paramiko import ServerInterface, SFTPServerInterface, SFTPServer, \
+    SFTPAttributes, SFTPHandle, SFTP_OK, AUTH_SUCCESSFUL, AUTH_FAILED, \
+    OPEN_SUCCEEDED
+
+import cumulus
+
+USER = 'cumulus'
+BUFFER_SIZE = 32768
+
+
+class _Server(ServerInterface):
+    def __init__(self, server):
+        self._server = server
+        self.home = server.home
+
+    def check_auth_publickey(self, username, key):
+        if username == USER and key == self._server.client_key:
+            return AUTH_SUCCESSFUL
+
+        return AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        thread = threading.Thread(target=self._server.run_command,
+                                  args=(channel, command))
+        thread.daemon = True
+        thread.start()
+
+        return True
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as ex:
+            return SFTPServer.convert_errno(ex.errno)
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class _SFTPServer(SFTPServerInterface):
+    def __init__(self, server, *args, **kwargs):
+        super(_SFTPServer, self).__init__(server, *args, **kwargs)
+        self._home = server.home
+
+    def _path(self, path):
+        return os.path.join(self._home, path)
+
+    def _error(self, ex):
+        return SFTPServer.convert_errno(ex.errno)
+
+    def list_folder(self, path):
+        path = self._path(path)
+        try:
+            entries = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(
+                    os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                entries.append(attr)
+
+            return entries
+        except OSError as ex:
+            return self._error(ex)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as ex:
+            return self._error(ex)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self._path(path)))
+        except OSError as ex:
+            return self._error(ex)
+
+    def open(self, path, flags, attr):
+        path = self._path(path)
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as ex:
+            return self._error(ex)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+
+        fp = os.fdopen(fd, mode)
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = fp
+        handle.writefile = fp
+
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except OSError as ex:
+            return self._error(ex)
+
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._path(oldpath), self._path(newpath))
+        except OSError as ex:
+            return self._error(ex)
+
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._path(path))
+        except OSError as ex:
+            return self._error(ex)
+
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._path(path))
+        except OSError as ex:
+            return self._error(ex)
+
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+    def canonicalize(self, path):
+        return os.path.normpath(self._path(path))
+
+
+class SshServer(object):
+    """
+    A SSH server listening on a local port, use as a context manager:
+
+        with SshServer() as server:
+            with get_connection('token', server.cluster()) as conn:
+                conn.execute('ls')
+    """
+    def __init__(self):
+        self.home = None
+        self.port = None
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._private_key = paramiko.RSAKey.generate(2048)
+        self.client_key = paramiko.RSAKey(data=self._private_key.asbytes())
+        self._socket = None
+        self._transports = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._key_name = None
+
+    def __enter__(self):
+        self.start()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def start(self):
+        self.home = tempfile.mkdtemp()
+        # The client key is looked up in the key store by name
+        self._key_name = 'sshserver-%s' % uuid.uuid4().hex
+        self._private_key.write_private_key_file(self.key_path)
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(16)
+        self.port = self._socket.getsockname()[1]
+
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            self._socket.close()
+        except socket.error:
+            pass
+
+        with self._lock:
+            for transport in self._transports:
+                transport.close()
+
+        shutil.rmtree(self.home, ignore_errors=True)
+        try:
+            os.remove(self.key_path)
+        except OSError:
+            pass
+
+    @property
+    def key_path(self):
+        return os.path.join(cumulus.config.ssh.keyStore, self._key_name)
+
+    def cluster(self, cluster_id='sshserver'):
+        """
+        Returns a cluster document that connects to this server.
+        """
+        return {
+            '_id': cluster_id,
+            'type': 'trad',
+            'config': {
+                'host': '127.0.0.1',
+                'port': self.port,
+                'ssh': {
+                    'user': USER,
+                    'key': self._key_name
+                }
+            }
+        }
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                (sock, _) = self._socket.accept()
+            except (socket.error, OSError):
+                return
+
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, _SFTPServer)
+            with self._lock:
+                self._transports.append(transport)
+            try:
+                transport.start_server(server=_Server(self))
+            except (paramiko.SSHException, EOFError):
+                transport.close()
+
+    def run_command(self, channel, command):
+        if isinstance(command, bytes):
+            command = command.decode('utf8')
+
+        proc = subprocess.Popen(['bash', '-c', command], cwd=self.home,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+        def _pump(read, write):
+            while True:
+                data = read(BUFFER_SIZE)
+                if not data:
+                    break
+                write(data)
+
+        def _stdin():
+            try:
+                _pump(channel.recv, proc.stdin.write)
+            except (IOError, OSError) as ex:
+                if ex.errno != errno.EPIPE:
+                    raise
+            finally:
+                try:
+                    proc.stdin.close()
+                except (IOError, OSError):
+                    pass
+
+        def _stderr():
+            _pump(proc.stderr.read1 if hasattr(proc.stderr, 'read1')
+                  else proc.stderr.read, channel.sendall_stderr)
+
+        threads = [threading.Thread(target=_stdin),
+                   threading.Thread(target=_stderr)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            _pump(proc.stdout.read1 if hasattr(proc.stdout, 'read1')
+                  else proc.stdout.read, channel.sendall)
+            threads[1].join()
+            channel.send_exit_status(proc.wait())
+        except (socket.error, EOFError):
+            proc.kill()
+        finally:
+            channel.close()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from cumulus.transport.batch import CommandResult
+from cumulus.transport.files.sync import remote_state, manifest_to_list, \
+    CHECKPOINT_NAME, MANIFEST_METADATA_KEY, MANIFEST_NAME
+from cumulus.transport.files.upload import upload_path
+from cumulus.transport.files.download import download_path
+
+
+class SyncTestCase(unittest.TestCase):
+
+    def test_remote_state(self):
+        conn = mock.MagicMock()
+        conn.execute_many.return_value = [
+            CommandResult('find', 0, ['a.txt\t10\t100.5', 'b/c.txt\t3\t200.0'],
+                          []),
+            CommandResult('sha256sum', 0, ['abc  ./a.txt', 'def  ./b/c.txt'],
+                          []),
+            CommandResult('cat', 0, ['{"a.txt": {"size": 10}}'], [])
+        ]
+
+        (files, manifest) = remote_state(conn, '/data', checksum=True,
+                                         manifest=True)
+
+        self.assertEqual(conn.execute_many.call_count, 1)
+        self.assertEqual(files, {
+            'a.txt': {'size': 10, 'mtime': '100.5', 'checksum': 'abc'},
+            'b/c.txt': {'size': 3, 'mtime': '200.0', 'checksum': 'def'}
+        })
+        self.assertEqual(manifest, {'a.txt': {'size': 10}})
+
+        # Missing directory
+        conn.execute_many.return_value = [
+            CommandResult('find', 1, [], ['No such file or directory']),
+            CommandResult('cat', 1, [], [])
+        ]
+        self.assertEqual(remote_state(conn, '/data', manifest=True),
+                         ({}, None))
+
+    def test_remote_state_skips_state_files(self):
+        # Run the commands locally, the files cumulus keeps its own state in
+        # should not be listed as files to sync.
+        def execute_many(commands):
+            results = []
+            for command in commands:
+                p = subprocess.Popen(command, shell=True,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     universal_newlines=True)
+                (stdout, stderr) = p.communicate()
+                results.append(CommandResult(command, p.returncode,
+                                             stdout.splitlines(),
+                                             stderr.splitlines()))
+            return results
+
+        conn = mock.MagicMock()
+        conn.execute_many.side_effect = execute_many
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.mkdir(os.path.join(root, 'sub'))
+        for path in ['a.txt', 'sub/b.txt', MANIFEST_NAME, CHECKPOINT_NAME]:
+            with open(os.path.join(root, path), 'w') as fp:
+                fp.write('data')
+
+        (files, _) = remote_state(conn, root, checksum=True)
+
+        self.assertEqual(sorted(files), ['a.txt', 'sub/b.txt'])
+        self.assertTrue(all('checksum' in f for f in files.values()))
+
+    @mock.patch('cumulus.transport.files.upload._upload_file')
+    @mock.patch('cumulus.transport.files.upload.GirderClient')
+    def test_upload_path_sync(self, girder_client, upload_file):
+        girder_client = girder_client.return_value
+        girder_client.listItem.return_value = [{'_id': 'item'}]
+        girder_client.listFolder.return_value = []
+        girder_client.get.return_value = [
+            {'_id': 'same', 'name': 'same.txt', 'size': 10},
+            {'_id': 'changed', 'name': 'changed.txt', 'size': 5},
+            {'_id': 'new', 'name': 'new.txt', 'size': 1}
+        ]
+
+        manifest = {
+            'same.txt': {'id': 'same', 'size': 10, 'mtime': '1.0'},
+            'changed.txt': {'id': 'old', 'size': 5, 'mtime': '1.0'}
+        }
+        conn = mock.MagicMock()
+        conn.execute_many.side_effect = [
+            [CommandResult('find', 0, ['same.txt\t10\t1.0',
+                                       'changed.txt\t5\t1.0'], []),
+             CommandResult('cat', 0, [json.dumps(manifest)], [])],
+            [CommandResult('cat', 0, [], [])]
+        ]
+
+        upload_path(conn, 'token', 'folder', '/data', sync=True)
+
+        uploaded = [c[0][2]['_id'] for c in upload_file.call_args_list]
+        self.assertEqual(uploaded, ['changed', 'new'])
+
+        # The manifest should be updated
+        write = conn.execute_many.call_args[0][0][0]
+        self.assertTrue(write.startswith(
+            "cat > /data/.cumulus_manifest.json <<'CUMULUS_EOF_"))
+        new_manifest = json.loads(write.split('\n')[1])
+        self.assertEqual(new_manifest, {
+            'same.txt': {'id': 'same', 'size': 10, 'mtime': '1.0'},
+            'changed.txt': {'id': 'changed', 'size': 5},
+            'new.txt': {'id': 'new', 'size': 1}
+        })
+
+    @mock.patch('cumulus.transport.files.download._import_file')
+    @mock.patch('cumulus.transport.files.download.GirderClient')
+    def test_download_path_sync(self, girder_client, import_file):
+        girder_client = girder_client.return_value
+        manifest = {
+            'same.txt': {'size': 10, 'mtime': '1.0', 'itemId': 'item1'},
+            'changed.txt': {'size': 5, 'mtime': '1.0', 'itemId': 'item2'}
+        }
+        girder_client.getFolder.return_value = {
+            'meta': {
+                MANIFEST_METADATA_KEY: manifest_to_list(manifest)
+            }
+        }
+        import_file.return_value = {'_id': 'new_item'}
+
+        conn = mock.MagicMock()
+        conn.execute_many.return_value = [
+            CommandResult('find', 0, ['same.txt\t10\t1.0',
+                                      'changed.txt\t5\t2.0',
+                                      'new.txt\t1\t2.0',
+                                      'skip.log\t1\t2.0'], [])
+        ]
+
+        download_path(conn, 'token', 'parent', '/data', 'sftp_assetstores',
+                      'assetstore', exclude=[r'.*\.log'], sync=True)
+
+        imported = [c[0][4] for c in import_file.call_args_list]
+        self.assertEqual(imported, ['changed.txt', 'new.txt'])
+        girder_client.delete.assert_called_once_with('item/item2')
+
+        (parent, metadata) = girder_client.addMetadataToFolder.call_args[0]
+        self.assertEqual(parent, 'parent')
+        self.assertEqual(
+            sorted(metadata[MANIFEST_METADATA_KEY], key=lambda e: e['path']),
+            [{'path': 'changed.txt', 'size': 5, 'mtime': '2.0',
+              'itemId': 'new_item'},
+             {'path': 'new.txt', 'size': 1, 'mtime': '2.0',
+              'itemId': 'new_item'},
+             {'path': 'same.txt', 'size': 10, 'mtime': '1.0',
+              'itemId': 'item1'}])
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import httmock
+import threading
+
+from cumulus.transport.transfer import chunk_ranges, parallel_put, \
+    PipelinedReader, RangeReader
+from cumulus.transport.files.upload import _upload_file
+from cumulus.transport.files.checkpoint import Checkpoint
+
+
+class FakeFile(object):
+    def __init__(self, sftp, mode):
+        self._sftp = sftp
+        self._offset = 0
+        if 'w' in mode:
+            del self._sftp.data[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def truncate(self, size):
+        del self._sftp.data[size:]
+        self._sftp.data.extend(b'\0' * (size - len(self._sftp.data)))
+
+    def seek(self, offset):
+        self._offset = offset
+
+    def flush(self):
+        pass
+
+    def stat(self):
+        pass
+
+    def write(self, data):
+        with self._sftp.lock:
+            self._sftp.data[self._offset:self._offset + len(data)] = data
+        self._offset += len(data)
+
+
+class FakeSftp(object):
+    def __init__(self, data, lock):
+        self.data = data
+        self.lock = lock
+        self.closed = False
+
+    def open(self, path, mode='r'):
+        return FakeFile(self, mode)
+
+    def close(self):
+        self.closed = True
+
+
+class TransferTestCase(unittest.TestCase):
+
+    def test_chunk_ranges(self):
+        self.assertEqual(list(chunk_ranges(10, 4)), [(0, 4), (4, 4), (8, 2)])
+        self.assertEqual(list(chunk_ranges(0, 4)), [])
+        self.assertEqual(list(chunk_ranges(10, 4, 4)), [(4, 4), (8, 2)])
+
+    def test_range_reader(self):
+        source = b'0123456789'
+        reader = RangeReader(lambda o, l: source[o:o + l], len(source),
+                             chunk_size=3)
+        self.assertEqual(reader.read(4), b'0123')
+        self.assertEqual(reader.read(), b'456789')
+        self.assertEqual(reader.read(1), b'')
+
+    def test_parallel_put(self):
+        source = bytes(bytearray(range(256))) * 100
+        data = bytearray()
+        lock = threading.Lock()
+        clients = []
+
+        def _open_sftp():
+            sftp = FakeSftp(data, lock)
+            clients.append(sftp)
+            return sftp
+
+        parallel_put(_open_sftp, lambda o, l: source[o:o + l], len(source),
+                     '/tmp/file', chunk_size=1000, concurrency=4)
+
+        self.assertEqual(bytes(data), source)
+        self.assertEqual(len(clients), 4)
+        self.assertTrue(all([c.closed for c in clients]))
+
+        # A short read should fail the transfer
+        with self.assertRaises(IOError):
+            parallel_put(_open_sftp, lambda o, l: source[o:o + l - 1],
+                         len(source), '/tmp/file', chunk_size=1000,
+                         concurrency=4)
+
+    def test_pipelined_reader(self):
+        source = b'0123456789'
+        sftp_file = mock.MagicMock()
+        sftp_file.readv.side_effect \
+            = lambda chunks: [source[o:o + l] for (o, l) in chunks]
+
+        reader = PipelinedReader(sftp_file, len(source), window=4)
+        self.assertEqual(reader.read(6), b'012345')
+        self.assertEqual(reader.read(), b'6789')
+        self.assertEqual(sftp_file.readv.call_args_list, [
+            mock.call([(0, 4)]), mock.call([(4, 4)]), mock.call([(8, 2)])])
+
+    def test_upload_file_ranges(self):
+        conn = mock.MagicMock()
+        girder_client = mock.MagicMock()
+        girder_client.urlBase = 'http://localhost/api/v1'
+        girder_client.token = 'token'
+        file = {
+            '_id': 'file_id',
+            'name': 'input.dat',
+            'size': 10
+        }
+
+        @httmock.urlmatch(path=r'^/api/v1/file/file_id/download$')
+        def _download(url, request):
+            params = dict(p.split('=') for p in url.query.split('&'))
+            content = b'0123456789'[int(params['offset']):
+                                    int(params['endByte'])]
+
+            return httmock.response(200, content, {}, request=request)
+
+        _upload_file(conn, girder_client, file, '/tmp')
+
+        (read_range, size, path) = conn.put_ranges.call_args[0]
+        self.assertEqual(size, 10)
+        self.assertEqual(path, '/tmp/input.dat')
+        with httmock.HTTMock(_download):
+            self.assertEqual(read_range(2, 3), b'234')
+
+    def test_parallel_put_resume(self):
+        source = bytes(bytearray(range(256))) * 100
+        # The previous attempt got as far as 3000 bytes
+        data = bytearray(source[:3000])
+        lock = threading.Lock()
+        offsets = []
+        progress = []
+
+        def _read_range(offset, length):
+            offsets.append(offset)
+            return source[offset:offset + length]
+
+        parallel_put(lambda: FakeSftp(data, lock), _read_range, len(source),
+                     '/tmp/file', chunk_size=1000, concurrency=4, offset=3000,
+                     progress=progress.append)
+
+        self.assertEqual(bytes(data), source)
+        self.assertEqual(min(offsets), 3000)
+        self.assertEqual(len(offsets), 23)
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], len(source))
+
+    def test_upload_file_checkpoint(self):
+        conn = mock.MagicMock()
+        girder_client = mock.MagicMock()
+        girder_client.urlBase = 'http://localhost/api/v1'
+        girder_client.token = 'token'
+        file = {
+            '_id': 'file_id',
+            'name': 'input.dat',
+            'size': 10
+        }
+        store = mock.MagicMock()
+        store.load.return_value = {
+            'source': 'folder_id',
+            'files': [{
+                'path': 'done.dat',
+                'id': 'file_id',
+                'size': 10,
+                'done': True
+            }, {
+                'path': 'input.dat',
+                'id': 'file_id',
+                'size': 10,
+                'offset': 4
+            }]
+        }
+        checkpoint = Checkpoint(store, 'folder_id')
+
+        _upload_file(conn, girder_client, file, '/tmp',
+                     checkpoint=checkpoint, key='done.dat')
+        self.assertFalse(conn.put_ranges.called)
+
+        _upload_file(conn, girder_client, file, '/tmp',
+                     checkpoint=checkpoint, key='input.dat')
+        self.assertEqual(checkpoint.get('input.dat'),
+                         {'id': 'file_id', 'size': 10, 'done': True})
+
+        # Progress is recorded against the file
+        kwargs = conn.put_ranges.call_args[1]
+        self.assertEqual(kwargs['offset'], 4)
+        kwargs['progress'](8)
+        self.assertEqual(checkpoint.get('input.dat'),
+                         {'id': 'file_id', 'size': 10, 'offset': 8})
@@ -27,7 +27,9 @@ from jsonpath_rw import parse
 import cumulus
 from cumulus.ssh.tasks import key
 from cumulus.transport import get_connection
-from cumulus.transport.ssh import SshClusterConnection
+from cumulus.transport.ssh import SshClusterConnection, READ_SIZE
+from cumulus.transport.pool import get_ssh_pool
+from cumulus.transport.batch import CommandResult
 
 class TransportTestCase(unittest.TestCase):
     def setUp(self):
@@ -36,12 +38,29 @@ class TransportTestCase(unittest.TestCase):
         with open(self._key_path, 'w') as fp:
             fp.write('bogus')
 
+        get_ssh_pool().clear()
+
     def tearDown(self):
+        get_ssh_pool().clear()
         try:
             os.remove(self._key_path)
         except OSError:
             pass
 
+    def _cluster(self):
+        return {
+            '_id': self._cluster_id,
+            'config': {
+                'ssh': {
+                    'user': 'bob',
+                    'key': self._cluster_id,
+                    'passphrase': 'test'
+                },
+                'host': 'localhost'
+            },
+            'type': 'trad'
+        }
+
     @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
     @mock.patch('cumulus.transport.ssh.paramiko.SSHClient.connect')
     def test_get_ssh_connection(self, connect, from_private_key_file):
@@ -61,4 +80,248 @@ class TransportTestCase(unittest.TestCase):
         with get_connection('girder_token', cluster) as ssh:
             self.assertTrue(isinstance(ssh, SshClusterConnection))
 
+    @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
+    @mock.patch('cumulus.transport.pool.SSHClient.get_transport')
+    @mock.patch('cumulus.transport.pool.SSHClient.connect')
+    def test_connection_pooled(self, connect, get_transport,
+                               from_private_key_file):
+        transport = get_transport.return_value
+        transport.is_active.return_value = True
+
+        cluster = self._cluster()
+        for _ in range(3):
+            with get_connection('girder_token', cluster) as ssh:
+                self.assertTrue(isinstance(ssh, SshClusterConnection))
+
+        # The connection and the decrypted key should be reused
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(from_private_key_file.call_count, 1)
+        transport.set_keepalive.assert_called_once_with(30)
+
+        # Now simulate the transport dying while idle in the pool
+        transport.is_active.return_value = False
+        with get_connection('girder_token', cluster):
+            pass
+
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(from_private_key_file.call_count, 1)
+
+    @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
+    @mock.patch('cumulus.transport.pool.SSHClient.get_transport')
+    @mock.patch('cumulus.transport.pool.SSHClient.connect')
+    def test_connection_discarded_on_error(self, connect, get_transport,
+                                           from_private_key_file):
+        get_transport.return_value.is_active.return_value = True
+
+        cluster = self._cluster()
+        with self.assertRaises(EOFError):
+            with get_connection('girder_token', cluster):
+                raise EOFError()
+
+        with get_connection('girder_token', cluster):
+            pass
+
+        # The connection that saw the error should not have been reused
+        self.assertEqual(connect.call_count, 2)
+
+    @mock.patch('cumulus.transport.pool.time.sleep')
+    @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
+    @mock.patch('cumulus.transport.pool.SSHClient.connect')
+    def test_connect_retry(self, connect, from_private_key_file, sleep):
+        connect.side_effect = [EOFError(), None]
+
+        with get_connection('girder_token', self._cluster()):
+            pass
+
+        self.assertEqual(connect.call_count, 2)
+
+    @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
+    @mock.patch('cumulus.transport.pool.SSHClient.get_transport')
+    @mock.patch('cumulus.transport.pool.SSHClient.connect')
+    def test_sftp_session_reused(self, connect, get_transport,
+                                 from_private_key_file):
+        transport = get_transport.return_value
+        transport.is_active.return_value = True
+        sftp = transport.open_sftp_client.return_value
+        sftp.get_channel.return_value.closed = False
+        sftp.stat.return_value.st_mode = 0o100644
+
+        with get_connection('girder_token', self._cluster()) as ssh:
+            ssh.stat('/a')
+            ssh.isfile('/b')
+            ssh.remove('/c')
+
+            self.assertEqual(transport.open_sftp_client.call_count, 1)
+
+            # Now kill the channel, the session should be reopened
+            sftp.get_channel.return_value.closed = True
+            sftp.stat.side_effect = [EOFError(), mock.DEFAULT]
+            ssh.stat('/a')
+
+            self.assertEqual(transport.open_sftp_client.call_count, 2)
+
+        # The session is closed with the connection
+        sftp.close.assert_called()
+
+    def _fake_channel(self):
+        class FakeChannel(object):
+            def __init__(self, stdout, stderr, exit_code=0):
+                self.stdout = list(stdout)
+                self.stderr = list(stderr)
+                self.exit_code = exit_code
+
+            def exec_command(self, command):
+                self.command = command
+
+            def recv_ready(self):
+                return len(self.stdout) > 0
+
+            def recv_stderr_ready(self):
+                return len(self.stderr) > 0
+
+            def recv(self, size):
+                return self.stdout.pop(0)
+
+            def recv_stderr(self, size):
+                return self.stderr.pop(0)
+
+            def exit_status_ready(self):
+                return not self.stdout and not self.stderr
+
+            def recv_exit_status(self):
+                return self.exit_code
+
+            def close(self):
+                pass
+
+        return FakeChannel
+
+    @mock.patch('cumulus.transport.ssh.profile_config',
+                return_value=(False, 0))
+    @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
+    @mock.patch('cumulus.transport.pool.SSHClient.get_transport')
+    @mock.patch('cumulus.transport.pool.SSHClient.connect')
+    def test_execute_stream(self, connect, get_transport,
+                            from_private_key_file, profile_config):
+        FakeChannel = self._fake_channel()
+        transport = get_transport.return_value
+        transport.is_active.return_value = True
+        transport.open_session.return_value = FakeChannel(
+            [b'out 1\nout', b' 2\n', b'partial'], [b'err 1\n', b'err 2\n'])
+
+        with get_connection('girder_token', self._cluster()) as ssh:
+            output = list(ssh.execute_stream('ls'))
+            # Both streams should be read as data arrives
+            self.assertEqual(output, [
+                ('stdout', 'out 1\n'), ('stderr', 'err 1\n'),
+                ('stdout', 'out 2\n'), ('stderr', 'err 2\n'),
+                ('stdout', 'partial')])
+
+            transport.open_session.return_value = FakeChannel(
+                [b'out 1\nout', b' 2\n', b'partial'], [b'err 1\n'])
+            self.assertEqual(ssh.execute('ls'),
+                             ['out 1\n', 'out 2\n', 'partial', 'err 1\n'])
+
+            # Reading stops at max_bytes and only complete lines are returned
+            transport.open_session.return_value = FakeChannel(
+                [b'out 1\nout', b' 2\n'], [])
+            output = list(ssh.execute_stream('ls', max_bytes=8))
+            self.assertEqual(output, [('stdout', 'out 1\n')])
+
+            # Output of exactly max_bytes isn't truncated
+            transport.open_session.return_value = FakeChannel(
+                [b'out 1\nout 2\n'], [])
+            output = list(ssh.execute_stream('ls', max_bytes=12))
+            self.assertEqual(output, [('stdout', 'out 1\n'),
+                                      ('stdout', 'out 2\n')])
+
+            # A line longer than a read is still returned as one line, the
+            # tail of job output counts them.
+            long_line = b'x' * (READ_SIZE + 10)
+            transport.open_session.return_value = FakeChannel(
+                [long_line[:READ_SIZE], long_line[READ_SIZE:] + b'\nnext\n'],
+                [])
+            output = list(ssh.execute_stream('ls'))
+            self.assertEqual(output, [('stdout', long_line.decode() + '\n'),
+                                      ('stdout', 'next\n')])
+
+            transport.open_session.return_value = FakeChannel(
+                [b'out 1\n'], [b'error\n'], exit_code=1)
+            with self.assertRaises(Exception):
+                ssh.execute('ls', ignore_exit_status=True)
+
+    @mock.patch('cumulus.transport.ssh.new_marker', return_value='MARKER')
+    @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
+    @mock.patch('cumulus.transport.pool.SSHClient.get_transport')
+    @mock.patch('cumulus.transport.pool.SSHClient.connect')
+    def test_profile_snapshot(self, connect, get_transport,
+                              from_private_key_file, new_marker):
+        FakeChannel = self._fake_channel()
+        transport = get_transport.return_value
+        transport.is_active.return_value = True
+        channels = []
+
+        def _open_session():
+            if not channels:
+                chan = FakeChannel([b'HOME=/home/bob\0PATH=/bin\0MARKER\0',
+                                    b'HOME=/home/bob\0PATH=/opt/sge/bin:/bin'
+                                    b'\0SGE_ROOT=/opt/sge\0SHLVL=2\0'], [])
+            else:
+                chan = FakeChannel([b'ok\n'], [])
+            channels.append(chan)
+
+            return chan
+        transport.open_session.side_effect = _open_session
+
+        cluster = self._cluster()
+        for _ in range(2):
+            with get_connection('girder_token', cluster) as ssh:
+                self.assertEqual(ssh.execute('qstat'), ['ok\n'])
+                self.assertEqual(ssh.execute('ps', source_profile=False),
+                                 ['ok\n'])
+
+        # The profile is only sourced once for the pooled connection
+        self.assertEqual(len(channels), 5)
+        self.assertIn('source /etc/profile', channels[0].command)
+        prefix = "export PATH=/opt/sge/bin:/bin SGE_ROOT=/opt/sge && "
+        self.assertEqual([c.command for c in channels[1:]],
+                         [prefix + 'qstat', 'ps'] * 2)
+
+        # Once the snapshot has expired it is taken again
+        with mock.patch('cumulus.transport.ssh.profile_config',
+                        return_value=(True, -1)):
+            del channels[:]
+            with get_connection('girder_token', cluster) as ssh:
+                ssh.execute('qstat')
+            self.assertEqual(len(channels), 2)
+
+    @mock.patch('cumulus.transport.ssh.SshClusterConnection.execute_many')
+    @mock.patch('cumulus.transport.ssh.paramiko.RSAKey.from_private_key_file')
+    @mock.patch('cumulus.transport.pool.SSHClient.get_transport')
+    @mock.patch('cumulus.transport.pool.SSHClient.connect')
+    def test_makedirs(self, connect, get_transport, from_private_key_file,
+                      execute_many):
+        get_transport.return_value.is_active.return_value = True
+        execute_many.return_value = [
+            CommandResult('mkdir -p /a/b/c', 0, [], [])]
+
+        with get_connection('girder_token', self._cluster()) as ssh:
+            ssh.makedirs('/a/b/c/')
+            execute_many.assert_called_once_with(['mkdir -p /a/b/c'],
+                                                 source_profile=False)
+
+            # Already known to exist
+            ssh.makedirs('/a/b/c')
+            ssh.makedirs('/a/b')
+            self.assertEqual(execute_many.call_count, 1)
+
+            ssh.makedirs('/a/b/d')
+            self.assertEqual(execute_many.call_count, 2)
 
+            execute_many.return_value = [
+                CommandResult('mkdir -p /x', 1, [], ['Permission denied'])]
+            with self.assertRaises(Exception):
+                ssh.makedirs('/x')
+            # A failure is not cached
+            with self.assertRaises(Exception):
+                ssh.makedirs('/x')
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import httmock
+import io
+import tarfile
+import requests
+
+from cumulus.transport.files.upload import upload_path
+
+
+class UploadTestCase(unittest.TestCase):
+
+    @mock.patch('cumulus.transport.files.upload.GirderClient')
+    def test_upload_path_bulk(self, girder_client):
+        girder_client = girder_client.return_value
+        girder_client.urlBase = 'http://localhost/api/v1'
+        girder_client.token = 'token'
+        girder_client.listItem.side_effect \
+            = lambda folder_id: iter([{'_id': 'item_%s' % folder_id}])
+        girder_client.listFolder.side_effect = lambda folder_id: iter(
+            [{'_id': 'sub', 'name': 'subfolder'}] if folder_id == 'root'
+            else [])
+        girder_client.get.side_effect = lambda path, parameters: [{
+            '_id': path.split('/')[1],
+            'name': '%s.txt' % path.split('/')[1],
+            'size': 4
+        }]
+
+        @httmock.urlmatch(path=r'^/api/v1/file/item_\w+/download$')
+        def _download(url, request):
+            response = requests.Response()
+            response.status_code = 200
+            response.raw = io.BytesIO(b'data')
+
+            return response
+
+        cluster_connection = mock.MagicMock()
+        cmd = cluster_connection.open_command.return_value.__enter__.return_value
+        tar_stream = io.BytesIO()
+        cmd.stdin.write.side_effect = tar_stream.write
+
+        with httmock.HTTMock(_download):
+            upload_path(cluster_connection, 'token', 'root', '/tmp/input',
+                        bulk=True)
+
+        self.assertEqual(cluster_connection.open_command.call_args[0][0],
+                         'mkdir -p /tmp/input && tar -xf - -C /tmp/input')
+        self.assertFalse(cluster_connection.put.called)
+        cmd.close_stdin.assert_called_once_with()
+        cmd.wait.assert_called_once_with()
+
+        tar_stream.seek(0)
+        with tarfile.open(mode='r', fileobj=tar_stream) as tar:
+            names = [(m.name, m.isdir()) for m in tar.getmembers()]
+            self.assertEqual(names, [('item_root.txt', False),
+                                     ('subfolder', True),
+                                     ('subfolder/item_sub.txt', False)])
+            self.assertEqual(
+                tar.extractfile('subfolder/item_sub.txt').read(), b'data')
+
+    def test_upload_path_bulk_fallback(self):
+        cluster_connection = mock.MagicMock()
+        cluster_connection.open_command.side_effect = NotImplementedError
+
+        with mock.patch('cumulus.transport.files.upload._upload_path') \
+                as _upload_path:
+            upload_path(cluster_connection, 'token', 'root', '/tmp/input',
+                        bulk=True)
+            self.assertTrue(_upload_path.called)
+
+        cluster_connection.makedirs.assert_called_once_with('/tmp/input')
+
+    @mock.patch('cumulus.transport.files.upload.GirderClient')
+    def test_upload_path_mkdir_failure(self, girder_client):
+        girder_client = girder_client.return_value
+        girder_client.listItem.return_value = iter([])
+        girder_client.listFolder.side_effect = lambda folder_id: iter(
+            [{'_id': 'sub', 'name': 'subfolder'}] if folder_id == 'root'
+            else [])
+
+        cluster_connection = mock.MagicMock()
+        # The destination may already exist, but a real failure to create a
+        # folder must not be ignored.
+        cluster_connection.makedirs.side_effect = [
+            None, IOError('Permission denied')]
+
+        with self.assertRaises(IOError):
+            upload_path(cluster_connection, 'token', 'root', '/tmp/input')
+
+        self.assertEqual(cluster_connection.makedirs.call_args_list, [
+            mock.call('/tmp/input'), mock.call('/tmp/input/subfolder')])
+        cluster_connection.mkdir.assert_not_called()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import os
+import shutil
+import stat
+import tempfile
+
+from cumulus.transport.walk import parse_entries, walk_command
+
+from .batch_test import LocalConnection
+
+
+class WalkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self._dir, 'sub', 'nested'))
+        for (path, data) in [('a.txt', 'a'), ('sub/b\tc.txt', 'bb'),
+                             ('sub/nested/d\ne.txt', 'ddd')]:
+            with open(os.path.join(self._dir, path), 'w') as fp:
+                fp.write(data)
+        os.chmod(os.path.join(self._dir, 'a.txt'), 0o640)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_walk(self):
+        conn = LocalConnection()
+        entries = {e['path']: e for e in conn.walk(self._dir)}
+
+        self.assertEqual(conn.calls, 1)
+        self.assertEqual(sorted(entries), ['a.txt', 'sub', 'sub/b\tc.txt',
+                                           'sub/nested',
+                                           'sub/nested/d\ne.txt'])
+        self.assertEqual(entries['a.txt']['mode'], stat.S_IFREG | 0o640)
+        self.assertEqual(entries['a.txt']['size'], 1)
+        self.assertEqual(entries['a.txt']['mtime'],
+                         os.stat(os.path.join(self._dir, 'a.txt')).st_mtime)
+        self.assertTrue(stat.S_ISDIR(entries['sub/nested']['mode']))
+        self.assertEqual(entries['sub/nested/d\ne.txt']['name'], 'd\ne.txt')
+        self.assertEqual(entries['sub/nested/d\ne.txt']['size'], 3)
+
+    def test_walk_max_depth(self):
+        conn = LocalConnection()
+        paths = sorted(e['path'] for e in conn.walk(self._dir, max_depth=1))
+
+        self.assertEqual(paths, ['a.txt', 'sub'])
+
+    def test_walk_command(self):
+        self.assertEqual(walk_command('/my path', max_depth=1),
+                         "find '/my path' -mindepth 1 -maxdepth 1 -printf "
+                         "'%y\\t%s\\t%T@\\t%m\\t%P\\0'")
+
+    def test_parse_entries(self):
+        # Entries can be split across chunks
+        chunks = [b'f\t10\t1.5\t644\ta', b'.txt\0d\t4096\t2.0\t755\tsub\0',
+                  b'bad entry\0']
+        entries = list(parse_entries(iter(chunks)))
+
+        self.assertEqual(entries, [{
+            'path': 'a.txt',
+            'name': 'a.txt',
+            'mode': stat.S_IFREG | 0o644,
+            'size': 10,
+            'mtime': 1.5
+        }, {
+            'path': 'sub',
+            'name': 'sub',
+            'mode': stat.S_IFDIR | 0o755,
+            'size': 4096,
+            'mtime': 2.0
+        }])